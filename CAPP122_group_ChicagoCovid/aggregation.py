@@ -0,0 +1,154 @@
+'''
+This module aggregates the daily vaccine and weekly case numbers by zip
+code over ISO weeks and rolling day windows
+
+Every function works on all zip codes at once: rows are sorted by a
+(zip code, day ordinal) key and window sums are read off a single
+cumulative sum, so there are no per-zip loops.
+'''
+
+import numpy as np
+import pandas as pd
+import schema
+
+WINDOWS = [7, 14, 28]
+PER_POPULATION = 100000
+
+VACCINE_DAILY = ["total_doses_daily",
+                 "_1st_dose_daily",
+                 "vaccine_series_completed_daily"]
+
+CASE_WEEKLY = ["cases_weekly",
+               "tests_weekly",
+               "deaths_weekly"]
+
+EPOCH = pd.Timestamp("1970-01-05") # first ISO Monday after the unix epoch
+
+
+def day_ordinal(dates):
+    '''
+    Counts the days elapsed since EPOCH
+
+    Inputs:
+        dates: pandas Series of datetimes
+    Returns:
+        numpy array of int32
+    '''
+    return ((dates - EPOCH).dt.days).to_numpy(dtype="int32")
+
+
+def week_ordinal(dates):
+    '''
+    Counts the ISO weeks elapsed since EPOCH, so that consecutive weeks
+    are consecutive integers across years
+
+    Inputs:
+        dates: pandas Series of datetimes
+    Returns:
+        numpy array of int32
+    '''
+    return day_ordinal(dates) // 7
+
+
+def add_iso_week(df, date_name):
+    '''
+    Adds the ISO year, ISO week number and week ordinal of a date column
+
+    Inputs:
+        df (Pandas DataFrame): Set of interest
+        date_name (str): Name of the column containing dates
+    Returns:
+        Pandas DataFrame with year, week_number and week_ordinal columns
+    '''
+    iso = df[date_name].dt.isocalendar()
+    df = df.copy()
+    df["year"] = iso.year.astype(schema.YEAR)
+    df["week_number"] = iso.week.astype(schema.WEEK)
+    df["week_ordinal"] = week_ordinal(df[date_name])
+    return df
+
+
+def weekly_rollup(df, agg_funs, date_name, zip_name = "zip_code"):
+    '''
+    Aggregates daily rows into ISO year-weeks by zip code
+
+    Inputs:
+        df (Pandas DataFrame): daily data
+        agg_funs (dict): aggregation function by column
+        date_name (str): Name of the column containing dates
+        zip_name (str): Name of the column containing zip codes
+    Returns:
+        Pandas DataFrame with one row per zip code and ISO week
+    '''
+    df = add_iso_week(df, date_name)
+    weekly = df.groupby([zip_name, "year", "week_number"], observed = True,
+                        sort = False).agg(agg_funs)
+    weekly = weekly.reset_index().sort_values([zip_name, "year",
+                                               "week_number"])
+    return weekly.reset_index(drop = True)
+
+
+def window_sums(keys, cumsum, length, offset = 0):
+    '''
+    Sums the values whose key lies in (key - offset - length, key - offset]
+    for every key, using a cumulative sum over the sorted keys
+
+    Inputs:
+        keys: sorted numpy array of int64 (zip code, day) keys
+        cumsum: numpy array (n + 1, k), cumulative sums with a leading 0 row
+        length (int): window length in days
+        offset (int): days between each row and the end of its window
+    Returns:
+        numpy array (n, k)
+    '''
+    end = np.searchsorted(keys, keys - offset, side = "right")
+    start = np.searchsorted(keys, keys - offset - length, side = "right")
+    return cumsum[end] - cumsum[start]
+
+
+def rolling_windows(df, columns, date_name, zip_name = "zip_code",
+                    windows = WINDOWS, pop_name = "population"):
+    '''
+    Computes rolling sums, rates per 100,000 residents and growth over the
+    previous window for every zip code, day and window length
+
+    Inputs:
+        df (Pandas DataFrame): daily or weekly data
+        columns (list): count columns to aggregate
+        date_name (str): Name of the column containing dates
+        zip_name (str): Name of the column containing zip codes
+        windows (list): window lengths in days
+        pop_name (str): Name of the column containing population
+    Returns:
+        Pandas DataFrame with zip code, date, day_ordinal and, for each
+        column c and window w, c_wd, c_wd_rate and c_wd_growth
+    '''
+    days = day_ordinal(df[date_name])
+    zip_codes, _ = pd.factorize(df[zip_name], sort = True)
+
+    # Keys of different zip codes are further apart than any window
+    span = int(days.max()) - int(days.min()) + 2 * max(windows) + 1
+    keys = zip_codes.astype("int64") * span + (days - days.min())
+    order = np.argsort(keys, kind = "stable")
+    keys = keys[order]
+
+    values = df[columns].astype("float64").fillna(0).to_numpy()[order]
+    cumsum = np.vstack([np.zeros((1, len(columns))),
+                        np.cumsum(values, axis = 0)])
+    population = df[pop_name].astype("float64").to_numpy()[order]
+
+    result = df[[zip_name, date_name]].iloc[order].reset_index(drop = True)
+    result["day_ordinal"] = days[order]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        for length in windows:
+            current = window_sums(keys, cumsum, length)
+            previous = window_sums(keys, cumsum, length, offset = length)
+            rate = current / population[:, None] * PER_POPULATION
+            growth = np.where(previous > 0, current / previous - 1, np.nan)
+            for i, col in enumerate(columns):
+                name = "{}_{}d".format(col, length)
+                result[name] = current[:, i]
+                result[name + "_rate"] = rate[:, i]
+                result[name + "_growth"] = growth[:, i]
+
+    return result
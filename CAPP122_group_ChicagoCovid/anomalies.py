@@ -0,0 +1,238 @@
+'''
+This module keeps running statistics of the weekly cases, test positivity
+and deaths of every zip code, and flags the weeks that fall outside their
+expected band
+
+The state of each zip code and variable holds the count, mean and sum of
+squared deviations of Welford's algorithm, an exponentially weighted mean
+and variance, and a ring buffer of the last RING_SIZE values. A new week
+updates it in constant time, so a daily run costs time proportional to the
+new rows of covid_case_num, not to their history. The rows are new when
+they were loaded after the last run, whatever their week: a zip code that
+reports late, or a week backfilled into a gap, is folded in on arrival.
+
+Run after build_sql_database:
+    python anomalies.py
+'''
+
+import warnings
+import numpy as np
+import pandas as pd
+import schema
+import sqlite_store
+
+TRACKED = ["cases_weekly", "percent_tested_positive_weekly", "deaths_weekly"]
+
+ALPHA = 0.3 # weight of the newest week in the moving mean and variance
+BAND = 3.0 # half width of the expected band, in moving standard deviations
+MIN_SD_SHARE = 0.1 # floor of the moving standard deviation, share of mean
+MIN_HISTORY = 4 # weeks seen before a zip code can be flagged
+RING_SIZE = 8
+
+RING = ["ring_{}".format(i) for i in range(RING_SIZE)]
+STATE_COLUMNS = ["n", "mean", "m2", "ewma", "ewvar", "ring_pos",
+                 "last_week_end", "last_loaded_at"] + RING
+
+NEW_ROWS_QUERY = """
+    SELECT zip_code, week_end, loaded_at, {}
+    FROM covid_case_num
+    {}
+    """
+
+
+def empty_state(keys):
+    '''
+    Builds the state of zip codes and variables never seen
+
+    Inputs:
+        keys: pandas MultiIndex of zip_code and variable
+    Returns:
+        pandas DataFrame indexed by keys
+    '''
+    state = pd.DataFrame(np.nan, index=keys, columns=STATE_COLUMNS)
+    state[["n", "m2", "ewvar", "ring_pos"]] = 0
+    state[["last_week_end", "last_loaded_at"]] = pd.NaT
+    return state
+
+
+def fold_week(arrays, rows, x):
+    '''
+    Flags one week of values against the state, then folds them into it
+
+    Inputs:
+        arrays: dictionary of the state columns as numpy arrays, updated
+            in place
+        rows: numpy array, positions in the state of the observations
+        x: numpy array, the observed values
+    Returns:
+        dictionary of the columns of the flags of the week
+    '''
+    n = arrays["n"][rows]
+    ewma = arrays["ewma"][rows]
+    ewvar = arrays["ewvar"][rows]
+    ring = arrays["ring"][rows]
+
+    sd = np.maximum(np.sqrt(ewvar), MIN_SD_SHARE * np.abs(ewma))
+    lower, upper = ewma - BAND * sd, ewma + BAND * sd
+    ready = n >= MIN_HISTORY
+    flag = np.where(ready & (x > upper), "high",
+                    np.where(ready & (x < lower), "low", ""))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zscore = np.where(sd > 0, (x - ewma) / sd, 0)
+    with warnings.catch_warnings():
+        # zip codes seen for the first time have an empty ring
+        warnings.simplefilter("ignore", RuntimeWarning)
+        recent = np.nanmedian(ring, axis=1)
+
+    # Welford's update of the mean and sum of squared deviations
+    n = n + 1
+    mean = np.where(n == 1, x, arrays["mean"][rows])
+    delta = x - mean
+    mean = mean + delta / n
+    arrays["m2"][rows] += delta * (x - mean)
+    arrays["mean"][rows] = mean
+    arrays["n"][rows] = n
+
+    # exponentially weighted mean and variance
+    first = n == 1
+    diff = np.where(first, 0, x - ewma)
+    increment = ALPHA * diff
+    arrays["ewma"][rows] = np.where(first, x, ewma + increment)
+    arrays["ewvar"][rows] = np.where(first, 0,
+                                     (1 - ALPHA) * (ewvar + diff * increment))
+
+    pos = arrays["ring_pos"][rows].astype("int64")
+    arrays["ring"][rows, pos] = x
+    arrays["ring_pos"][rows] = (pos + 1) % RING_SIZE
+
+    return {"value": x, "expected": ewma, "lower": lower, "upper": upper,
+            "zscore": zscore, "recent_median": recent, "flag": flag}
+
+
+def update(state, rows):
+    '''
+    Folds new weekly rows into the running statistics, one week at a time,
+    and flags the rows outside their expected band
+
+    Inputs:
+        state: pandas DataFrame of anomaly_state, None on the first run
+        rows: pandas DataFrame with zip_code, week_end, loaded_at and the
+            TRACKED columns; rows loaded no later than the last row folded
+            into their zip code and variable are skipped
+    Returns:
+        (pandas DataFrame of the new state, pandas DataFrame of the flags
+        of the new rows)
+    '''
+    long = rows.melt(id_vars=["zip_code", "week_end", "loaded_at"],
+                     value_vars=TRACKED,
+                     var_name="variable").dropna(subset=["value"])
+    long["zip_code"] = long["zip_code"].astype(str)
+    long["week_end"] = pd.to_datetime(long["week_end"])
+    long["loaded_at"] = pd.to_datetime(long["loaded_at"])
+    long = long.drop_duplicates(["zip_code", "variable", "week_end"],
+                                keep="last")
+
+    keys = pd.MultiIndex.from_frame(long[["zip_code", "variable"]])
+    if state is None:
+        state = empty_state(keys.unique())
+    else:
+        state = state.astype({"zip_code": str, "variable": str}). \
+            set_index(["zip_code", "variable"])
+        state = pd.concat([state, empty_state(keys.unique().difference(
+            state.index))])
+
+    positions = state.index.get_indexer(keys)
+    last = state["last_loaded_at"].to_numpy()[positions]
+    new = ~(long["loaded_at"].to_numpy() <= last)
+    long, positions = long[new], positions[new]
+
+    arrays = {col: state[col].to_numpy(dtype="float64", copy=True)
+              for col in ["n", "mean", "m2", "ewma", "ewvar", "ring_pos"]}
+    arrays["ring"] = state[RING].to_numpy(dtype="float64", copy=True)
+    last_week_end = state["last_week_end"].to_numpy(copy=True)
+    last_loaded_at = state["last_loaded_at"].to_numpy(copy=True)
+
+    flags = []
+    week_ends = long["week_end"].to_numpy()
+    loaded = long["loaded_at"].to_numpy()
+    values = long["value"].to_numpy(dtype="float64")
+    for week_end in np.unique(week_ends):
+        in_week = week_ends == week_end
+        rows_of_week = positions[in_week]
+        week = fold_week(arrays, rows_of_week, values[in_week])
+        # a backfilled week does not move the latest week back
+        last_week_end[rows_of_week] = np.fmax(last_week_end[rows_of_week],
+                                              week_end)
+        last_loaded_at[rows_of_week] = np.fmax(last_loaded_at[rows_of_week],
+                                               loaded[in_week])
+        flags.append(pd.DataFrame({"zip_code": long["zip_code"].
+                                   to_numpy()[in_week],
+                                   "variable": long["variable"].
+                                   to_numpy()[in_week],
+                                   "week_end": week_end, **week}))
+
+    for col in ["n", "mean", "m2", "ewma", "ewvar", "ring_pos"]:
+        state[col] = arrays[col]
+    state[RING] = arrays["ring"]
+    state["last_week_end"] = last_week_end
+    state["last_loaded_at"] = last_loaded_at
+
+    state = schema.apply_schema(state.reset_index(), "anomaly_state")
+    if flags:
+        flags = pd.concat(flags, ignore_index=True)
+    else:
+        flags = pd.DataFrame(columns=["zip_code", "variable", "week_end",
+                                      "value", "expected", "lower", "upper",
+                                      "zscore", "recent_median", "flag"])
+    return state, schema.apply_schema(flags, "anomaly_flags")
+
+
+def new_case_rows(since=None, path=sqlite_store.DATABASE_PATH):
+    '''
+    Reads the weekly case rows loaded after a time from the sqlite3
+    database
+
+    Inputs:
+        since: pandas Timestamp, None to read every row
+        path: str, path of the sqlite3 database
+    Returns:
+        pandas DataFrame with zip_code, week_end, loaded_at and the TRACKED
+        columns
+    '''
+    columns = ", ".join(TRACKED)
+    if since is None or pd.isna(since):
+        query, params = NEW_ROWS_QUERY.format(columns, ""), ()
+    else:
+        query = NEW_ROWS_QUERY.format(columns, "WHERE loaded_at > ?")
+        params = (pd.Timestamp(since).strftime(sqlite_store.LOADED_AT_FORMAT),)
+    return sqlite_store.reader_pool(path).query(query, params)
+
+
+def update_from_database(path=sqlite_store.DATABASE_PATH):
+    '''
+    Folds the rows loaded since the last run into the latest state, and
+    writes the new state and the flags of the new rows to databases/
+
+    Returns:
+        pandas DataFrame of the flags of the new rows
+    '''
+    date = schema.latest_snapshot("anomaly_state")
+    state, since = None, None
+    if date is not None:
+        state = schema.read_database("anomaly_state", date)
+        # the last load folded in: every row loaded after it is new, even
+        # a late or backfilled week older than the newest week seen
+        since = state["last_loaded_at"].max()
+
+    state, flags = update(state, new_case_rows(since, path))
+    if flags.empty:
+        # nothing new, keep the flags of the last run that had some
+        return flags
+    schema.write_database(state, "anomaly_state")
+    schema.write_database(flags, "anomaly_flags")
+    return flags
+
+
+if __name__ == "__main__":
+    flags = update_from_database()
+    print(len(flags), "new weeks,", (flags["flag"] != "").sum(), "flagged")
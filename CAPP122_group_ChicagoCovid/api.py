@@ -0,0 +1,532 @@
+'''
+This module serves the processed data as a JSON API over ASGI, so that
+other consumers (and eventually the dashboard) no longer parse the csv
+files of databases/ themselves
+
+    GET /cross_section   [zip_code]
+    GET /latest          [zip_code]
+    GET /time_series     zip_code [start, end, variables]
+    GET /predictions     variable [zip_code]
+    GET /neighbors       zip_code, variable [k]
+    GET /trends          [zip_code, variable]
+    GET /windows         zip_code [kind]
+
+Run it with any ASGI server, e.g.
+
+    uvicorn api:app
+
+The event loop never blocks: file and database reads run in a thread pool
+and model fits in a process pool. Results are cached for the current data
+version, concurrent identical requests share one computation, and every
+response carries an ETag so that clients can revalidate with a 304.
+'''
+
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import functools
+import hashlib
+import json
+import os
+import time
+import urllib.parse
+import data_analyzing as da
+import data_modeling as dm
+import schema
+import sqlite_store
+
+THREADS = concurrent.futures.ThreadPoolExecutor(max_workers=16)
+PROCESS_WORKERS = os.cpu_count()
+
+# seconds between two checks for newly published data
+VERSION_TTL = 2.0
+
+MAX_NEIGHBORS = 50
+
+# the rolling 7, 14 and 28 day windows written by data_processing
+WINDOW_KINDS = {"cases": "case_windows", "vaccines": "vaccine_windows"}
+
+TS_KEYS = ["zip_code", "week_number", "week_end"]
+
+TS_QUERY = """
+    SELECT {}
+    FROM ts_joint
+    WHERE zip_code = ? AND date(week_end) BETWEEN ? AND ?
+    ORDER BY week_end;
+    """
+
+# the latest_*_by_zip tables are rebuilt by materialized_tables.sql when
+# new weeks load, so the latest week is one indexed lookup per zip code
+LATEST_TABLES = ["latest_case_by_zip", "latest_vaccine_by_zip"]
+
+LATEST_QUERY = """
+    SELECT c.*,
+       v.total_doses_daily,
+       v.total_doses_cumulative,
+       v._1st_dose_daily,
+       v._1st_dose_cumulative,
+       v._1st_dose_percent_population,
+       v.vaccine_series_completed_daily,
+       v.vaccine_series_completed_cumulative,
+       v.vaccine_series_completed_percent_population,
+       v.date
+    FROM latest_case_by_zip AS c
+    LEFT JOIN latest_vaccine_by_zip AS v ON v.zip_code = c.zip_code
+    WHERE ? = '' OR c.zip_code = ?
+    ORDER BY c.zip_code;
+    """
+
+
+class APIError(Exception):
+    '''
+    An error reported to the client with an HTTP status
+    '''
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Memo:
+    '''
+    Caches the results of coroutines by key for one data version, evicting
+    the least recently used. Callers asking for a key that is still being
+    computed wait for the same result instead of computing it again.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.version = None
+        self._tasks = collections.OrderedDict()
+
+    async def get(self, version, key, compute):
+        '''
+        Returns the cached result of key, calling compute() on a miss
+
+        Inputs:
+            version: tuple, data version, a new one clears the cache
+            key: hashable
+            compute: function returning a coroutine
+        '''
+        if version != self.version:
+            self.version = version
+            self._tasks.clear()
+
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._tasks[key] = task
+            if len(self._tasks) > self.size:
+                self._tasks.popitem(last=False)
+        else:
+            self._tasks.move_to_end(key)
+
+        try:
+            # a client hanging up must not cancel the shared task
+            return await asyncio.shield(task)
+        except APIError:
+            raise
+        except Exception:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+            raise
+
+
+FRAMES = Memo(size=64)
+RESPONSES = Memo(size=4096)
+
+_processes = None
+_version = (0.0, None)
+
+
+def processes():
+    '''
+    Returns the process pool of the CPU-bound work, started on first use
+    '''
+    global _processes
+    if _processes is None:
+        _processes = concurrent.futures.ProcessPoolExecutor(PROCESS_WORKERS)
+    return _processes
+
+
+async def in_thread(fun, *args, **kwargs):
+    '''
+    Runs a blocking function in the thread pool
+    '''
+    call = functools.partial(fun, *args, **kwargs)
+    return await asyncio.get_event_loop().run_in_executor(THREADS, call)
+
+
+async def in_process(fun, *args):
+    '''
+    Runs a CPU-bound function in the process pool
+    '''
+    return await asyncio.get_event_loop().run_in_executor(processes(), fun,
+                                                          *args)
+
+
+def read_version():
+    '''
+    Identifies the data currently published: the date of the newest cross
+    section snapshot, the last write to the sqlite3 database and the date
+    of the newest trends
+    '''
+    stamps = []
+    for path in [sqlite_store.DATABASE_PATH, sqlite_store.DATABASE_PATH
+                 + "-wal"]:
+        try:
+            stamps.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            stamps.append(0)
+    return (schema.latest_snapshot("cross_section"), *stamps,
+            schema.latest_snapshot("ts_trends"))
+
+
+async def data_version():
+    '''
+    Returns the current data version, a tuple checked at most every
+    VERSION_TTL seconds
+    '''
+    global _version
+    checked, version = _version
+    now = time.monotonic()
+    if version is None or now - checked > VERSION_TTL:
+        version = await in_thread(read_version)
+        _version = (now, version)
+    return version
+
+
+def snapshot_date(version):
+    '''
+    Extracts the cross section snapshot date from a data version
+    '''
+    if version[0] is None:
+        raise APIError(503, "No cross section snapshot was published")
+    return version[0]
+
+
+async def cross_section(version):
+    '''
+    The latest cross section, indexed by zip code
+    '''
+    async def load():
+        return await in_thread(schema.read_database, "cross_section",
+                               snapshot_date(version), index_col=0)
+    return await FRAMES.get(version, ("cross_section",), load)
+
+
+async def ts_columns(version):
+    '''
+    The columns of the joint time series table
+    '''
+    def read_columns():
+        info = sqlite_store.reader_pool().query("PRAGMA table_info(ts_joint)")
+        return list(info["name"])
+
+    async def load():
+        columns = await in_thread(read_columns)
+        if not columns:
+            raise APIError(503, "The time series table was not built")
+        return columns
+    return await FRAMES.get(version, ("ts_columns",), load)
+
+
+async def predictions(version, var):
+    '''
+    The predictions by majority race of one outcome for every zip code
+    '''
+    async def load():
+        dataset = await cross_section(version)
+        return await in_process(dm.predict_outcome, dataset, var)
+    return await FRAMES.get(version, ("predictions", var), load)
+
+
+def require(params, name):
+    '''
+    Returns a query parameter, reporting a missing one to the client
+    '''
+    if not params.get(name):
+        raise APIError(400, "Missing query parameter {}".format(name))
+    return params[name]
+
+
+def date_param(params, name, default):
+    '''
+    Returns a query parameter holding a YYYY-MM-DD date
+    '''
+    if name not in params:
+        return default
+    try:
+        return str(datetime.date.fromisoformat(params[name]))
+    except ValueError:
+        raise APIError(400, "{} must be a YYYY-MM-DD date".format(name))
+
+
+async def check_variable(version, var):
+    '''
+    Reports variables that are not outcomes of the cross section
+    '''
+    dataset = await cross_section(version)
+    outcomes = [col for col in dataset.columns
+                if not col.startswith(("majority", "population"))]
+    if var not in outcomes:
+        raise APIError(400, "Unknown variable {}".format(var))
+
+
+async def get_cross_section(version, params):
+    '''
+    Every variable of the cross section, for one or all zip codes
+    '''
+    df = await cross_section(version)
+    if params.get("zip_code"):
+        df = df[df.index == params["zip_code"]]
+        if df.empty:
+            raise APIError(404, "zipcode not in Chicago")
+    return df.rename_axis("zip_code").reset_index()
+
+
+def read_latest(zip_code):
+    '''
+    Reads the latest rows of one zip code, or of all if zip_code is empty,
+    from the materialized tables
+
+    Returns:
+        pandas DataFrame, or None if the tables were not built
+    '''
+    pool = sqlite_store.reader_pool()
+    tables = pool.query("SELECT name FROM sqlite_master WHERE type = 'table'")
+    if not set(LATEST_TABLES) <= set(tables["name"]):
+        return None
+    df = pool.query(LATEST_QUERY, (zip_code, zip_code))
+    return df.drop(columns=["week_rank", sqlite_store.LOADED_AT],
+                   errors="ignore")
+
+
+async def get_latest(version, params):
+    '''
+    The latest week of cases and of vaccines, for one or all zip codes
+    '''
+    df = await in_thread(read_latest, params.get("zip_code", ""))
+    if df is None:
+        raise APIError(503, "The latest week tables were not built")
+    if df.empty and params.get("zip_code"):
+        raise APIError(404, "zipcode not in Chicago")
+    return df
+
+
+async def get_time_series(version, params):
+    '''
+    The weekly cases and vaccines of a zip code between two dates
+    '''
+    zip_code = require(params, "zip_code")
+    columns = await ts_columns(version)
+    variables = [var for var in params.get("variables", "").split(",")
+                 if var]
+    unknown = [var for var in variables if var not in columns]
+    if unknown:
+        raise APIError(400, "Unknown variables {}".format(", ".join(unknown)))
+    selected = TS_KEYS + [var for var in variables or columns
+                          if var not in TS_KEYS]
+
+    query = TS_QUERY.format(", ".join('"{}"'.format(col)
+                                      for col in selected))
+    args = (zip_code, date_param(params, "start", str(datetime.date.min)),
+            date_param(params, "end", str(datetime.date.max)))
+    df = await in_thread(sqlite_store.reader_pool().query, query, args)
+    if df.empty and "start" not in params and "end" not in params:
+        raise APIError(404, "zipcode not in Chicago")
+    return df
+
+
+async def get_predictions(version, params):
+    '''
+    The predicted outcome by majority race, for one or all zip codes
+    '''
+    var = require(params, "variable")
+    await check_variable(version, var)
+    pred = await predictions(version, var)
+    if params.get("zip_code"):
+        pred = pred[pred.index == params["zip_code"]]
+        if pred.empty:
+            raise APIError(404, "zipcode not in Chicago")
+    return pred.rename_axis("zip_code").reset_index()
+
+
+async def get_neighbors(version, params):
+    '''
+    Compares a zip code to its k nearest neighbors on one outcome
+    '''
+    zip_code = require(params, "zip_code")
+    var = require(params, "variable")
+    await check_variable(version, var)
+    try:
+        k = int(params.get("k", 5))
+    except ValueError:
+        raise APIError(400, "k must be an integer")
+    if not 1 <= k <= MAX_NEIGHBORS:
+        raise APIError(400, "k must be between 1 and {}".format(MAX_NEIGHBORS))
+    covid = (await cross_section(version)).rename_axis("zip_code")
+    try:
+        return await in_process(da.compare_to_neighbors, zip_code, k, var,
+                                covid.reset_index())
+    except RuntimeError as error:
+        raise APIError(404, str(error))
+
+
+async def get_trends(version, params):
+    '''
+    The growth rates and changepoints fitted by panel_models, for one or
+    all zip codes and variables
+    '''
+    async def load():
+        if version[-1] is None:
+            raise APIError(503, "The trends were not fitted")
+        return await in_thread(schema.read_database, "ts_trends", version[-1])
+
+    df = await FRAMES.get(version, ("ts_trends",), load)
+    for name in ["zip_code", "variable"]:
+        if params.get(name):
+            df = df[df[name] == params[name]]
+    if df.empty:
+        raise APIError(404, "No trends for these zip code and variable")
+    return df
+
+
+async def get_windows(version, params):
+    '''
+    The rolling 7, 14 and 28 day windows of cases or vaccines of a zip code
+    '''
+    zip_code = require(params, "zip_code")
+    kind = params.get("kind", "cases")
+    if kind not in WINDOW_KINDS:
+        raise APIError(400, "kind must be one of {}".format(
+            ", ".join(WINDOW_KINDS)))
+
+    async def load():
+        try:
+            return await in_thread(schema.read_database, WINDOW_KINDS[kind],
+                                   snapshot_date(version))
+        except FileNotFoundError:
+            raise APIError(503, "The {} windows were not written".format(kind))
+
+    df = await FRAMES.get(version, ("windows", kind), load)
+    df = df[df["zip_code"] == zip_code]
+    if df.empty:
+        raise APIError(404, "zipcode not in Chicago")
+    return df
+
+
+ROUTES = {"/cross_section": get_cross_section,
+          "/latest": get_latest,
+          "/time_series": get_time_series,
+          "/predictions": get_predictions,
+          "/neighbors": get_neighbors,
+          "/trends": get_trends,
+          "/windows": get_windows}
+
+
+def json_default(value):
+    '''
+    Converts the numpy scalars of a result to python numbers
+    '''
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError("{} is not JSON serializable".format(type(value)))
+
+
+def encode(result):
+    '''
+    Serializes a result to JSON
+
+    Input:
+        result: pandas DataFrame or dictionary
+    Returns:
+        tuple (etag, body), the ETag hashes the body
+    '''
+    if hasattr(result, "to_json"):
+        body = result.to_json(orient="records", date_format="iso")
+    else:
+        body = json.dumps(result, default=json_default)
+    body = body.encode()
+    etag = '"{}"'.format(hashlib.blake2b(body, digest_size=16).hexdigest())
+    return etag, body
+
+
+async def render(path, params):
+    '''
+    Returns the ETag and JSON body of a request, from the cache if the
+    data did not change since it was last served
+    '''
+    version = await data_version()
+
+    async def compute():
+        result = await ROUTES[path](version, params)
+        return await in_thread(encode, result)
+
+    key = (path, tuple(sorted(params.items())))
+    return await RESPONSES.get(version, key, compute)
+
+
+async def send_response(send, status, body, headers=(), head=False):
+    '''
+    Sends a complete HTTP response. The response to a HEAD request has
+    the headers of the GET response, content-length included, and no body.
+    '''
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode()),
+                            *headers]})
+    await send({"type": "http.response.body", "body": b"" if head else body})
+
+
+async def lifespan(receive, send):
+    '''
+    Answers the startup and shutdown events of the ASGI server
+    '''
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _processes is not None:
+                _processes.shutdown(wait=False)
+            THREADS.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    '''
+    The ASGI application
+    '''
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+
+    path = scope["path"].rstrip("/")
+    if path not in ROUTES:
+        await send_response(send, 404, b'{"error": "Not found"}')
+        return
+    if scope["method"] not in ("GET", "HEAD"):
+        await send_response(send, 405, b'{"error": "Method not allowed"}')
+        return
+
+    head = scope["method"] == "HEAD"
+    params = dict(urllib.parse.parse_qsl(scope["query_string"].decode()))
+    try:
+        etag, body = await render(path, params)
+    except APIError as error:
+        body = json.dumps({"error": str(error)}).encode()
+        await send_response(send, error.status, body, head=head)
+        return
+
+    headers = [(b"etag", etag.encode()), (b"cache-control", b"no-cache")]
+    request_headers = dict(scope["headers"])
+    matches = request_headers.get(b"if-none-match", b"").decode()
+    if etag in [tag.strip() for tag in matches.split(",")] or matches == "*":
+        await send({"type": "http.response.start", "status": 304,
+                    "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    await send_response(send, 200, body, headers, head)
@@ -0,0 +1,206 @@
+'''
+This module writes and reads the artefact bundle of a snapshot: all the
+dashboard needs to serve requests without parsing csv files, importing
+statsmodels or sklearn, or refitting anything
+
+A bundle is a directory artifacts/<snapshot date>/ holding
+    manifest.json   format version, variable names, model families, best
+                    represented variables and dropdown options
+    *.npy           standardization, principal axes and components, model
+                    coefficients, loaded memory-mapped
+    *.pkl           the cross section and time series frames
+It is written to a new directory and published by pointing the
+artifacts/<snapshot date> link at it, see schema.publish_directory.
+'''
+
+import datetime
+import json
+import os
+import numpy as np
+import pandas as pd
+import aggregation
+import schema
+
+BUNDLE_DIR = "artifacts/"
+BUNDLE_FORMAT = 2
+MANIFEST = "manifest.json"
+
+ARRAYS = ["scaler_mean", "scaler_scale", "components", "principal_components",
+          "coefficients"]
+FRAMES = {"database_cross": "cross_section.pkl", "database_ts": "ts.pkl"}
+
+RACES = ["latino", "asian", "black", "white"]
+
+
+def bundle_path(date):
+    '''
+    Builds the path of the bundle of a snapshot
+    '''
+    return BUNDLE_DIR + str(date) + "/"
+
+
+def dashboard_options(database_cross, database_ts):
+    '''
+    Lists the options of the dropdowns and of the week slider
+
+    Inputs:
+        database_cross: pandas DataFrame, cross section by zip code
+        database_ts: pandas DataFrame, time series by zip code
+    Returns:
+        dictionary of lists and numbers, serializable to JSON. The week
+        slider runs over ISO week ordinals, consecutive across years.
+    '''
+    outcomes = [col for col in database_cross.columns
+                if not col.startswith(('majority', 'population'))]
+    week_end = pd.to_datetime(database_ts['week_end'])
+    weeks = pd.Series(week_end.to_numpy(),
+                      index=aggregation.week_ordinal(week_end))
+    week_ends = weeks.groupby(level=0).max()
+    # every callback needs the zip code in the cross section, 60666 (the
+    # airport) only has a time series
+    cross_zips = set(database_cross.index.astype(str))
+    return {"zip_codes": [str(i) for i in database_ts.index.unique()
+                          if str(i) in cross_zips],
+            "ts_variables": [var for var in database_ts.columns
+                             if var in outcomes],
+            "outcomes": outcomes,
+            "week_min": int(week_ends.index.min()),
+            "week_max": int(week_ends.index.max()),
+            "week_marks": {str(week): day.strftime("%b %Y")
+                           for week, day in week_ends.items()
+                           if week % 8 == 0}}
+
+
+def build_bundle(date=None):
+    '''
+    Fits the PCA and the model of every outcome on a published snapshot
+    and writes its bundle
+
+    Inputs:
+        date: str or datetime.date, snapshot date. Defaults to today.
+    Returns:
+        str, path of the bundle
+    '''
+    # the modeling libraries are needed to build a bundle, not to read one
+    import data_modeling as dm
+
+    if date is None:
+        date = datetime.date.today()
+    database_cross = schema.read_database("cross_section", date, index_col=0)
+    database_ts = schema.read_database("ts", date, index_col=0)
+    options = dashboard_options(database_cross, database_ts)
+
+    pca_var, scaler, pca = dm.fit_pca(database_cross)
+    components = pca.transform(
+        scaler.transform(database_cross[pca_var].astype("float64")))
+    full_df = pd.concat([database_cross,
+                         pd.DataFrame(components, columns=dm.COMP_NAMES,
+                                      index=database_cross.index)], axis=1)
+    loadings = pd.DataFrame(pca.components_, columns=pca_var)
+
+    design_columns = [x for x in full_df if x.startswith(("princi", "major"))]
+    coefficients, families = dm.fit_models(full_df[options["outcomes"]],
+                                           full_df[design_columns])
+
+    arrays = {"scaler_mean": scaler.mean_,
+              "scaler_scale": scaler.scale_,
+              "components": pca.components_,
+              "principal_components": components,
+              "coefficients": coefficients.T.to_numpy()}
+    manifest = {"format": BUNDLE_FORMAT,
+                "snapshot": str(date),
+                "pca_var": pca_var,
+                "comp_names": dm.COMP_NAMES,
+                "design_columns": design_columns,
+                "families": families.to_dict(),
+                "best_represented": list(dm.best_represented(loadings)),
+                "options": options}
+
+    path = bundle_path(date)
+    staging = schema.staging_directory(path)
+    for name, array in arrays.items():
+        np.save(staging + name + ".npy", np.asarray(array, dtype="float64"))
+    database_cross.to_pickle(staging + FRAMES["database_cross"])
+    database_ts.to_pickle(staging + FRAMES["database_ts"])
+    with open(staging + MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    schema.publish_directory(staging, path)
+    return path
+
+
+class Bundle:
+    '''
+    The artefacts of one snapshot, with the predictions they imply
+    '''
+
+    def __init__(self, path):
+        with open(path + MANIFEST) as f:
+            self.manifest = json.load(f)
+        self.arrays = {name: np.load(path + name + ".npy", mmap_mode="r")
+                       for name in ARRAYS}
+        self.database_cross = pd.read_pickle(path + FRAMES["database_cross"])
+        self.database_ts = pd.read_pickle(path + FRAMES["database_ts"])
+
+        components = pd.DataFrame(self.arrays["principal_components"],
+                                  columns=self.manifest["comp_names"],
+                                  index=self.database_cross.index)
+        self.full_df = pd.concat([self.database_cross, components], axis=1)
+        self.loadings = pd.DataFrame(self.arrays["components"],
+                                     columns=self.manifest["pca_var"])
+        self.outcomes = self.manifest["options"]["outcomes"]
+
+    def predictions(self, var):
+        '''
+        Produces the predictions by majority race of an outcome from the
+        stored coefficients, like data_modeling.predict_outcome
+
+        Inputs:
+            var (str): name of the outcome
+        Returns:
+            pandas DataFrame with actual and one column per race
+        '''
+        columns = self.manifest["design_columns"]
+        coefficients = self.arrays["coefficients"][self.outcomes.index(var)]
+        design = self.full_df[columns].to_numpy(dtype="float64")
+
+        dummies = np.array([col.startswith("major") for col in columns])
+        scenarios = np.repeat(design[np.newaxis], len(RACES) + 1, axis=0)
+        scenarios[1:, :, dummies] = 0
+        for i, race in enumerate(RACES, start=1):
+            scenarios[i, :, columns.index("majority_" + race)] = 1
+
+        linear = scenarios @ coefficients
+        if self.manifest["families"][var] == "binomial":
+            linear = 1 / (1 + np.exp(-linear))
+
+        df = pd.DataFrame(linear.T, index=self.database_cross.index,
+                          columns=["actual"] + RACES)
+        df[df < 0] = 0 # Limiting prediction range
+        return df
+
+
+def has_bundle(date):
+    '''
+    Tells whether a snapshot has a bundle of the current format
+    '''
+    try:
+        with open(bundle_path(date) + MANIFEST) as f:
+            return json.load(f).get("format") == BUNDLE_FORMAT
+    except FileNotFoundError:
+        return False
+
+
+def read_bundle(date):
+    '''
+    Loads the bundle of a snapshot
+
+    Inputs:
+        date: str or datetime.date, snapshot date
+    Returns:
+        Bundle, or None if the snapshot has no bundle of the current format
+    '''
+    if not has_bundle(date):
+        return None
+    # resolved once, so a bundle published meanwhile is not read half
+    return Bundle(os.path.realpath(bundle_path(date)) + "/")
@@ -3,21 +3,24 @@ This module store cleaned data to sqlite3 database
 '''
 
 from pathlib import Path
-import sqlite3
 import pandas as pd
 import data_collect
 import data_cleaning
+import geo
+import sqlite_store
 import sys
 import os
 
-DATABASE_PATH = "covid_research.sqlite3"
+DATABASE_PATH = sqlite_store.DATABASE_PATH
 
 def get_all_data():
     '''
     Get all cleaned data from APIs and
     store them into sqlite3 databases
+
+    The tables are loaded into staging copies and swapped in together,
+    so readers keep seeing the previous tables until the load is complete
     '''
-    create_table()
     data_dict = {}
 
     covid_case_num = data_cleaning.clean_covid_case_num()
@@ -30,20 +33,23 @@ def get_all_data():
     data_dict["population"] = population
     health_centers = data_cleaning.clean_health_centers()
     data_dict["health_centers"] = health_centers
-    hospital = data_collect.get_hospital_data()
+    hospital = geo.parse_hospitals(data_collect.get_hospital_data())
     data_dict["hospital"] = hospital
     health_indicator_tract = data_collect.get_health_indicator_data()
     data_dict["health_indicator_tract"] = health_indicator_tract
+    health_indicator_zip = \
+        data_collect.get_health_indicator_zip_data(health_indicator_tract)
+    data_dict["health_indicator_zip"] = health_indicator_zip
 
-    for table, df in data_dict.items():
-        import_data(table, df)
+    sqlite_store.load_tables(data_dict, DATABASE_PATH)
 
 
 def create_table():
     '''
-    Creates the cleaned data tables using SQL scripts
+    Creates empty cleaned data tables using SQL scripts,
+    to initialise a new database
     '''
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = sqlite_store.connect_writer(DATABASE_PATH)
     cursor = conn.cursor()
     with open('create_table.sql') as f:
         commands = f.read()
@@ -59,9 +65,7 @@ def import_data(table, df):
         table: str, name of the table in sqlite3 databases
         df: pandas DataFrame of data
     '''
-    conn = sqlite3.connect(DATABASE_PATH)
-    df.to_sql(table, con=conn, index=False, if_exists='replace')
-    conn.close()
+    sqlite_store.load_tables({table: df}, DATABASE_PATH)
 
 
 def gen_get_data_query():
@@ -79,7 +83,12 @@ def gen_get_data_query():
                 "population",
                 "health_centers",
                 "hospital",
-                "health_indicator_tract"]
+                "health_indicator_tract",
+                "health_indicator_zip",
+                "weekly_vaccine",
+                "latest_case_by_zip",
+                "latest_vaccine_by_zip",
+                "ts_joint"]
     for dataset in data_lst:
         query_dict[dataset] = general_query.format(dataset)
     return query_dict
@@ -99,16 +108,16 @@ def get_data(table):
         dataframe: pandas DataFrame of requested data
     '''
     if table in GET_DATA_QUERY:
-        connection = sqlite3.connect(DATABASE_PATH)
-        conn = connection.cursor()
-        query = GET_DATA_QUERY[table]
-        conn.execute(query)
-        result_data = conn.fetchall()
-        column_des = conn.description
-        column_names = [column_des[i][0] for i in range(len(column_des))]
-        df = pd.DataFrame(list(result_data), columns = column_names)
-        conn.close()
-        connection.close()
+        readers = sqlite_store.reader_pool(DATABASE_PATH)
+        with readers.connection() as connection:
+            conn = connection.cursor()
+            query = GET_DATA_QUERY[table]
+            conn.execute(query)
+            result_data = conn.fetchall()
+            column_des = conn.description
+            column_names = [column_des[i][0] for i in range(len(column_des))]
+            df = pd.DataFrame(list(result_data), columns = column_names)
+            conn.close()
         return df
     print("Table is not available")
 
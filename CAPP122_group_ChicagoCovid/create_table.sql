@@ -6,6 +6,7 @@ DROP TABLE IF EXISTS population;
 DROP TABLE IF EXISTS health_centers;
 DROP TABLE IF EXISTS hospital;
 DROP TABLE IF EXISTS health_indicator_tract;
+DROP TABLE IF EXISTS health_indicator_zip;
 
 
 CREATE TABLE covid_case_num
@@ -50,9 +51,14 @@ CREATE TABLE covid_vaccination_num
 
 
 CREATE TABLE covid_vaccination_sites
-   (facility_name varchar(50),
+   (facility_id integer,
+   facility_name varchar(50),
+   address_1 varchar(100),
+   city varchar(20),
    postal_code integer,
-   PRIMARY KEY (postal_code)
+   latitude decimal,
+   longitude decimal,
+   PRIMARY KEY (facility_id)
    );
 
 
@@ -80,7 +86,10 @@ CREATE TABLE health_centers
    community_area varchar(50),
    phone  varchar(20),
    fqhc_look_alike_or_neither_special_notes varchar(50),
+   address varchar(100),
    zip_code integer,
+   latitude decimal,
+   longitude decimal,
    PRIMARY KEY (zip_code)
    );
 
@@ -96,7 +105,8 @@ CREATE TABLE hospital
    addr_city varchar(20),
    addr_zip integer,
    contact_phone varchar(20),
-   lat_long varchar(50),
+   latitude decimal,
+   longitude decimal,
    PRIMARY KEY (addr_zip)
    );
 
@@ -114,6 +124,22 @@ CREATE TABLE health_indicator_tract
    obesity decimal,
    uninsured decimal,
    preventive_services decimal,
-   zip_code integer,
+   PRIMARY KEY (geoid)
+   );
+
+
+CREATE TABLE health_indicator_zip
+   (zip_code integer,
+   children_in_poverty decimal,
+   dental_care decimal,
+   diabetes decimal,
+   frequent_mental_distress decimal,
+   frequent_physical_distress decimal,
+   housing_cost_excessive decimal,
+   income_inequality decimal,
+   life_expectancy decimal,
+   obesity decimal,
+   uninsured decimal,
+   preventive_services decimal,
    PRIMARY KEY (zip_code)
    );
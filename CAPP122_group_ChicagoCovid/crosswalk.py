@@ -0,0 +1,77 @@
+'''
+This module aggregates census tract values to zip codes through the
+ZCTA-tract relationship file
+
+The relationship is stored as a sparse zip x tract weight matrix, so all
+indicators of all zip codes come out of a single sparse matrix product.
+'''
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import schema
+
+# Columns of the relationship file kept by data_collect.get_geoid_zipcode_map
+WEIGHT_COLUMNS = {"population": "population_part",
+                  "area": "land_area_part"}
+
+
+def weight_matrix(map_df, weight = "population", zip_name = "zip_code",
+                  geoid_name = "geoid"):
+    '''
+    Builds the sparse zip x tract weight matrix of the crosswalk
+
+    Inputs:
+        map_df (Pandas DataFrame): one row per zip-tract pair
+        weight (str): "population", "area", or None for equal weights
+        zip_name (str): Name of the column containing zip codes
+        geoid_name (str): Name of the column containing tract geoids
+    Returns:
+        (scipy csr_matrix, Index, Index): weights, zip codes, tract geoids
+    '''
+    zip_idx, zips = pd.factorize(map_df[zip_name].astype(str), sort = True)
+    tract_idx, tracts = pd.factorize(map_df[geoid_name].astype(str),
+                                     sort = True)
+
+    if weight is None:
+        values = np.ones(len(map_df))
+    else:
+        values = map_df[WEIGHT_COLUMNS[weight]].astype("float64").to_numpy()
+
+    matrix = sparse.csr_matrix((values, (zip_idx, tract_idx)),
+                               shape = (len(zips), len(tracts)))
+    return matrix, zips, tracts
+
+
+def aggregate_to_zip(tract_df, map_df, columns = schema.INDICATORS,
+                     weight = "population", geoid_name = "geoid"):
+    '''
+    Computes the weighted average of tract values for every zip code,
+    skipping the tracts with missing values
+
+    Inputs:
+        tract_df (Pandas DataFrame): one row per tract
+        map_df (Pandas DataFrame): one row per zip-tract pair
+        columns (list): names of the columns to aggregate
+        weight (str): "population", "area", or None for equal weights
+        geoid_name (str): Name of the column containing tract geoids
+    Returns:
+        Pandas DataFrame with a zip_code column and one column per value
+    '''
+    matrix, zips, tracts = weight_matrix(map_df, weight,
+                                         geoid_name = geoid_name)
+
+    tract_df = tract_df.drop_duplicates(geoid_name)
+    tract_df.index = tract_df[geoid_name].astype(str)
+    values = tract_df.reindex(tracts)[columns].astype("float64").to_numpy()
+    present = ~np.isnan(values)
+
+    # Numerators and denominators in one product
+    sums = matrix @ np.hstack([np.nan_to_num(values), present])
+    numerator, denominator = np.hsplit(sums, 2)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        averages = np.where(denominator > 0, numerator / denominator, np.nan)
+
+    zip_df = pd.DataFrame(averages, columns = columns)
+    zip_df.insert(0, "zip_code", zips)
+    return schema.apply_schema(zip_df, "health_indicator_zip")
@@ -3,130 +3,166 @@ import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output
 import plotly.express as px
-import pandas as pd
-import datetime
-import data_modeling as dm
+import plotly.io as pio
+import numpy as np
 import data_analyzing as da
+import snapshots
 
-# load data
-database_cross = pd.read_csv("databases/cross_section_database " + \
-                      str(datetime.date.today()) + ".csv", index_col=0)
-pca_var = [col for col in database_cross.columns \
-            if not col.startswith('majority')]
-full_df, loadings = dm.do_pca(database_cross)
+# load data, and swap in newer snapshots as they are published
+snapshot_manager = snapshots.SnapshotManager()
+snapshot_manager.watch()
 
-database_ts = pd.read_csv("databases/ts_database " + \
-                          str(datetime.date.today()) + ".csv", index_col=0)
-
-non_ts_var = ["week_number", "week_end", "row_id", "zip_code_location", "date",
+non_ts_var = ["week_number", "week_end", "row_id", "date",
               "population", "year"]
-cs_var = [col for col in database_cross.columns \
-          if not col.startswith(('majority', 'population'))]
+
+SWEEP_POINTS = 100
+
+# plotly builds its default template on first use, which is not thread
+# safe; the first page load runs every callback at once
+_ = pio.templates[pio.templates.default].data.scatter
 
 # Launch dashboard
 
 app = dash.Dash(__name__)
 
-app.layout = html.Div([
-    html.H1(children='Dashboard of Covid-19 in Chicago by Zip Code',
-            style={'textAlign': 'center'}),
-    # Top Left
-    html.Div([
-        html.H4(children='Time Series of Variable by Zipcode',
+
+def serve_layout():
+    '''
+    Build the layout from the current snapshot, on every page load
+
+    Output:
+      the root html.Div of the dashboard
+    '''
+    state = snapshot_manager.current()
+    options = state.options
+    scenario_inputs = []
+    if state.scenario_engine is not None:
+        scenario_inputs = state.scenario_engine.inputs
+
+    return html.Div([
+        html.H1(children='Dashboard of Covid-19 in Chicago by Zip Code',
                 style={'textAlign': 'center'}),
+        # Top Left
         html.Div([
-            html.H6(children='Select a Zip Code: '),
-            dcc.Dropdown(
-                id='crossfilter-zipcode-ts',
-                options=[{'label': i, 'value': int(i)} \
-                         for i in database_ts.index.unique() if i != "Unknown"],
-                value=60601,
-                searchable=True
-            )], style={"display": "inline-block", "width": "40%"}),
-        html.Div([
-            html.H6(children='Select a Variable to Plot: '),
-            dcc.Dropdown(
-                id='crossfilter-var-ts',
-                options=[{'label': var, 'value': var} \
-                       for var in database_ts.columns if var in cs_var],
-                value='tests_weekly'
-            )], style={'display': 'inline-block', 'width': '50%',
+            html.H4(children='Time Series of Variable by Zipcode',
+                    style={'textAlign': 'center'}),
+            html.Div([
+                html.H6(children='Select a Zip Code: '),
+                dcc.Dropdown(
+                    id='crossfilter-zipcode-ts',
+                    options=[{'label': i, 'value': int(i)} \
+                             for i in options['zip_codes']],
+                    value=60601,
+                    searchable=True
+                )], style={"display": "inline-block", "width": "40%"}),
+            html.Div([
+                html.H6(children='Select a Variable to Plot: '),
+                dcc.Dropdown(
+                    id='crossfilter-var-ts',
+                    options=[{'label': var, 'value': var} \
+                           for var in options['ts_variables']],
+                    value='tests_weekly'
+                )], style={'display': 'inline-block', 'width': '50%',
+                           'vertical-align': 'top'}),
+            dcc.Graph(
+                id='var_time_series',
+                config={'autosizable': True, 'responsive': False}
+            ),
+            html.Div([
+                html.H6(children="Select Week"),
+                dcc.RangeSlider(
+                    id='week-slider',
+                    min=options['week_min'],
+                    max=options['week_max'],
+                    value=(options['week_min'], options['week_max']),
+                    marks=options['week_marks'],
+                step=1)]),], style={'width': '49%', 'display': 'inline-block',
                        'vertical-align': 'top'}),
-        dcc.Graph(
-            id='var_time_series',
-            config={'autosizable': True, 'responsive': False}
-        ),
+        # Top Right
         html.Div([
-            html.H6(children="Select Week"),
-            dcc.RangeSlider(
-                id='week-slider',
-                min=database_ts['week_number'].min(),
-                max=database_ts['week_number'].max(),
-                value=(database_ts['week_number'].min(),
-                       database_ts['week_number'].max()),
-                marks={str(week): str(week) for week in \
-                        database_ts['week_number'].unique() if week % 4 == 0},
-            step=1)]),], style={'width': '49%', 'display': 'inline-block',
-                   'vertical-align': 'top'}),
-    # Top Right
-    html.Div([
-        html.H4(children="Prediced Variable Conditional on Majority Race",
-                style={'textAlign': 'center'}),
+            html.H4(children="Prediced Variable Conditional on Majority Race",
+                    style={'textAlign': 'center'}),
+            html.Div([
+                html.H6(children='Select a Variable to Predict: '),
+                dcc.Dropdown(
+                    id='crossfilter-var-pred',
+                    options=[{'label': var, 'value': str(var)} \
+                        for var in options['outcomes']],
+                    value='tests_weekly'
+                )], style={'display': 'inline-block', 'width': '50%',
+                           'vertical-align': 'top'}),
+            html.Div([
+                dcc.Graph(
+                    id='prediction-fig',
+                    config={'autosizable': True, 'responsive': False})
+                ]),
+            html.Div([
+                html.H4(children='K Nearest Neighbors Prediction',
+                        style={'textAlign': 'center'}),
+                html.H6(children='Select K',
+                        style={'textAlign': 'center'}),
+                dcc.Dropdown(
+                    id='crossfilter-knn-pred',
+                    options=[{'label': i, 'value': i} for i in range(1, 11)],
+                    value=5
+                ),
+                dcc.Textarea(
+                    id='knn-output',
+                    value='KNN Comparison',
+                    style={'width': '100%', 'height': '20%',
+                           'font-family': 'Times New Roman',
+                           'font-size': '22px'})
+            ])], style={'width': '49%', 'display': 'inline-block',
+                        'vertical-align': 'top'}),
+        # bottom panel
         html.Div([
-            html.H6(children='Select a Variable to Predict: '),
+            html.H2(children='Select Another Component'),
             dcc.Dropdown(
-                id='crossfilter-var-pred',
-                options=[{'label': var, 'value': str(var)} \
-                    for var in database_cross.columns if var in cs_var],
-                value='tests_weekly'
-            )], style={'display': 'inline-block', 'width': '50%',
-                       'vertical-align': 'top'}),
-        html.Div([
+                id='crossfilter-pca-axis',
+                options=[{'label': i, 'value': i - 1} for i in range(2, 7)],
+                value=1
+            ),
+            html.H4(children='PCA Correlation Plot',
+                    style={'textAlign': 'center'}),
             dcc.Graph(
-                id='prediction-fig',
-                config={'autosizable': True, 'responsive': False})
-            ]),
+                id='pca-figure-with-dropdown',
+                config={'autosizable': True, 'responsive': True}
+            )], style={'width': '60%',
+                       'display': 'inline-block'}),
         html.Div([
-            html.H4(children='K Nearest Neighbors Prediction',
+            html.H4(children='Scatterplot of Principal Components by Zipcode',
                     style={'textAlign': 'center'}),
-            html.H6(children='Select K',
+            dcc.Graph(
+                id='scatter-with-zipcode',
+                hoverData={'points': [{'hovertext': '60601'}]},
+                config={'autosizable': True, 'responsive': True},
+            )], style={'width': '39%', 'display': 'inline-block'}),
+        # what-if panel
+        html.Div([
+            html.H4(children='What-if Prediction of the Selected Variable',
                     style={'textAlign': 'center'}),
-            dcc.Dropdown(
-                id='crossfilter-knn-pred',
-                options=[{'label': i, 'value': i} for i in range(1, 11)],
-                value=5
-            ),
-            dcc.Textarea(
-                id='knn-output',
-                value='KNN Comparison',
-                style={'width': '100%', 'height': '20%',
-                       'font-family': 'Times New Roman',
-                       'font-size': '22px'})
-        ])], style={'width': '49%', 'display': 'inline-block',
-                    'vertical-align': 'top'}),
-    # bottom panel
-    html.Div([
-        html.H2(children='Select Another Component'),
-        dcc.Dropdown(
-            id='crossfilter-pca-axis',
-            options=[{'label': i, 'value': i - 1} for i in range(2, 7)],
-            value=1
-        ),
-        html.H4(children='PCA Correlation Plot', style={'textAlign': 'center'}),
-        dcc.Graph(
-            id='pca-figure-with-dropdown',
-            config={'autosizable': True, 'responsive': True}
-        )], style={'width': '60%',
-                   'display': 'inline-block'}),
-    html.Div([
-        html.H4(children='Scatterplot of Principal Components by Zipcode',
-                style={'textAlign': 'center'}),
-        dcc.Graph(
-            id='scatter-with-zipcode',
-            hoverData={'points': [{'hovertext': '60601'}]},
-            config={'autosizable': True, 'responsive': True},
-        )], style={'width': '39%', 'display': 'inline-block'})
-])
+            html.Div([
+                html.H6(children='Select an Input to Change: '),
+                dcc.Dropdown(
+                    id='scenario-input',
+                    options=[{'label': var, 'value': var} \
+                             for var in scenario_inputs],
+                    value='vaccionation_sites'
+                )], style={'display': 'inline-block', 'width': '50%',
+                           'vertical-align': 'top'}),
+            html.Div([
+                html.H6(children='New Value: '),
+                dcc.Input(id='scenario-value', type='number', debounce=True)
+                ], style={'display': 'inline-block', 'width': '30%',
+                          'vertical-align': 'top', 'margin-left': '5%'}),
+            dcc.Graph(
+                id='scenario-fig',
+                config={'autosizable': True, 'responsive': True})
+            ], style={'width': '60%', 'display': 'inline-block'})
+        ])
+
+
+app.layout = serve_layout
 
 
 @app.callback(
@@ -143,15 +179,17 @@ def update_var_timeseries(zipcode, var, week):
     Inputs:
       zipcode (int): zip code represented as integer
       var (str): the name of variable of interest
-      week (tuple): a tuple of the start and the end week
+      week (tuple): a tuple of the start and the end week ordinal, see
+        aggregation.week_ordinal
 
     Output:
       fig_ts: a figure of time series data
     '''
+    database_ts = snapshot_manager.current().database_ts
     week_start, week_end = week
-    df_ts = database_ts.loc[(database_ts['week_number'] <= week_end) & \
-                            (database_ts['week_number'] >= week_start), :]
-    mask = df_ts.index == zipcode
+    df_ts = database_ts.loc[(database_ts['week_ordinal'] <= week_end) & \
+                            (database_ts['week_ordinal'] >= week_start), :]
+    mask = df_ts.index == str(zipcode)
     df_ts = df_ts[mask]
     fig_ts = px.line(df_ts, x='week_end', y=var)
     fig_ts.update_xaxes(title_text='Time')
@@ -175,8 +213,8 @@ def update_prediction_fig(zipcode, var):
     Output:
       fig_pred: a figure of prediction bar chart
     '''
-    pred = dm.predict_outcome(database_cross, var)
-    pred_zipcode = pred[pred.index == zipcode]
+    pred = snapshot_manager.current().predictions(var)
+    pred_zipcode = pred[pred.index == str(zipcode)]
     fig_pred = px.bar(x=pred.columns, y=pred_zipcode.iloc[0, :],
                       color=pred.columns,
                       labels=dict(x = 'Majority Race', y = var,
@@ -204,7 +242,14 @@ def update_knn_output(zipcode, k, var):
     Output:
       result (str): a string of result of knn prediction
     '''
-    result_dict = da.compare_to_neighbors(zipcode, k, var)
+    covid = snapshot_manager.current().database_cross
+    try:
+        result_dict = da.compare_to_neighbors(zipcode, k, var,
+                                              covid.rename_axis('zip_code').
+                                              reset_index())
+    except RuntimeError as error:
+        # e.g. 60642, missing from the zip code coordinates
+        return str(error)
     result = ('''The value on variable {} from Zip code {} is {}''' + \
              ''' that from its {} nearest neighbors.
              ''').format(var, zipcode,
@@ -212,17 +257,70 @@ def update_knn_output(zipcode, k, var):
     return result
 
 
-def update_pca_cor(axis):
+@app.callback(
+    Output('scenario-fig', 'figure'),
+    [Input('crossfilter-zipcode-ts', 'value'),
+     Input('crossfilter-var-pred', 'value'),
+     Input('scenario-input', 'value'),
+     Input('scenario-value', 'value')])
+
+
+def update_scenario_fig(zipcode, var, column, value):
+    '''
+    Update the what-if figure by user's input: the predicted variable of
+    the zip code along the range of the input, with the current and the
+    edited input marked
+
+    Inputs:
+      zipcode (int): zip code represented as integer
+      var (str): the name of variable of interest
+      column (str): the name of the input to change
+      value (float): the new value of the input, or None
+
+    Output:
+      fig_scenario: a figure of the predictions along the input
+    '''
+    engine = snapshot_manager.current().scenario_engine
+    if engine is None:
+        return px.line(title='No stored models for this snapshot')
+    if column is None:
+        return px.line(title='Select an input to change')
+    try:
+        current = engine.rows([zipcode])[0, engine.input_position(column)]
+    except ValueError as error:
+        return px.line(title=str(error))
+
+    observed = engine.base[:, engine.input_position(column)]
+    points = [observed.min(), observed.max(), current]
+    if value is not None:
+        points.append(value)
+    values = np.linspace(min(points), max(points), SWEEP_POINTS)
+    sweep = engine.sweep(column, values, var, [zipcode])
+
+    fig_scenario = px.line(x=sweep.index, y=sweep.iloc[:, 0],
+                           labels=dict(x = column, y = var), height=350)
+    before, after = engine.what_if(zipcode, var, **{
+        column: current if value is None else value})
+    fig_scenario.add_scatter(x=[current], y=[before], mode='markers',
+                             name='Current')
+    if value is not None:
+        fig_scenario.add_scatter(x=[value], y=[after], mode='markers',
+                                 name='What-if')
+    return fig_scenario
+
+
+def update_pca_cor(axis, loadings, best_var):
     '''
     Update PCA correlation plot by user's input
 
     Inputs:
       axis (int): the number of another principal component
+      loadings (DataFrame): principal axes of the current snapshot
+      best_var (list): variables best represented on the first two axes
 
     Ouput:
       fig_pca: a figure of pca correlation plot
     '''
-    best_var = dm.best_represented(loadings)
     loading_filtered = loadings.loc[:, best_var]
 
     fig_pca = px.scatter(x=loading_filtered.loc[0, ],
@@ -251,13 +349,15 @@ def update_pca_cor(axis):
     return fig_pca
 
 
-def update_pca_scatter(axis, zipcode):
+def update_pca_scatter(axis, zipcode, full_df):
     '''
     Update PCA scatterplot by user's input
 
     Input:
       axis (int): the number of another principal component
       zipcode (int): the zipcode
+      full_df (DataFrame): cross section of the current snapshot with its
+        principal components
 
     Output:
       fig_zip: a figure of scatterplot by zip code
@@ -270,7 +370,7 @@ def update_pca_scatter(axis, zipcode):
     fig_zip.update_xaxes(title_text='Principal Component 1')
     fig_zip.update_yaxes(title_text='Principal Component ' + str(axis + 1))
 
-    zip_df = full_df.loc[zipcode, [x_name, y_name]]
+    zip_df = full_df.loc[str(zipcode), [x_name, y_name]]
     fig_zip.add_scatter(x = [zip_df[0]], y = [zip_df[1]], mode="markers",
                         marker=dict(size=5, color="red"),
                         name=str(zipcode))
@@ -296,8 +396,9 @@ def update_figure(axis, zipcode):
     Output:
       fig_pca, fig_zip: figures of PCA correlation plots and PCA scatterplot
     '''
-    fig_pca = update_pca_cor(axis)
-    fig_zip = update_pca_scatter(axis, zipcode)
+    state = snapshot_manager.current()
+    fig_pca = update_pca_cor(axis, state.loadings, state.best_var)
+    fig_zip = update_pca_scatter(axis, zipcode, state.full_df)
 
     return fig_pca, fig_zip
 
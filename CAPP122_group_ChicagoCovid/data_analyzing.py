@@ -1,5 +1,6 @@
 from math import radians, cos, sin, asin, sqrt, ceil
 import pandas as pd
+import schema
 
 
 def find_neighbors(coor, covid, zip1, k):
@@ -10,7 +11,7 @@ def find_neighbors(coor, covid, zip1, k):
     Inputs:
         coor: a pandas dataframe that maps zipcodes to coordinates
         covid: a pandas dataframe maps zipcodes with other variables
-        zip1: int, the zip code area that the user cares about
+        zip1: str, the zip code area that the user cares about
         k: int, the number of neighbours around to compare
     Returns:
         A list that includes all the k nearest neighbours zip codes.
@@ -37,15 +38,17 @@ def find_neighbors(coor, covid, zip1, k):
     return sort_neighbor[: k]
 
 
-def compare_to_neighbors(zip, k, var):
+def compare_to_neighbors(zip, k, var, covid=None):
     '''
     Compare the zip code area's variable values with
     k-neighbors' variable values.
 
     Inputs:
-        zip: int, the zip code area that the user inputs
+        zip: int or str, the zip code area that the user inputs
         k: int, the number of neighbours around to compare
         var: the output variable users would like to compare on
+        covid: a pandas dataframe of the cross section with a zip_code
+            column, read from databases/ if not given
     Returns:
         a dictionary that maps a calculated variable to a
         dictionary that contains "weight" and "value" as
@@ -53,9 +56,10 @@ def compare_to_neighbors(zip, k, var):
         zipcode area and k-neighbors to their results.
     '''
 
-    coor = pd.read_csv("rawdata/chicago-zip-code-latitude-and-longitude.csv",
-                        sep='\t')
-    covid = pd.read_csv("databases/cross_section_database 2021-03-15.csv")
+    zip = str(zip)
+    coor = schema.read_raw("zip_coordinates")
+    if covid is None:
+        covid = schema.read_database("cross_section", "2021-03-15")
 
     neigh_zips = find_neighbors(coor, covid, zip, k)
     neigh_mask = covid['zip_code'].isin(neigh_zips)
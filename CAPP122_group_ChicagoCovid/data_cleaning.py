@@ -3,8 +3,9 @@ This module cleans raw data
 '''
 
 import data_collect
+import geo
+import schema
 import pandas as pd
-import re
 import datetime
 pd.set_option('mode.chained_assignment', None)
 
@@ -26,11 +27,11 @@ def clean_covid_case_num():
     '''
 
     covid_case_num = DATASET_DICT["covid_case_num"]
-    covid_case_num["week_end"] = pd.to_datetime(covid_case_num["week_end"])
-    
+    # zip_code_location holds GeoJSON dicts, which cannot be cast
     covid_case_num.drop(["week_start", "zip_code_location"] + COL_DROP,
                     axis = 1, inplace = True)
-    
+    covid_case_num = schema.apply_schema(covid_case_num, "covid_case_num")
+
     return covid_case_num
 
 
@@ -43,9 +44,10 @@ def clean_covid_vaccination_num():
     '''
 
     covid_vaccination = DATASET_DICT["covid_vaccination_num"]
-    covid_vaccination["date"] = pd.to_datetime(covid_vaccination["date"])
     covid_vaccination.drop(["zip_code_location"] + COL_DROP,
                                 axis = 1, inplace = True)
+    covid_vaccination = schema.apply_schema(covid_vaccination,
+                                            "covid_vaccination_num")
 
     return covid_vaccination
 
@@ -58,8 +60,11 @@ def clean_covid_vaccination_sites():
         covid_vaccination_sites: pandas DataFrame of covid_vaccination_sites
     '''
     covid_vaccination_sites = DATASET_DICT["covid_vaccination_sites"]
+    covid_vaccination_sites = geo.parse_vaccination_sites(
+        covid_vaccination_sites)
     covid_vaccination_sites = covid_vaccination_sites.\
-        loc[:, ["facility_name","postal_code"]]
+        loc[:, ["facility_id", "facility_name", "address_1", "city",
+                "postal_code", "latitude", "longitude"]]
 
     return covid_vaccination_sites
 
@@ -97,17 +102,6 @@ def clean_health_centers():
     health_centers.drop([":@computed_region_awaf_s7ux"] + COL_DROP, 
                          axis = 1, inplace = True)
 
-    health_centers["location_1"] = health_centers["location_1"].apply(str)
-    health_centers["zip_code"] = health_centers.location_1. \
-                                apply(lambda x: extract_zip(x))
-                                
-    health_centers.drop(["location_1"], axis = 1, inplace = True)
+    health_centers = geo.parse_health_centers(health_centers)
 
     return health_centers
-
-
-def extract_zip(string):
-    '''
-    Extracts zip code from health_center.location_1
-    '''
-    return re.findall(".*\"zip\":\s+\"(.*)\"", string)[0]
@@ -8,32 +8,44 @@ Data Sources:
 '''
 
 import csv
+import os
 import ssl
+import sys
 import urllib.request
 import pandas as pd
 import requests
 from sodapy import Socrata
+import crosswalk
+import joins
+import regions
+import schema
+
+RELATIONSHIP_URL = \
+    "https://www2.census.gov/geo/docs/maps-data/data/rel/zcta_tract_rel_10.txt"
+# columns kept from the relationship file, with their names in the map
+RELATIONSHIP_COLUMNS = {"ZCTA5": "zip_code",
+                        "GEOID": "geoid",
+                        "POPPT": "population_part",
+                        "AREALANDPT": "land_area_part"}
+CHUNK_ROWS = 50000
 
 
-def get_dataportal_api_data():
+def get_dataportal_api_data(region=regions.DEFAULT_REGION):
     '''
-    Collects data from Chicago Data Portal API
+    Collects data from the open data portal of a region
 
+    Input:
+        region: str, key of regions.REGIONS
     Output:
         dataset_dict: a dictionary mapping table_name
                       to the relevantpandas Dataframe
     '''
-    client = Socrata("data.cityofchicago.org",
+    client = Socrata(regions.REGIONS[region]["portal"],
                     "BxWCnzf8952oHnxHDXohAdBSQ",
                     "API EMAIL ACCOUNT", ##need replace
                     "API KEYWORD")  ##need replace
 
-    dataset_id = {
-        "covid_case_num": "yhhz-zm2v",
-        "covid_vaccination_num": "553k-3xzc",
-        "covid_vaccination_sites": "6q3z-9maq",
-        "population": "85cm-7uqa",
-        "health_centers": "cjg8-dbka"}
+    dataset_id = regions.REGIONS[region]["datasets"]
 
     dataset_dict = {}
     for filename, set_id in dataset_id.items():
@@ -45,14 +57,16 @@ def get_dataportal_api_data():
     return dataset_dict
 
 
-def get_hospital_data():
+def get_hospital_data(region=regions.DEFAULT_REGION):
     '''
-    Collects hospital data from Chicago Health Atlas API
+    Collects hospital data, from Chicago Health Atlas API for Chicago
 
+    Input:
+        region: str, key of regions.REGIONS
     Output:
-        df: pandas DataFrame of Chicago hospital information
+        df: pandas DataFrame of hospital information
     '''
-    url = "https://api.chicagohealthatlas.org/api/v1/hospitals"
+    url = regions.REGIONS[region]["hospitals"]
     response = requests.get(url)
     dictr = response.json()
     df = pd.json_normalize(dictr)
@@ -61,12 +75,15 @@ def get_hospital_data():
     return df
 
 
-def get_health_indicator_data():
+def get_health_indicator_data(region=regions.DEFAULT_REGION):
     '''
     Collects health indicator data from City Health Dashboard API
 
+    Input:
+        region: str, key of regions.REGIONS
     Output:
-        df: pandas DataFrame of Chicago health indicators
+        df: pandas DataFrame of health indicators of the region,
+            one row per census tract
     '''
     indicator_yr = [
         ("children-in-poverty","2017,+5+Year+Estimate"),
@@ -83,14 +100,13 @@ def get_health_indicator_data():
     ]
 
     df = request_cityhealth_api_data(indicator_yr[0][0],
-                                     indicator_yr[0][1])
+                                     indicator_yr[0][1], region)
 
+    indicator_dfs = {}
     for indicator, data_yr_type in indicator_yr[1:]:
-        indicator_df = request_cityhealth_api_data(indicator, data_yr_type)
-        df = df.merge(indicator_df, on="geoid")
-
-    map_df = get_geoid_zipcode_map()
-    df = df.merge(map_df, on="geoid")
+        indicator_dfs[indicator] = \
+            request_cityhealth_api_data(indicator, data_yr_type, region)
+    df = joins.join_on_key(df, indicator_dfs, "geoid", how="inner")
 
     col_rename = {"children-in-poverty":"children_in_poverty",
                   "dental-care":"dental_care",
@@ -107,7 +123,33 @@ def get_health_indicator_data():
     return df
 
 
-def request_cityhealth_api_data(indicator, data_yr_type):
+def get_health_indicator_zip_data(tract_df=None, weight="population",
+                                  region=regions.DEFAULT_REGION):
+    '''
+    Aggregates the tract level health indicators to zip codes,
+    weighting each tract by its share of the zip code
+
+    Input:
+        tract_df: pandas DataFrame of tract level health indicators,
+                  collected again if not given
+        weight: str, "population" or "area"
+        region: str, key of regions.REGIONS
+    Output:
+        df: pandas DataFrame of health indicators by zip code
+    '''
+    if tract_df is None:
+        tract_df = get_health_indicator_data(region)
+    map_df = get_geoid_zipcode_map(regions.REGIONS[region]["state_fips"])
+    dataframe_to_csv(map_df, "geoid_zipcode_map")
+    df = crosswalk.aggregate_to_zip(tract_df, map_df, weight=weight)
+    filename = "health_indicator_zip"
+    dataframe_to_csv(df, filename)
+
+    return df
+
+
+def request_cityhealth_api_data(indicator, data_yr_type,
+                                region=regions.DEFAULT_REGION):
     '''
     Request data from City Health Dashboard API
     based on specific indicator name and data_yr_type
@@ -115,12 +157,15 @@ def request_cityhealth_api_data(indicator, data_yr_type):
     Input:
         indicator: str, name of indicator
         data_yr_type: str, the year of the data source
+        region: str, key of regions.REGIONS
     Output:
         indicator_df: pandas DataFrame, tract level data based on 
                       indicator input and data_yr_type
     '''
     end_point = "api.cityhealthdashboard.com/api/data/tract-metric/"
-    loc_filter = "&city_name=Chicago&state_abbr=IL"
+    loc_filter = "&city_name={}&state_abbr={}".format(
+        regions.REGIONS[region]["city_name"],
+        regions.REGIONS[region]["state_abbr"])
     api_key = "API KEY" ## replace with API key
 
     request_str = "https://{}{}?" + \
@@ -141,29 +186,54 @@ def request_cityhealth_api_data(indicator, data_yr_type):
     return indicator_df
 
 
-def get_geoid_zipcode_map():
+def get_geoid_zipcode_map(state_fips="17", source=RELATIONSHIP_URL,
+                          refresh=False):
     '''
     Get the dataframe mapping the geoid to zipcode
     Source: census.gov
 
+    The national relationship file is streamed in chunks of CHUNK_ROWS
+    rows, keeping only the needed columns and the rows of the state, so
+    memory is bounded by the chunk size. The crosswalk of the state is
+    saved to rawdata/ and read from there by later runs.
+
+    Input:
+        state_fips: str, FIPS code of the state, Illinois by default
+        source: str, url or path of the relationship file
+        refresh: bool, read the relationship file even if the crosswalk
+                 of the state was saved
     Output:
-        map_df: pandas Dataframe mapping the geoid to zipcode
+        map_df: pandas Dataframe mapping the geoid to zipcode, with the
+                population and land area of each zip-tract part
     '''
-    url = \
-    "https://www2.census.gov/geo/docs/maps-data/data/rel/zcta_tract_rel_10.txt"
-    ssl._create_default_https_context = ssl._create_unverified_context
-    df = pd.read_csv(url, sep=",", dtype=str)
-    map_df = df.drop(df[df['STATE'] != '17'].index)
-    map_df = map_df.loc[:, ["ZCTA5","GEOID"]]
-    map_df.rename(columns = {"ZCTA5": "zip_code",
-                              "GEOID": "geoid"},
-                  inplace = True)
+    cache = schema.RAWDATA_DIR + "zcta_tract_rel_{}.csv".format(state_fips)
+    if not refresh and os.path.exists(cache):
+        return pd.read_csv(cache, dtype=str)
+
+    if source.startswith("http"):
+        context = ssl._create_unverified_context()
+        stream = urllib.request.urlopen(source, context=context)
+    else:
+        stream = open(source)
+    with stream:
+        chunks = pd.read_csv(stream, sep=",", dtype=str,
+                             usecols=["STATE", *RELATIONSHIP_COLUMNS],
+                             chunksize=CHUNK_ROWS)
+        map_df = pd.concat([chunk.loc[chunk["STATE"] == state_fips,
+                                      list(RELATIONSHIP_COLUMNS)]
+                            for chunk in chunks], ignore_index=True)
+    map_df.rename(columns = RELATIONSHIP_COLUMNS, inplace = True)
+
+    os.makedirs(schema.RAWDATA_DIR, exist_ok=True)
+    map_df.to_csv(cache + ".tmp", index=False)
+    os.replace(cache + ".tmp", cache)
     return map_df
 
 
 def dataframe_to_csv(dataframe, filename):
     '''
-    Converts Pandas Dataframe to csv file
+    Converts Pandas Dataframe to a csv file in the rawdata/ directory of
+    the current region
 
     Input:
         dataframe: pandas DataFrame object
@@ -171,17 +241,19 @@ def dataframe_to_csv(dataframe, filename):
     Output:
         a CSV file
     '''
-    path = "" + filename + ".csv" ## replace with actual path
+    path = schema.RAWDATA_DIR + filename + ".csv"
     dataframe.to_csv(path)
 
 
-def main():
-    print ("Collecting all raw data.")
-    get_dataportal_api_data()
-    get_hospital_data()
-    get_health_indicator_data()
+def main(region=regions.DEFAULT_REGION):
+    print ("Collecting all raw data of", region)
+    get_dataportal_api_data(region)
+    get_hospital_data(region)
+    get_health_indicator_zip_data(get_health_indicator_data(region),
+                                  region=region)
     print ("Raw data is ready.")
 
 
 if __name__ == "__main__":
-    main()
+    # regions.py passes the region whose directory it runs in
+    main(*sys.argv[1:2])
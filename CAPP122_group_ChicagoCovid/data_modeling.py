@@ -1,11 +1,35 @@
-import datetime
+import numpy as np
 import pandas as pd
 import statsmodels.api as sm
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
 
-database_cross = pd.read_csv("databases/cross_section_database " + \
-                      str(datetime.date.today()) + ".csv", index_col = 0)
+TOTAL_COMPONENTS = 6 # 80% of total variance explained
+COMP_NAMES = ["principal_component" + str(x) for x in
+              range(1, TOTAL_COMPONENTS + 1)]
+
+
+def fit_pca(dataset):
+    """
+    Fits the standardization and the principal axis of a given DataFrame
+
+    Args:
+        dataset (Pandas DataFrame): Set of interest
+
+    Returns:
+        tuple: (variables of the pca, fitted StandardScaler, fitted PCA)
+    """
+
+    pca_var = [col for col in dataset.columns if not col.startswith('major')]
+
+    ref_df = dataset[pca_var].astype("float64")
+    scaler = StandardScaler().fit(ref_df)
+
+    pca = PCA(n_components = TOTAL_COMPONENTS)
+    pca.fit(scaler.transform(ref_df))
+
+    return pca_var, scaler, pca
+
 
 def do_pca(dataset):
     """
@@ -18,19 +42,12 @@ def do_pca(dataset):
         tuple of DataFrames: (augamented dataset, principal axis)
     """
     
-    total_components = 6 # 80% of total variance explained
-    comp_names = ["principal_component" + str(x) for x in 
-                range(1, total_components + 1)]
-
-    pca_var = [col for col in dataset.columns if not col.startswith('major')]
-
-    ref_df = dataset[pca_var]
-    ref_df = StandardScaler().fit_transform(ref_df)
+    pca_var, scaler, pca = fit_pca(dataset)
 
-    pca = PCA(n_components = total_components) 
-    principal_components = pca.fit_transform(ref_df)
+    ref_df = scaler.transform(dataset[pca_var].astype("float64"))
+    principal_components = pca.transform(ref_df)
     principal_components = pd.DataFrame(data = principal_components, 
-                                        columns = comp_names,
+                                        columns = COMP_NAMES,
                                         index = dataset.index)
 
     full_data_frame = pd.concat([dataset, principal_components], axis=1)                                    
@@ -65,6 +82,23 @@ def best_represented(coord, axes=[0,1], min_cos_2=0.5):
     return coord.columns[best_represtented]
 
 
+def outcome_family(dep_var):
+    """
+    Selects the structure of the model of an outcome variable: a binomial
+    GLM for shares between 0 and 1, a linear model otherwise
+
+    Args:
+        dep_var (Pandas Series or numpy array): Outcome variable
+
+    Returns:
+        str: "binomial" or "ols"
+    """
+
+    if np.min(dep_var) >= 0 and np.max(dep_var) <= 1:
+        return "binomial"
+    return "ols"
+
+
 def fit_model(dep_var, design_matrix, var):
     """
     Given a relevant dataset, this function fits a generalized linear model 
@@ -80,7 +114,7 @@ def fit_model(dep_var, design_matrix, var):
         [statsmodels]: Fitted Model
     """
     
-    if min(dep_var) >= 0 and max(dep_var) <= 1:
+    if outcome_family(dep_var) == "binomial":
         model = sm.GLM(dep_var, design_matrix, family = sm.families.Binomial())
     else:
         model = sm.OLS(dep_var, design_matrix)
@@ -90,6 +124,88 @@ def fit_model(dep_var, design_matrix, var):
     return model_fit
 
 
+def batched_irls(design, outcomes, max_iter=100, tol=1e-10):
+    """
+    Fits binomial GLMs with the logit link to several outcome columns
+    sharing one design matrix, by iteratively reweighted least squares run
+    on all columns at once
+
+    Args:
+        design (numpy array): n x p design matrix
+        outcomes (numpy array): n x k shares between 0 and 1
+        max_iter (int, optional): Maximum number of iterations.
+            Defaults to 100.
+        tol (float, optional): Relative change of the coefficients at
+            convergence. Defaults to 1e-10.
+
+    Returns:
+        numpy array: p x k coefficients
+    """
+
+    n, p = design.shape
+    eps = np.finfo("float64").eps
+    # row-wise outer products, so that the p x p normal matrices of all
+    # outcomes come out of a single matrix product
+    outer = (design[:, :, np.newaxis] * design[:, np.newaxis, :]).reshape(
+        n, p * p)
+
+    mu = (outcomes + 0.5) / 2 # same start as statsmodels
+    eta = np.log(mu / (1 - mu))
+    coef = np.zeros((p, outcomes.shape[1]))
+
+    for _ in range(max_iter):
+        weights = mu * (1 - mu)
+        working = eta + (outcomes - mu) / weights
+        xtwx = (weights.T @ outer).reshape(-1, p, p)
+        xtwz = (weights * working).T @ design
+        new_coef = np.linalg.solve(xtwx, xtwz[..., np.newaxis])[..., 0].T
+
+        eta = design @ new_coef
+        mu = np.clip(1 / (1 + np.exp(-eta)), eps, 1 - eps)
+        change = np.max(np.abs(new_coef - coef))
+        coef = new_coef
+        if change <= tol * (1 + np.max(np.abs(coef))):
+            break
+
+    return coef
+
+
+def fit_models(outcomes, design_matrix):
+    """
+    Fits the model of every outcome column against one shared design
+    matrix, with the same choice of structure as fit_model: a single
+    least squares factorization for all linear outcomes and a batched IRLS
+    for all binomial ones
+
+    Args:
+        outcomes (Pandas DataFrame): One column per outcome variable
+        design_matrix (Pandas DataFrame): Set with pca
+
+    Returns:
+        tuple: (Pandas DataFrame of coefficients indexed by the design
+            columns with one column per outcome, Pandas Series of families)
+    """
+
+    design = design_matrix.to_numpy(dtype = "float64")
+    values = outcomes.to_numpy(dtype = "float64")
+
+    families = pd.Series([outcome_family(values[:, j])
+                          for j in range(values.shape[1])],
+                         index = outcomes.columns)
+    binomial = (families == "binomial").to_numpy()
+
+    coef = np.empty((design.shape[1], values.shape[1]))
+    if (~binomial).any():
+        coef[:, ~binomial] = np.linalg.lstsq(design, values[:, ~binomial],
+                                             rcond = None)[0]
+    if binomial.any():
+        coef[:, binomial] = batched_irls(design, values[:, binomial])
+
+    coefficients = pd.DataFrame(coef, index = design_matrix.columns,
+                                columns = outcomes.columns)
+    return coefficients, families
+
+
 def predict_outcome(dataset, var):
     """
     Produces prediction by majority race by zip code for the outcome variable 
@@ -110,7 +226,7 @@ def predict_outcome(dataset, var):
     select_vars = [x for x in set_with_pca if x.startswith(("princi", "major"))]
     select_vars.append(var)
 
-    ref_dataset = set_with_pca[select_vars]
+    ref_dataset = set_with_pca[select_vars].astype("float64")
     
     depend_var = ref_dataset[var]
     design_matrix = ref_dataset.drop(var, axis=1)
@@ -1,7 +1,14 @@
 import numpy as np
-import pandas as pd
-import re
-import datetime
+import aggregation
+import artifacts
+import crosswalk
+import geo
+import joins
+import nearest
+import out_of_core
+import panel_cube
+import schema
+import smoothing
 
 def summarise_by_zip_latest(data, zip_name, time_ind):
     """Gets the row corresponding to the latest week available by zip code
@@ -12,48 +19,18 @@ def summarise_by_zip_latest(data, zip_name, time_ind):
         time_ind (str): Name of the column containig time information
 
     Returns:
-        Pandas DataFrame
+        Pandas DataFrame: numeric columns of the latest row, by zip code
     """
 
-    if not isinstance(data[zip_name][0], str):
-        data[zip_name] = data[zip_name].apply(str)
+    latest = data.sort_values(time_ind).groupby(zip_name, observed = True). \
+             tail(1)
+    latest = latest.set_index(zip_name).sort_index()
 
-    return data.groupby(zip_name).max(time_ind)
+    return latest.select_dtypes("number")
 
-##### Processing Weekly case numbers
-covid_case_num = pd.read_csv("rawdata/covid_case_num.csv", index_col = 0)
-
-# Time Structure
-covid_case_num["week_end"] = pd.to_datetime(covid_case_num["week_end"])
-
-# Dropping Unknown Variables
-covid_case_num.drop(["week_start", 
-                    ":@computed_region_rpca_8um6", 
-                    ":@computed_region_vrxf_vc4k",
-                    ":@computed_region_6mkv_f3dw", 
-                    ":@computed_region_bdys_3d7i",
-                    ":@computed_region_43wa_7qmu"], 
-                    axis = 1, inplace = True)
-
-
-
-##### Processing Vaccine numbers
-covid_vaccination_num = pd.read_csv("rawdata/covid_vaccination_num.csv",
-                                     index_col = 0)
-
-# Dropping Unknown Variables
-covid_vaccination_num.drop([":@computed_region_vrxf_vc4k", 
-                            ":@computed_region_6mkv_f3dw",
-                            ":@computed_region_bdys_3d7i", 
-                            ":@computed_region_43wa_7qmu",
-                            ":@computed_region_rpca_8um6"], 
-                            axis = 1, inplace = True)
-
-# Aggregating by week
-covid_vaccination_num["date"] = pd.to_datetime(covid_vaccination_num["date"])
-covid_vaccination_num["week_number"] = covid_vaccination_num["date"].dt. \
-                                       isocalendar().week 
+##### Processing Weekly case numbers and Vaccine numbers
 
+# Aggregating vaccines by ISO year and week
 agg_funs = {"total_doses_daily": "sum" , 
             "total_doses_cumulative": "max", 
             "_1st_dose_daily": "sum",
@@ -64,12 +41,33 @@ agg_funs = {"total_doses_daily": "sum" ,
             'vaccine_series_completed_percent_population': "max",
             "date": "max"}
 
-weekly_vaccine = covid_vaccination_num.groupby(["zip_code", "week_number"]). \
-                 agg(agg_funs)
-weekly_vaccine = weekly_vaccine.reset_index()
+if out_of_core.enabled():
+    # Streamed in chunks, reduced and joined by buckets of zip codes
+    # The rolling windows are written to databases/ bucket by bucket
+    by_zip = out_of_core.zip_tables(agg_funs)
+    weekly_vaccine = by_zip["weekly_vaccine"]
+    latest_case_rows = by_zip["latest_cases"]
+else:
+    covid_case_num = schema.read_raw("covid_case_num")
+
+    # Dropping Unknown Variables
+    covid_case_num.drop(["week_start"], axis = 1, inplace = True)
+
+    covid_vaccination_num = schema.read_raw("covid_vaccination_num")
+    weekly_vaccine = aggregation.weekly_rollup(covid_vaccination_num,
+                                               agg_funs, "date")
+
+    # Rolling 7, 14 and 28 day windows
+    vaccine_windows = aggregation.rolling_windows(covid_vaccination_num,
+                                                  aggregation.VACCINE_DAILY,
+                                                  "date")
+    case_windows = aggregation.rolling_windows(covid_case_num,
+                                               aggregation.CASE_WEEKLY,
+                                               "week_end")
+    latest_case_rows = covid_case_num
 
 ##### Processing Population Information
-population = pd.read_csv("rawdata/population.csv", index_col = 0)
+population = schema.read_raw("population")
 
 # Taking only data from 2019
 population = population[population.year == 2019]
@@ -78,6 +76,7 @@ population = population[population.year == 2019]
 col_names = population.columns[5:-1]
 for item in col_names:
     population[item] = 100 * (population[item] / population.population_total)
+    population[item] = population[item].astype(schema.RATE)
 
 # Renaming zip_code
 population.rename(columns = {"geography": "zip_code"}, inplace = True)
@@ -115,8 +114,7 @@ population = population[pop_filter]
 
 
 ### Processing Vaccionation Sites
-covid_vaccination_sites = pd.read_csv("rawdata/covid_vaccination_sites.csv", 
-                                      index_col = 0)
+covid_vaccination_sites = schema.read_raw("covid_vaccination_sites")
 
 vaccionation_sites = covid_vaccination_sites.postal_code.value_counts()
 vaccionation_sites = vaccionation_sites.reset_index()
@@ -124,24 +122,13 @@ vaccionation_sites.rename(columns = {"index": "zip_code",
                                      "postal_code": "vaccionation_sites"}, 
                                      inplace = True)
 
-vaccionation_sites["zip_code"] = vaccionation_sites["zip_code"].astype(str)
-
 
 
 ### Processing Health Centers
-health_centers = pd.read_csv("rawdata/health_centers.csv")
+health_centers = schema.read_raw("health_centers")
 
 # Getting zip code
-
-def extract_zip(string):
-    """
-    Extracts zip code from health_center.location_1
-    """
-
-    return re.findall(".*\"zip\":\s+\"(.*)\"", string)[0]
-
-health_centers["zip_code"] = health_centers.location_1. \
-                             apply(lambda x: extract_zip(x))
+health_centers = geo.parse_health_centers(health_centers)
 
 health_centers = health_centers.zip_code.value_counts()
 health_centers = health_centers.reset_index()
@@ -152,42 +139,61 @@ health_centers.rename(columns = {"index": "zip_code",
 
 
 ### Processing Hospitals
-hospital = pd.read_csv("rawdata/hospital.csv", index_col = 0)
+hospital = schema.read_raw("hospital")
 hospitals_by_zip = hospital.addr_zip.value_counts()
 hospitals_by_zip = hospitals_by_zip.reset_index()
 hospitals_by_zip.rename(columns = {"index": "zip_code", 
                                    "addr_zip": "number_of_hospitals"}, 
                                    inplace = True)
 
-hospitals_by_zip["zip_code"] = hospitals_by_zip["zip_code"].astype(str)
+
+
+### Processing Health Indicators
+health_indicator_tract = schema.read_raw("health_indicator_tract")
+health_indicator_tract.rename(columns = {ind.replace("_", "-"): ind for ind
+                                         in schema.INDICATORS}, inplace = True)
+
+if "zip_code" in health_indicator_tract.columns:
+    # Older tract files repeat each tract once per zip code, without weights
+    geoid_zipcode_map = health_indicator_tract[["zip_code", "geoid"]]
+    indicator_weight = None
+else:
+    geoid_zipcode_map = schema.read_raw("geoid_zipcode_map")
+    indicator_weight = "population"
+
+health_indicator_zip = crosswalk.aggregate_to_zip(health_indicator_tract,
+                                                  geoid_zipcode_map,
+                                                  weight = indicator_weight)
+
+
+
+### Distance to the nearest facility of each type
+facility_distances = nearest.distance_to_nearest()
 
 
 
 ### Joining Databases - CROSS SECTION   
 
-lastest_cases = summarise_by_zip_latest(covid_case_num, "zip_code", "week_end")
+lastest_cases = summarise_by_zip_latest(latest_case_rows, "zip_code",
+                                        "week_end")
 lastest_cases = lastest_cases.reset_index()
 lastest_cases = lastest_cases.drop("week_number", axis = 1)
 
 lastest_vaccines = summarise_by_zip_latest(weekly_vaccine, "zip_code", "date")
 lastest_vaccines = lastest_vaccines.reset_index()
-lastest_vaccines = lastest_vaccines.drop("week_number", axis = 1)
+lastest_vaccines = lastest_vaccines.drop(["year", "week_number"], axis = 1)
 
-to_append = {"demographic_info" : population, 
+to_append = {"vaccines" : lastest_vaccines,
+             "demographic_info" : population, 
              "vaccine_sites" : vaccionation_sites,
              "health_centers" : health_centers,
              "hospitals" : hospitals_by_zip}
 
-joint_database = pd.merge(lastest_cases, lastest_vaccines, on = "zip_code",
-                          how = "left")
-
-for item in to_append.values():
-    joint_database = pd.merge(joint_database, item, on = "zip_code", 
-                              how = "left")
+# Zip codes without facilities have none of them
+repl_with_zero = {"vaccine_sites" : 0, "health_centers" : 0, "hospitals" : 0}
 
-repl_with_zero = joint_database.columns[-3:]
-joint_database.loc[:, repl_with_zero] = joint_database.loc[:, repl_with_zero]. \
-                                        fillna(0)
+joint_database = joins.join_on_key(lastest_cases, to_append, "zip_code",
+                                   how = "left", fill = repl_with_zero)
 
 joint_database = joint_database.loc[joint_database.zip_code != "60666"]
 joint_database = joint_database.loc[joint_database.zip_code != "Unknown"]
@@ -195,23 +201,32 @@ joint_database = joint_database.loc[joint_database.zip_code != "Unknown"]
 
 ### Joining Databases - TIME SERIES   
 
-ts_covid_case_num = covid_case_num.copy()
-ts_weekly_vaccine = weekly_vaccine.copy()
+if out_of_core.enabled():
+    ts_joint = by_zip["ts"]
+    zip_locations = by_zip["zip_locations"]
+else:
+    ts_joint = joins.join_weekly(covid_case_num, weekly_vaccine)
 
-ts_covid_case_num["year"] = ts_covid_case_num.week_end.dt.year
-ts_weekly_vaccine["year"] = ts_weekly_vaccine.date.dt.year
+    # Coordinates are kept once per zip code instead of once per row
+    zip_locations = geo.zip_locations(covid_case_num, covid_vaccination_num)
 
-ts_joint = pd.merge(ts_covid_case_num, ts_weekly_vaccine, 
-                    left_on = ["zip_code", "year", "week_number"], 
-                    right_on = ["zip_code", "year", "week_number"],
-                    how = "left")
-
-ts_joint = ts_joint.sort_values(by = ["zip_code", "week_end"])
+# Rates of small zip codes shrunk towards their neighbours
+ts_joint = smoothing.smooth_panel(ts_joint, zip_locations)
 
 
 ### Writing databases
-joint_database.to_csv("databases/cross_section_database " + 
-                      str(datetime.date.today()) + ".csv", index = False)
-
-ts_joint.to_csv("databases/ts_database " + 
-                str(datetime.date.today()) + ".csv", index = False)
\ No newline at end of file
+schema.write_database(joint_database, "cross_section")
+schema.write_database(ts_joint, "ts")
+schema.write_database(zip_locations, "zip_locations")
+schema.write_database(health_indicator_zip, "health_indicator_zip")
+schema.write_database(facility_distances, "facility_distances")
+schema.write_database(weekly_vaccine, "weekly_vaccine")
+if not out_of_core.enabled():
+    schema.write_database(vaccine_windows, "vaccine_windows")
+    schema.write_database(case_windows, "case_windows")
+
+### Zip x week x variable cube of the time series
+panel_cube.build_cube(ts_joint)
+
+### Artefact bundle of the dashboard
+artifacts.build_bundle()
@@ -0,0 +1,71 @@
+'''
+This module searches vaccination sites, health centers and hospitals by
+name, type and address through the facility_search FTS5 index built by
+facility_search.sql
+'''
+
+import re
+import pandas as pd
+import sqlite_store
+
+# bm25 weights of the name, facility_type and address columns
+COLUMN_WEIGHTS = (10.0, 2.0, 1.0)
+
+RESULT_COLUMNS = ["name", "facility_type", "address", "zip_code", "source",
+                  "source_id", "score"]
+
+SEARCH_QUERY = """
+    SELECT name, facility_type, address, zip_code, source, source_id,
+        bm25(facility_search, {}, {}, {}) AS score
+    FROM facility_search
+    WHERE facility_search MATCH ?
+    {}
+    ORDER BY score
+    LIMIT ?;
+    """
+
+
+def match_expression(text):
+    '''
+    Turns free text typed by a user into an FTS5 query where every word
+    must start a word of the facility
+
+    Input:
+        text: str, e.g. "walgr marine d"
+    Output:
+        str, FTS5 MATCH expression, e.g. '"walgr"* "marine"* "d"*'
+        or None if the text has no words
+    '''
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join('"{}"*'.format(word) for word in words)
+
+
+def search_facilities(text, limit=10, source=None, path=None):
+    '''
+    Finds the facilities best matching a free text query
+
+    Inputs:
+        text: str, beginnings of words of the name, type or address
+        limit: int, maximum number of results
+        source: str, optional, one of "covid_vaccination_sites",
+                "health_centers" or "hospital"
+        path: str, optional, path of the sqlite3 database
+    Output:
+        pandas DataFrame of the matches, best first
+    '''
+    expression = match_expression(text)
+    if expression is None:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    readers = sqlite_store.reader_pool(path or sqlite_store.DATABASE_PATH)
+    source_filter = "AND source = ?" if source else ""
+    query = SEARCH_QUERY.format(*COLUMN_WEIGHTS, source_filter)
+
+    params = [expression]
+    if source:
+        params.append(source)
+    params.append(limit)
+
+    return readers.query(query, tuple(params))
@@ -0,0 +1,47 @@
+-- Full-text index over the names, types and addresses of all facilities,
+-- rebuilt inside the same transaction that swaps in new facility data
+
+DROP TABLE IF EXISTS facility_search;
+
+CREATE VIRTUAL TABLE facility_search USING fts5
+   (name,
+   facility_type,
+   address,
+   zip_code UNINDEXED,
+   source UNINDEXED,
+   source_id UNINDEXED,
+   tokenize = 'unicode61 remove_diacritics 2',
+   prefix = '2 3 4');
+
+INSERT INTO facility_search
+   (name, facility_type, address, zip_code, source, source_id)
+   SELECT facility_name,
+      'Vaccination Site',
+      trim(coalesce(address_1, '') || ' ' || coalesce(city, '')),
+      postal_code,
+      'covid_vaccination_sites',
+      facility_id
+   FROM covid_vaccination_sites;
+
+INSERT INTO facility_search
+   (name, facility_type, address, zip_code, source, source_id)
+   SELECT facility,
+      trim('Health Center ' ||
+         coalesce(fqhc_look_alike_or_neither_special_notes, '')),
+      trim(coalesce(address, '') || ' ' || coalesce(community_area, '')),
+      zip_code,
+      'health_centers',
+      rowid
+   FROM health_centers;
+
+INSERT INTO facility_search
+   (name, facility_type, address, zip_code, source, source_id)
+   SELECT name,
+      trim(coalesce(primary_type, '') || ' ' || coalesce(sub_type, '')),
+      trim(coalesce(addr_street, '') || ' ' || coalesce(addr_city, '')),
+      addr_zip,
+      'hospital',
+      src_id
+   FROM hospital;
+
+INSERT INTO facility_search (facility_search) VALUES ('optimize');
@@ -0,0 +1,168 @@
+'''
+This module parses the location fields of the raw data into typed
+zip code, latitude and longitude columns
+
+Every parser runs the regular expression once per distinct value of the
+field and broadcasts the result, so repeated locations cost nothing.
+'''
+
+import pandas as pd
+import schema
+
+NUMBER = r"-?\d+(?:\.\d*)?"
+
+# {'type': 'Point', 'coordinates': [-87.625473, 41.880112]}
+POINT_PATTERN = (r"\[\s*(?P<longitude>{0})\s*,\s*(?P<latitude>{0})\s*\]"
+                 .format(NUMBER))
+
+# {'latitude': '41.82', 'longitude': '-87.60', 'human_address':
+#  '{"address": "3753 S. Cottage Grove", ..., "zip": "60653"}'}
+LOCATION_1_PATTERN = (r"'latitude':\s*'(?P<latitude>{0})'.*?"
+                      r"'longitude':\s*'(?P<longitude>{0})'.*?"
+                      r"\"address\":\s*\"(?P<address>[^\"]*)\".*?"
+                      r"\"zip\":\s*\"(?P<zip_code>[^\"]*)\"".format(NUMBER))
+
+# 41.8967452,-87.6216242
+LAT_LONG_PATTERN = (r"^\s*(?P<latitude>{0})\s*,\s*(?P<longitude>{0})\s*$"
+                    .format(NUMBER))
+
+GEO_TYPES = {"address": "object",
+             "zip_code": schema.ZIP,
+             "latitude": schema.COORD,
+             "longitude": schema.COORD}
+
+
+def extract_fields(series, pattern):
+    '''
+    Applies a regular expression with named groups to every distinct value
+    of a series and broadcasts the matches back to all rows
+
+    Inputs:
+        series: pandas Series of location strings (or dicts from the API)
+        pattern: str, regular expression with named groups
+    Returns:
+        pandas DataFrame with one typed column per named group,
+        indexed like series
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        uniques = series.cat.categories.astype(str)
+    else:
+        codes, uniques = pd.factorize(series.astype(str))
+
+    parsed = pd.Series(uniques).str.extract(pattern)
+    missing = pd.DataFrame([[None] * parsed.shape[1]],
+                           columns=parsed.columns)
+    # codes of -1 (missing values) pick the all-missing last row
+    parsed = pd.concat([parsed, missing], ignore_index=True)
+
+    fields = parsed.iloc[codes].reset_index(drop=True)
+    fields.index = series.index
+    for col in fields.columns:
+        if GEO_TYPES[col] == schema.COORD:
+            fields[col] = pd.to_numeric(fields[col])
+    return fields.astype({col: GEO_TYPES[col] for col in fields.columns})
+
+
+def parse_point(series):
+    '''
+    Parses Socrata point strings into latitude and longitude
+
+    Inputs:
+        series: pandas Series, e.g. covid_case_num.zip_code_location
+    Returns:
+        pandas DataFrame with latitude and longitude columns
+    '''
+    return extract_fields(series, POINT_PATTERN)[["latitude", "longitude"]]
+
+
+def parse_location_1(series):
+    '''
+    Parses the location_1 field of health_centers
+
+    Inputs:
+        series: pandas Series, health_centers.location_1
+    Returns:
+        pandas DataFrame with address, zip_code, latitude and longitude
+        columns
+    '''
+    fields = extract_fields(series, LOCATION_1_PATTERN)
+    return fields[["address", "zip_code", "latitude", "longitude"]]
+
+
+def parse_lat_long(series):
+    '''
+    Parses the "lat,long" field of hospital
+
+    Inputs:
+        series: pandas Series, hospital.lat_long
+    Returns:
+        pandas DataFrame with latitude and longitude columns
+    '''
+    return extract_fields(series, LAT_LONG_PATTERN)
+
+
+def replace_location(df, column, parser):
+    '''
+    Replaces a raw location column by the typed columns parsed from it
+
+    Inputs:
+        df: pandas DataFrame
+        column: str, name of the raw location column
+        parser: function turning the column into a DataFrame
+    Returns:
+        pandas DataFrame without column and with the parsed columns
+    '''
+    parsed = parser(df[column])
+    df = df.drop(columns=[column] + [col for col in parsed.columns
+                                     if col in df.columns])
+    return pd.concat([df, parsed], axis=1)
+
+
+def parse_health_centers(health_centers):
+    '''
+    Adds address, zip_code, latitude and longitude to health_centers and
+    drops location_1
+    '''
+    return replace_location(health_centers, "location_1", parse_location_1)
+
+
+def parse_hospitals(hospital):
+    '''
+    Adds latitude and longitude to hospital and drops lat_long
+    '''
+    return replace_location(hospital, "lat_long", parse_lat_long)
+
+
+def parse_vaccination_sites(covid_vaccination_sites):
+    '''
+    Adds latitude and longitude to covid_vaccination_sites and drops
+    location
+    '''
+    return replace_location(covid_vaccination_sites, "location", parse_point)
+
+
+def zip_locations(*frames, zip_name="zip_code",
+                  location_name="zip_code_location"):
+    '''
+    Builds one row of coordinates per zip code from the repeated
+    zip_code_location strings of the case and vaccine tables
+
+    Inputs:
+        frames: pandas DataFrames with zip code and location columns
+        zip_name (str): Name of the column containing zip codes
+        location_name (str): Name of the column containing the locations
+    Returns:
+        pandas DataFrame with zip_code, latitude and longitude columns
+    '''
+    points = []
+    for df in frames:
+        first = df[[zip_name, location_name]].drop_duplicates(zip_name)
+        coords = parse_point(first[location_name])
+        coords.insert(0, "zip_code", first[zip_name].astype(str))
+        points.append(coords)
+
+    locations = pd.concat(points, ignore_index=True)
+    locations = locations.dropna().drop_duplicates("zip_code")
+    locations = locations.sort_values("zip_code").reset_index(drop=True)
+    return schema.apply_schema(locations, "zip_locations")
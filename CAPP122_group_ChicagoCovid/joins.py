@@ -0,0 +1,97 @@
+'''
+This module joins many DataFrames on a shared key in a single pass
+
+Every source is indexed by the key once and aligned to the keys of the
+base table, and the aligned columns are concatenated together, instead
+of copying the growing wide table at every pairwise merge.
+'''
+
+import numpy as np
+import pandas as pd
+import schema
+
+
+def index_by_key(df, key, name):
+    '''
+    Indexes a source by its key column
+
+    Inputs:
+        df (Pandas DataFrame): source table
+        key (str): name of the key column
+        name (str): name of the source, used in error messages
+    Returns:
+        Pandas DataFrame indexed by the key as strings, without the key
+    '''
+    indexed = df.set_index(df[key].astype(str)).drop(columns = key)
+    if not indexed.index.is_unique:
+        raise ValueError("Source {} has repeated {} values".format(name, key))
+    return indexed
+
+
+def join_on_key(base, sources, key = "zip_code", how = "left", fill = None):
+    '''
+    Joins several sources to a base table on a shared key column, giving
+    the same rows and columns as successive pd.merge calls
+
+    Inputs:
+        base (Pandas DataFrame): table whose rows are kept
+        sources (dict): name of each source mapped to its DataFrame, in
+            the order the columns should appear. Keys must be unique.
+        key (str): name of the key column present in every table
+        how (str): "left" keeps every base row, "inner" only the rows
+            whose key is in every source
+        fill (dict, optional): name of a source mapped to the value
+            used for the base rows missing from that source
+
+    Returns:
+        Pandas DataFrame
+    '''
+    if how not in ("left", "inner"):
+        raise ValueError("how must be 'left' or 'inner'")
+    fill = fill or {}
+
+    indexed = {name: index_by_key(df, key, name)
+               for name, df in sources.items()}
+    keys = pd.Index(base[key].astype(str))
+
+    if how == "inner":
+        keep = np.ones(len(keys), dtype = bool)
+        for df in indexed.values():
+            keep &= keys.isin(df.index)
+        base = base[keep]
+        keys = keys[keep]
+
+    columns = [base.reset_index(drop = True)]
+    for name, df in indexed.items():
+        aligned = df.reindex(keys)
+        if name in fill:
+            aligned = aligned.fillna(fill[name])
+        columns.append(aligned.reset_index(drop = True))
+
+    return pd.concat(columns, axis = 1)
+
+
+def join_weekly(case_num, weekly_vaccine):
+    '''
+    Joins the weekly case numbers of every zip code with its vaccines of
+    the same ISO year and week
+
+    Inputs:
+        case_num (Pandas DataFrame): weekly case numbers, with locations
+        weekly_vaccine (Pandas DataFrame): see aggregation.weekly_rollup
+
+    Returns:
+        Pandas DataFrame sorted by zip code and week, without locations
+    '''
+    ts = case_num.copy()
+    ts["year"] = ts.week_end.dt.isocalendar().year.astype(schema.YEAR)
+
+    ts = pd.merge(ts, weekly_vaccine,
+                  left_on = ["zip_code", "year", "week_number"],
+                  right_on = ["zip_code", "year", "week_number"],
+                  how = "left")
+
+    ts = ts.sort_values(by = ["zip_code", "week_end"])
+
+    # Coordinates are kept once per zip code instead of once per row
+    return ts.drop("zip_code_location", axis = 1)
@@ -0,0 +1,403 @@
+'''
+This module load-tests the dashboard: it starts dashboard_pca locally and
+replays scripted user sessions from many concurrent virtual users, posting
+to the _dash-update-component endpoint exactly as the browser does
+
+Callbacks and component values are discovered from the running app
+(_dash-dependencies and _dash-layout). A session loads the page, which
+fires every callback, then goes through SESSION: every step changes one
+component, fires all the callbacks listening to it at once, and waits a
+random think time. Latencies and throughput are reported by callback, and
+compared to a saved baseline.
+
+The requests of the first seconds of a run warm the server's caches up
+and are not recorded. A callback regresses when a percentile exceeds
+the baseline by both the relative tolerance and an absolute slack. A
+percentile is only compared when both runs have MIN_TAIL calls above it,
+and throughput when both have MIN_TAIL calls, so that two runs of the
+same code pass.
+
+Usage:
+    python load_test.py --users 20 --duration 60 --save-baseline base.json
+    python load_test.py --users 20 --duration 60 --baseline base.json
+The second run exits with status 1 if any callback regressed.
+'''
+
+import argparse
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+import requests
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER = ("import dashboard_pca; "
+          "dashboard_pca.app.run_server(host='{}', port={}, debug=False)")
+STARTUP_SECONDS = 300
+TIMEOUT_SECONDS = 60
+
+# every step changes one component: "pick" selects another option of a
+# dropdown, "drag" moves a range slider in DRAG_STEPS updates, "type"
+# enters a number in an input, within its min and max or TYPED_RANGE
+SESSION = [("pick", "crossfilter-zipcode-ts"),
+           ("drag", "week-slider"),
+           ("pick", "crossfilter-var-ts"),
+           ("pick", "crossfilter-var-pred"),
+           ("pick", "scenario-input"),
+           ("type", "scenario-value"),
+           ("pick", "crossfilter-zipcode-ts"),
+           ("pick", "crossfilter-knn-pred"),
+           ("pick", "crossfilter-pca-axis"),
+           ("type", "scenario-value"),
+           ("drag", "week-slider"),
+           ("pick", "crossfilter-zipcode-ts")]
+DRAG_STEPS = 3
+TYPED_RANGE = (0, 100)
+
+PERCENTILES = [50, 95, 99]
+TOLERANCE = 0.2 # allowed relative regression against the baseline
+SLACK_MS = 50 # allowed absolute regression of a percentile
+MIN_TAIL = 10 # calls above a percentile in both runs before comparing it
+WARMUP_SECONDS = 10
+
+
+def start_server(host, port):
+    '''
+    Starts the dashboard in a new process and waits until it serves
+
+    Returns:
+        subprocess.Popen of the server
+    '''
+    server = subprocess.Popen([sys.executable, "-c",
+                               SERVER.format(host, port)], cwd=PROJECT_DIR)
+    url = "http://{}:{}".format(host, port)
+    deadline = time.time() + STARTUP_SECONDS
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The dashboard exited while starting")
+        try:
+            if requests.get(url + "/_dash-layout", timeout=5).ok:
+                return server
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("The dashboard did not start in time")
+
+
+def component_props(layout):
+    '''
+    Collects the properties of every component with an id of a layout
+
+    Inputs:
+        layout: dict, the JSON of _dash-layout
+    Returns:
+        dictionary of props by component id
+    '''
+    props = {}
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict) and "props" in node:
+            if "id" in node["props"]:
+                props[node["props"]["id"]] = node["props"]
+            stack.append(node["props"].get("children"))
+    return props
+
+
+def callback_label(output):
+    '''
+    Names a callback by its outputs, "..a.figure...b.figure.." for many
+    '''
+    return "+".join(part for part in output.strip(".").split("...") if part)
+
+
+class Dashboard:
+    '''
+    The callbacks and initial component values of a running dashboard
+    '''
+
+    def __init__(self, url):
+        self.url = url
+        self.callbacks = requests.get(url + "/_dash-dependencies",
+                                      timeout=TIMEOUT_SECONDS).json()
+        self.props = component_props(requests.get(
+            url + "/_dash-layout", timeout=TIMEOUT_SECONDS).json())
+
+    def initial_values(self):
+        '''
+        Returns the value of every component when the page loads
+        '''
+        return {component: props.get("value")
+                for component, props in self.props.items()}
+
+    def listening(self, component):
+        '''
+        Returns the callbacks with the value of a component as input
+        '''
+        return [callback for callback in self.callbacks
+                if {"id": component, "property": "value"} in
+                [{"id": i["id"], "property": i["property"]}
+                 for i in callback["inputs"]]]
+
+    def payload(self, callback, values, changed):
+        '''
+        Builds the body the browser posts to run a callback
+        '''
+        def props(items):
+            return [dict(item, value=values.get(item["id"]))
+                    for item in items]
+        return {"output": callback["output"],
+                "inputs": props(callback["inputs"]),
+                "state": props(callback.get("state", [])),
+                "changedPropIds": [component + ".value"
+                                   for component in changed]}
+
+
+class Recorder:
+    '''
+    Latencies and errors of the requests of every callback
+    '''
+
+    def __init__(self, since=0):
+        self.since = since
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, label, started, seconds, ok):
+        '''
+        Records one request, unless it started before self.since, a
+        time.time() during the warm-up
+        '''
+        if started < self.since:
+            return
+        with self._lock:
+            self.latencies.setdefault(label, []).append(seconds)
+            self.errors[label] = self.errors.get(label, 0) + (not ok)
+
+    def summary(self, duration):
+        '''
+        Summarises every callback
+
+        Inputs:
+            duration (float): wall time of the run in seconds
+        Returns:
+            dictionary by callback of count, errors, p50, p95 and p99 in
+            milliseconds and throughput in requests per second
+        '''
+        summary = {}
+        for label, latencies in sorted(self.latencies.items()):
+            stats = {"count": len(latencies),
+                     "errors": self.errors[label],
+                     "throughput": len(latencies) / duration}
+            for p, value in zip(PERCENTILES, np.percentile(
+                    np.array(latencies) * 1000, PERCENTILES)):
+                stats["p{}".format(p)] = value
+            summary[label] = stats
+        return summary
+
+
+def post_callback(session, dashboard, recorder, callback, values, changed):
+    '''
+    Runs one callback on the server and records its latency
+    '''
+    body = dashboard.payload(callback, values, changed)
+    started = time.time()
+    start = time.perf_counter()
+    try:
+        response = session.post(dashboard.url + "/_dash-update-component",
+                                json=body, timeout=TIMEOUT_SECONDS)
+        ok = response.status_code in (200, 204)
+    except requests.RequestException:
+        ok = False
+    recorder.record(callback_label(callback["output"]), started,
+                    time.perf_counter() - start, ok)
+
+
+def next_values(dashboard, action, component, values, rng):
+    '''
+    Lists the successive values of a component during one step
+    '''
+    props = dashboard.props[component]
+    if action == "pick":
+        options = [option["value"] for option in props.get("options", [])
+                   if option["value"] != values[component]]
+        return [options[rng.integers(len(options))]] if options else []
+    if action == "type":
+        low = props.get("min", TYPED_RANGE[0])
+        high = props.get("max", TYPED_RANGE[1])
+        return [round(float(rng.uniform(low, high)), 2)]
+    low, high = props["min"], props["max"]
+    ends = np.sort(rng.integers(low, high + 1, 2))
+    start = values[component] or [low, high]
+    return [[int(round(a + (b - a) * step / DRAG_STEPS))
+             for a, b in zip(start, ends)]
+            for step in range(1, DRAG_STEPS + 1)]
+
+
+def virtual_user(dashboard, recorder, pool, stop_at, think, seed):
+    '''
+    Replays sessions until stop_at, firing the callbacks of every step
+    concurrently like the browser
+
+    Inputs:
+        dashboard: Dashboard
+        recorder: Recorder
+        pool: ThreadPoolExecutor sending the requests
+        stop_at (float): time.time() at which to stop
+        think (float): longest pause between two steps, in seconds
+        seed (int): seed of the choices of this user
+    '''
+    rng = np.random.default_rng(seed)
+    session = requests.Session()
+
+    def fire(callbacks, values, changed):
+        futures = [pool.submit(post_callback, session, dashboard, recorder,
+                               callback, dict(values), changed)
+                   for callback in callbacks]
+        concurrent.futures.wait(futures)
+
+    while time.time() < stop_at:
+        values = dashboard.initial_values()
+        fire(dashboard.callbacks, values, [])
+        for action, component in SESSION:
+            if time.time() >= stop_at:
+                break
+            time.sleep(rng.uniform(0, think))
+            for value in next_values(dashboard, action, component, values,
+                                     rng):
+                values[component] = value
+                fire(dashboard.listening(component), values, [component])
+
+
+def run_load(url, users, duration, think, seed=0, warmup=WARMUP_SECONDS):
+    '''
+    Runs concurrent virtual users against a dashboard
+
+    Inputs:
+        url (str): address of the running dashboard
+        users (int): number of virtual users
+        duration (float): seconds of the run, after the warm-up
+        think (float): longest pause of a user between two steps
+        seed (int): seed of the sessions
+        warmup (float): seconds of requests not recorded
+    Returns:
+        dictionary by callback, see Recorder.summary
+    '''
+    dashboard = Dashboard(url)
+    recorder = Recorder(since=time.time() + warmup)
+    stop_at = recorder.since + duration
+    # a browser sends up to 6 requests to the same server at once
+    with concurrent.futures.ThreadPoolExecutor(users * 6) as pool:
+        threads = [threading.Thread(target=virtual_user,
+                                    args=(dashboard, recorder, pool, stop_at,
+                                          think, seed + i))
+                   for i in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return recorder.summary(duration)
+
+
+def regressions(summary, baseline, tolerance=TOLERANCE, slack_ms=SLACK_MS,
+                min_tail=MIN_TAIL):
+    '''
+    Compares a run to a baseline run
+
+    Inputs:
+        summary, baseline: dictionaries by callback, see Recorder.summary
+        tolerance (float): allowed relative regression
+        slack_ms (float): allowed absolute regression of a percentile
+        min_tail (int): calls above a percentile in both runs before it
+            is compared, e.g. 200 calls for p95 if min_tail is 10
+    Returns:
+        list of str, one per regressed number
+    '''
+    found = []
+    for label, base in baseline.items():
+        stats = summary.get(label)
+        if stats is None:
+            found.append("{}: not called".format(label))
+            continue
+        if stats["errors"] > base["errors"]:
+            found.append("{}: {} errors".format(label, stats["errors"]))
+        count = min(stats["count"], base["count"])
+        if count < min_tail:
+            continue
+        for p in PERCENTILES:
+            key = "p{}".format(p)
+            if count * (100 - p) < min_tail * 100:
+                continue
+            if stats[key] > base[key] * (1 + tolerance) + slack_ms:
+                found.append("{}: {} {:.1f} ms, baseline {:.1f} ms".format(
+                    label, key, stats[key], base[key]))
+        if stats["throughput"] < base["throughput"] * (1 - tolerance):
+            found.append("{}: {:.2f} req/s, baseline {:.2f} req/s".format(
+                label, stats["throughput"], base["throughput"]))
+    return found
+
+
+def print_summary(summary):
+    print("{:<60} {:>6} {:>6} {:>8} {:>8} {:>8} {:>7}".format(
+        "callback", "count", "errors", "p50 ms", "p95 ms", "p99 ms",
+        "req/s"))
+    for label, stats in summary.items():
+        print("{:<60} {:>6} {:>6} {:>8.1f} {:>8.1f} {:>8.1f} {:>7.2f}".format(
+            label, stats["count"], stats["errors"], stats["p50"],
+            stats["p95"], stats["p99"], stats["throughput"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the dashboard")
+    parser.add_argument("--url", help="test a running dashboard instead of "
+                                      "starting one")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--think", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="baseline to compare to")
+    parser.add_argument("--save-baseline", help="file to save the run to")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--slack-ms", type=float, default=SLACK_MS)
+    parser.add_argument("--min-tail", type=int, default=MIN_TAIL)
+    parser.add_argument("--warmup", type=float, default=WARMUP_SECONDS)
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server = start_server("127.0.0.1", args.port)
+        url = "http://127.0.0.1:{}".format(args.port)
+    try:
+        summary = run_load(url, args.users, args.duration, args.think,
+                           args.seed, args.warmup)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_summary(summary)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(summary, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(summary, json.load(f), args.tolerance,
+                                args.slack_ms, args.min_tail)
+        for regression in found:
+            print("REGRESSION", regression)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
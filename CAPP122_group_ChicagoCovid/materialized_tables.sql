@@ -0,0 +1,92 @@
+-- Rebuilt inside the same transaction that swaps in new case or vaccine data
+
+CREATE INDEX IF NOT EXISTS idx_covid_case_num_zip_week
+   ON covid_case_num (zip_code, week_end);
+
+-- Rows loaded since its last run, read by anomalies.py
+CREATE INDEX IF NOT EXISTS idx_covid_case_num_loaded
+   ON covid_case_num (loaded_at);
+
+CREATE INDEX IF NOT EXISTS idx_covid_vaccination_num_zip_date
+   ON covid_vaccination_num (zip_code, date);
+
+
+-- Daily vaccinations rolled up by ISO year and week. The Thursday of a
+-- date's ISO week decides both its ISO year and its ISO week number.
+DROP TABLE IF EXISTS weekly_vaccine;
+
+CREATE TABLE weekly_vaccine AS
+   SELECT zip_code,
+      CAST(strftime('%Y', thursday) AS INTEGER) AS year,
+      (CAST(strftime('%j', thursday) AS INTEGER) - 1) / 7 + 1 AS week_number,
+      SUM(total_doses_daily) AS total_doses_daily,
+      MAX(total_doses_cumulative) AS total_doses_cumulative,
+      SUM(_1st_dose_daily) AS _1st_dose_daily,
+      MAX(_1st_dose_cumulative) AS _1st_dose_cumulative,
+      MAX(_1st_dose_percent_population) AS _1st_dose_percent_population,
+      SUM(vaccine_series_completed_daily) AS vaccine_series_completed_daily,
+      MAX(vaccine_series_completed_cumulative)
+         AS vaccine_series_completed_cumulative,
+      MAX(vaccine_series_completed_percent_population)
+         AS vaccine_series_completed_percent_population,
+      MAX(date) AS date
+   FROM (SELECT *, date(date, '-3 days', 'weekday 4') AS thursday
+         FROM covid_vaccination_num)
+   GROUP BY zip_code, year, week_number;
+
+CREATE UNIQUE INDEX idx_weekly_vaccine_zip_week
+   ON weekly_vaccine (zip_code, year, week_number);
+
+
+-- Row of the latest week by zip code
+DROP TABLE IF EXISTS latest_case_by_zip;
+
+CREATE TABLE latest_case_by_zip AS
+   SELECT * FROM
+      (SELECT *, ROW_NUMBER() OVER
+          (PARTITION BY zip_code ORDER BY week_end DESC) AS week_rank
+       FROM covid_case_num)
+   WHERE week_rank = 1;
+
+CREATE UNIQUE INDEX idx_latest_case_by_zip ON latest_case_by_zip (zip_code);
+
+
+DROP TABLE IF EXISTS latest_vaccine_by_zip;
+
+CREATE TABLE latest_vaccine_by_zip AS
+   SELECT * FROM
+      (SELECT *, ROW_NUMBER() OVER
+          (PARTITION BY zip_code ORDER BY year DESC, week_number DESC)
+          AS week_rank
+       FROM weekly_vaccine)
+   WHERE week_rank = 1;
+
+CREATE UNIQUE INDEX idx_latest_vaccine_by_zip
+   ON latest_vaccine_by_zip (zip_code);
+
+
+-- Weekly cases joined to the vaccines of the same ISO year and week
+DROP TABLE IF EXISTS ts_joint;
+
+CREATE TABLE ts_joint AS
+   SELECT c.*,
+      v.total_doses_daily,
+      v.total_doses_cumulative,
+      v._1st_dose_daily,
+      v._1st_dose_cumulative,
+      v._1st_dose_percent_population,
+      v.vaccine_series_completed_daily,
+      v.vaccine_series_completed_cumulative,
+      v.vaccine_series_completed_percent_population,
+      v.date
+   FROM (SELECT *,
+            CAST(strftime('%Y', date(week_end, '-3 days', 'weekday 4'))
+               AS INTEGER) AS year
+         FROM covid_case_num) AS c
+   LEFT JOIN weekly_vaccine AS v
+      ON v.zip_code = c.zip_code
+      AND v.year = c.year
+      AND v.week_number = CAST(c.week_number AS INTEGER)
+   ORDER BY c.zip_code, c.week_end;
+
+CREATE INDEX idx_ts_joint_zip_week ON ts_joint (zip_code, week_end);
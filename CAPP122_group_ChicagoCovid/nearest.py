@@ -0,0 +1,251 @@
+'''
+This module answers nearest-facility and within-radius queries from any
+zip code centroid or point, using KD-trees over the facility coordinates
+
+Coordinates are projected onto the unit sphere, where the straight-line
+(chord) distance grows with the great-circle distance, so the tree
+returns exact great-circle neighbours.
+'''
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+import geo
+import schema
+
+EARTH_RADIUS_KM = 6367 # same radius as data_analyzing.haversine
+
+FACILITY_TYPES = ["vaccination_site", "health_center", "hospital"]
+
+
+def unit_vectors(lat, lon):
+    '''
+    Projects coordinates in decimal degrees onto the unit sphere
+
+    Inputs:
+        lat, lon: array-likes of latitudes and longitudes
+    Returns:
+        numpy array (n, 3)
+    '''
+    lat = np.radians(np.asarray(lat, dtype="float64"))
+    lon = np.radians(np.asarray(lon, dtype="float64"))
+    return np.column_stack([np.cos(lat) * np.cos(lon),
+                            np.cos(lat) * np.sin(lon),
+                            np.sin(lat)])
+
+
+def chord_to_km(chord):
+    '''
+    Converts chord lengths on the unit sphere to great-circle kilometres
+    '''
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def km_to_chord(km):
+    '''
+    Converts great-circle kilometres to chord lengths on the unit sphere
+    '''
+    return 2 * np.sin(np.minimum(km / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+def load_facilities():
+    '''
+    Gathers the vaccination sites, health centers and hospitals of the raw
+    data with their coordinates
+
+    Returns:
+        pandas DataFrame with name, facility_type, zip_code, latitude and
+        longitude columns
+    '''
+    sites = geo.parse_vaccination_sites(
+        schema.read_raw("covid_vaccination_sites"))
+    sites = sites.rename(columns={"facility_name": "name",
+                                  "postal_code": "zip_code"})
+    sites["facility_type"] = "vaccination_site"
+
+    centers = geo.parse_health_centers(schema.read_raw("health_centers"))
+    centers = centers.rename(columns={"facility": "name"})
+    centers["facility_type"] = "health_center"
+
+    hospitals = geo.parse_hospitals(schema.read_raw("hospital"))
+    hospitals = hospitals.rename(columns={"addr_zip": "zip_code"})
+    hospitals["facility_type"] = "hospital"
+
+    columns = ["name", "facility_type", "zip_code", "latitude", "longitude"]
+    facilities = pd.concat([df[columns] for df in [sites, centers, hospitals]],
+                           ignore_index=True)
+    facilities["zip_code"] = facilities["zip_code"].astype(str)
+    return facilities.dropna(subset=["latitude", "longitude"]). \
+        reset_index(drop=True)
+
+
+def load_zip_centroids():
+    '''
+    Reads the centroid of every Chicago zip code
+
+    Returns:
+        pandas DataFrame indexed by zip code with latitude and longitude
+    '''
+    coor = schema.read_raw("zip_coordinates")
+    coor = coor.rename(columns={"Zip": "zip_code", "Latitude": "latitude",
+                                "Longitude": "longitude"})
+    coor["zip_code"] = coor["zip_code"].astype(str)
+    return coor.drop_duplicates("zip_code").set_index("zip_code")
+
+
+class FacilityIndex:
+    '''
+    KD-trees over all facilities and over each facility type
+    '''
+
+    def __init__(self, facilities=None, centroids=None):
+        if facilities is None:
+            facilities = load_facilities()
+        if centroids is None:
+            centroids = load_zip_centroids()
+        self.facilities = facilities.reset_index(drop=True)
+        self.centroids = centroids
+        # single queries index plain arrays: pandas lookups and row
+        # selection would cost ten times the tree query
+        self.origins = dict(zip(centroids.index, unit_vectors(
+            centroids["latitude"], centroids["longitude"])))
+        self.columns = {col: self.facilities[col].to_numpy()
+                        for col in self.facilities.columns}
+
+        vectors = unit_vectors(self.facilities["latitude"],
+                               self.facilities["longitude"])
+        self.trees = {None: (cKDTree(vectors),
+                             np.arange(len(self.facilities)))}
+        by_type = self.facilities.groupby("facility_type").indices
+        # types without facilities get an empty tree, not an unknown type
+        for facility_type in set(FACILITY_TYPES) | set(by_type):
+            rows = by_type.get(facility_type, np.array([], dtype="int64"))
+            self.trees[facility_type] = (cKDTree(vectors[rows]), rows)
+
+    def origin(self, zip_code=None, point=None):
+        '''
+        Resolves a query origin given as a zip code or a (lat, lon) point
+
+        Returns:
+            numpy array (3,), unit vector of the origin
+        '''
+        if point is None:
+            if str(zip_code) not in self.origins:
+                raise ValueError("zipcode not in Chicago")
+            return self.origins[str(zip_code)]
+        return unit_vectors([point[0]], [point[1]])[0]
+
+    def tree(self, facility_type):
+        '''
+        Returns the tree and facility rows of one facility type
+        '''
+        if facility_type not in self.trees:
+            raise ValueError("Unknown facility type {}".format(facility_type))
+        return self.trees[facility_type]
+
+    def ranks(self, k, rows):
+        '''
+        Lists the neighbour ranks to query, at most one per facility
+        '''
+        if k < 0:
+            raise ValueError("k must not be negative")
+        return list(range(1, min(k, len(rows)) + 1))
+
+    def results(self, rows, chords):
+        '''
+        Builds the result table of facility rows and their distances
+        '''
+        found = {col: values[rows] for col, values in self.columns.items()}
+        found["distance_km"] = chord_to_km(np.asarray(chords))
+        return pd.DataFrame(found)
+
+    def nearest(self, k=1, facility_type=None, zip_code=None, point=None):
+        '''
+        Finds the k facilities nearest to a zip code centroid or a point
+
+        Inputs:
+            k (int): number of facilities
+            facility_type (str, optional): one of FACILITY_TYPES
+            zip_code (int or str, optional): origin zip code
+            point (tuple, optional): origin (latitude, longitude)
+        Returns:
+            pandas DataFrame of facilities with distance_km, nearest first
+        '''
+        tree, rows = self.tree(facility_type)
+        ranks = self.ranks(k, rows)
+        origin = self.origin(zip_code, point)
+        if not ranks:
+            return self.results(rows[:0], np.empty(0))
+        chords, idx = tree.query(origin, k=ranks)
+        return self.results(rows[idx], chords)
+
+    def within(self, radius_km, facility_type=None, zip_code=None,
+               point=None):
+        '''
+        Finds the facilities within a radius of a zip code centroid or a
+        point
+
+        Inputs:
+            radius_km (float): radius in kilometres
+            facility_type (str, optional): one of FACILITY_TYPES
+            zip_code (int or str, optional): origin zip code
+            point (tuple, optional): origin (latitude, longitude)
+        Returns:
+            pandas DataFrame of facilities with distance_km, nearest first
+        '''
+        tree, rows = self.tree(facility_type)
+        origin = self.origin(zip_code, point)
+        idx = np.asarray(tree.query_ball_point(origin, km_to_chord(radius_km)),
+                         dtype="int64")
+        chords = np.linalg.norm(tree.data[idx] - origin, axis=1)
+        order = np.argsort(chords)
+        return self.results(rows[idx[order]], chords[order])
+
+    def nearest_distances(self, k=1, facility_type=None, zip_codes=None):
+        '''
+        Computes the distance from every zip code centroid to its k nearest
+        facilities in one batched query
+
+        Inputs:
+            k (int): number of facilities
+            facility_type (str, optional): one of FACILITY_TYPES
+            zip_codes (list, optional): zip codes, all centroids by default
+        Returns:
+            pandas DataFrame indexed by zip code, one column of kilometres
+            per neighbour rank
+        '''
+        tree, rows = self.tree(facility_type)
+        centroids = self.centroids
+        if zip_codes is not None:
+            centroids = centroids.loc[[str(z) for z in zip_codes]]
+        origins = unit_vectors(centroids["latitude"], centroids["longitude"])
+        ranks = self.ranks(k, rows)
+        if not ranks:
+            return pd.DataFrame(index=centroids.index)
+        chords, _ = tree.query(origins, k=ranks)
+        return pd.DataFrame(chord_to_km(chords), index=centroids.index,
+                            columns=["nearest_{}_km".format(rank)
+                                     for rank in ranks])
+
+
+def distance_to_nearest(index=None):
+    '''
+    Distance from every zip code centroid to its nearest facility of each
+    type, as a zip-keyed table that joins the cross section
+
+    Input:
+        index: FacilityIndex, built from the raw data if not given
+    Returns:
+        pandas DataFrame with zip_code and one km_to_nearest_<type> column
+        per facility type, NaN for types without facilities
+    '''
+    if index is None:
+        index = FacilityIndex()
+    distances = {}
+    for facility_type in FACILITY_TYPES:
+        nearest = index.nearest_distances(1, facility_type)
+        distances["km_to_nearest_" + facility_type] = \
+            nearest.iloc[:, 0] if nearest.shape[1] else \
+            pd.Series(np.nan, index=nearest.index)
+    distances = pd.DataFrame(distances).rename_axis("zip_code").reset_index()
+    return schema.apply_schema(distances, "facility_distances")
@@ -0,0 +1,252 @@
+'''
+This module runs the zip code stages of data_processing out of core, for
+raw case and vaccine files that do not fit in memory
+
+The raw files are streamed in chunks of CHUNK_ROWS rows. A first pass
+reads only their zip code column and counts the rows of every zip code.
+The zip codes are then split into up to BUCKETS buckets of consecutive
+zip codes holding about as many rows each: the raw files are sorted by
+zip code, so the zip codes of one chunk would make lopsided buckets.
+
+Every chunk is reduced to partial aggregates, the weekly vaccine sums and
+maxima and the latest case row of each zip code, and its rows are spilled
+to disk by bucket. A bucket holds all the rows of its zip codes, so the
+partial aggregates are merged and the rolling windows, time series and
+coordinates computed one bucket at a time.
+
+The buckets are taken in zip code order, so the rolling windows, one row
+per raw row, are appended to their snapshot files bucket by bucket and
+never held whole. Only the weekly tables, one row per zip code and week,
+are joined in memory. Memory is bounded by one chunk, the rows of one
+bucket and the weekly tables. A bucket holds about 1 / BUCKETS of the raw
+rows, but never less than the rows of its largest zip code, which cannot
+be split. The outputs are those of the in-memory path.
+
+Run with:
+    python data_processing.py --out-of-core
+'''
+
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+import aggregation
+import geo
+import joins
+import schema
+
+FLAG = "--out-of-core"
+CHUNK_ROWS = 200000
+BUCKETS = 16
+
+# how the partial aggregates of the chunks are merged
+COMBINE = {"sum": "sum", "max": "max", "min": "min"}
+
+VACCINE_COLUMNS = ["zip_code", "date", "population"] + \
+                  aggregation.VACCINE_DAILY
+LOCATION_COLUMNS = ["zip_code", "zip_code_location"]
+
+
+def enabled():
+    '''
+    Tells whether data_processing was asked to run out of core
+    '''
+    return FLAG in sys.argv
+
+
+def zip_counts(table, chunk_rows):
+    '''
+    Counts the rows of every zip code of a raw file, streaming only its
+    zip code column
+
+    Inputs:
+        table: str, name of the raw table, e.g. "covid_case_num"
+        chunk_rows: int, rows read at once
+    Returns:
+        pandas Series of row counts indexed by zip code
+    '''
+    filename, _ = schema.RAW_FILES[table]
+    counts = pd.Series(dtype="int64")
+    for chunk in pd.read_csv(schema.RAWDATA_DIR + filename,
+                             usecols=["zip_code"], dtype=str,
+                             chunksize=chunk_rows):
+        counts = counts.add(chunk["zip_code"].value_counts(), fill_value=0)
+    return counts
+
+
+def bucket_bounds(counts, buckets):
+    '''
+    Picks the zip codes that split the zip codes into buckets of
+    consecutive zip codes holding about as many rows each
+
+    Inputs:
+        counts: pandas Series of row counts indexed by zip code
+        buckets: int, largest number of buckets
+    Returns:
+        numpy array of str, the first zip code of every bucket but the
+        first, in increasing order
+    '''
+    counts = counts.groupby(counts.index.astype(str)).sum().sort_index()
+    zips = counts.index.to_numpy(dtype=str)
+    rows_before = (counts.cumsum() - counts).to_numpy()
+    targets = counts.sum() * np.arange(1, buckets) / buckets
+    first = np.unique(np.searchsorted(rows_before, targets, side="left"))
+    return zips[first[(first > 0) & (first < len(zips))]]
+
+
+def spill(folder, name, df, chunk, bounds):
+    '''
+    Splits the rows of a chunk by bucket and writes every part to disk,
+    empty parts included so that every bucket knows the columns
+
+    Inputs:
+        folder: str, directory of the spilled files
+        name: str, name of the intermediate table
+        df: pandas DataFrame with a zip_code column
+        chunk: int, position of the chunk in the raw file
+        bounds: numpy array, see bucket_bounds
+    '''
+    bucket_ids = np.searchsorted(bounds, np.asarray(df["zip_code"],
+                                                    dtype=str), side="right")
+    for bucket in range(len(bounds) + 1):
+        path = os.path.join(folder, "{}_{}_{:06d}.pkl".format(name, bucket,
+                                                             chunk))
+        df[bucket_ids == bucket].to_pickle(path)
+
+
+def gather(folder, name, bucket):
+    '''
+    Reads back the parts of one bucket of an intermediate table, in the
+    order of the chunks
+
+    Returns:
+        pandas DataFrame
+    '''
+    paths = sorted(glob.glob(os.path.join(folder, "{}_{}_*.pkl".format(
+        name, bucket))))
+    return pd.concat([pd.read_pickle(path) for path in paths],
+                     ignore_index=True)
+
+
+def latest_rows(df, zip_name, time_ind):
+    '''
+    Keeps the row of the latest time of every zip code, the partial
+    aggregate of data_processing.summarise_by_zip_latest
+    '''
+    return df.sort_values(time_ind).groupby(zip_name, observed=True).tail(1)
+
+
+def ordered(df, table, by):
+    '''
+    Casts an output to the types of the in-memory path and sorts its rows
+    like it. Categories are sorted first, as categoricals sort by code.
+
+    Inputs:
+        df: pandas DataFrame
+        table: str, name of the table in schema.SCHEMA
+        by: list of the columns the output is sorted by
+    Returns:
+        pandas DataFrame
+    '''
+    df = schema.sort_categories(schema.apply_schema(df, table))
+    return df.sort_values(by, kind="mergesort").reset_index(drop=True)
+
+
+def finish(pieces, table, by):
+    '''
+    Joins the pieces of an output computed bucket by bucket, in the row
+    order and with the types of the in-memory path. Empty pieces are left
+    out: a join or merge with no rows may order its columns differently.
+    '''
+    pieces = [piece for piece in pieces if len(piece)] or pieces[:1]
+    return ordered(pd.concat(pieces, ignore_index=True), table, by)
+
+
+def zip_tables(agg_funs, chunk_rows=CHUNK_ROWS, buckets=BUCKETS, date=None):
+    '''
+    Streams the raw case and vaccine files and builds every table of
+    data_processing that is computed zip code by zip code. The rolling
+    windows are written to their snapshot files as they are computed.
+
+    Inputs:
+        agg_funs: dict, weekly aggregation function of every vaccine
+            column, each one of COMBINE
+        chunk_rows: int, rows read at once from a raw file
+        buckets: int, largest number of buckets of zip codes
+        date: str or datetime.date, snapshot date of the rolling windows.
+            Defaults to today.
+    Returns:
+        dictionary with the weekly_vaccine, ts and zip_locations tables,
+        and latest_cases, the candidate rows of the latest week of every
+        zip code
+    '''
+    unsupported = set(agg_funs.values()) - set(COMBINE)
+    if unsupported:
+        raise ValueError("Cannot merge partial aggregates of " +
+                         ", ".join(sorted(unsupported)))
+    combine = {col: COMBINE[fun] for col, fun in agg_funs.items()}
+
+    bounds = bucket_bounds(
+        zip_counts("covid_case_num", chunk_rows).add(
+            zip_counts("covid_vaccination_num", chunk_rows), fill_value=0),
+        buckets)
+
+    folder = tempfile.mkdtemp(prefix="spill_")
+    try:
+        latest = []
+        cases = schema.read_raw("covid_case_num", chunksize=chunk_rows)
+        for i, chunk in enumerate(cases):
+            chunk = chunk.drop(["week_start"], axis=1)
+            latest.append(latest_rows(chunk, "zip_code", "week_end"))
+            spill(folder, "cases", chunk, i, bounds)
+
+        vaccines = schema.read_raw("covid_vaccination_num",
+                                   chunksize=chunk_rows)
+        for i, chunk in enumerate(vaccines):
+            weekly = aggregation.weekly_rollup(chunk, agg_funs, "date")
+            spill(folder, "weekly", weekly, i, bounds)
+            spill(folder, "vaccines", chunk[VACCINE_COLUMNS], i, bounds)
+            spill(folder, "locations",
+                  chunk[LOCATION_COLUMNS].drop_duplicates("zip_code"),
+                  i, bounds)
+
+        pieces = {"weekly_vaccine": [], "ts": [], "zip_locations": []}
+        windows = ["zip_code", "day_ordinal"]
+        with schema.DatabaseWriter("vaccine_windows", date) as \
+                vaccine_windows, \
+                schema.DatabaseWriter("case_windows", date) as case_windows:
+            for bucket in range(len(bounds) + 1):
+                case_num = gather(folder, "cases", bucket)
+                vaccine_num = gather(folder, "vaccines", bucket)
+                # the max date of a partial lies in its week, so rolling
+                # the partials up again merges them
+                weekly = aggregation.weekly_rollup(
+                    gather(folder, "weekly", bucket), combine, "date")
+
+                pieces["weekly_vaccine"].append(weekly)
+                pieces["ts"].append(joins.join_weekly(case_num, weekly))
+                pieces["zip_locations"].append(geo.zip_locations(
+                    case_num, gather(folder, "locations", bucket)))
+                # later buckets only hold later zip codes
+                if len(vaccine_num):
+                    vaccine_windows.write(ordered(aggregation.rolling_windows(
+                        vaccine_num, aggregation.VACCINE_DAILY, "date"),
+                        "vaccine_windows", windows))
+                if len(case_num):
+                    case_windows.write(ordered(aggregation.rolling_windows(
+                        case_num, aggregation.CASE_WEEKLY, "week_end"),
+                        "case_windows", windows))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return {"weekly_vaccine": finish(pieces["weekly_vaccine"],
+                                     "weekly_vaccine",
+                                     ["zip_code", "year", "week_number"]),
+            "ts": finish(pieces["ts"], "ts", ["zip_code", "week_end"]),
+            "zip_locations": finish(pieces["zip_locations"],
+                                    "zip_locations", ["zip_code"]),
+            "latest_cases": schema.sort_categories(schema.apply_schema(
+                pd.concat(latest, ignore_index=True), "covid_case_num"))}
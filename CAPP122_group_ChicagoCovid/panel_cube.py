@@ -0,0 +1,171 @@
+'''
+This module stores the time series panel as a dense zip x week x variable
+cube on disk, memory-mapped by its readers
+
+A cube is a directory cubes/<snapshot date>/ holding
+    cube.npy     float32 array, NaN where a zip code has no row for a week
+    index.json   the zip codes, the ISO week ordinal of the first week, the
+                 week ends and the variable names, in axis order
+Weeks are consecutive ISO week ordinals (see aggregation.week_ordinal), so
+the position of a week is its ordinal minus the first one. Every slice
+below is a view of the mapped file: nothing is copied, and processes
+reading the same cube share its pages through the OS page cache.
+'''
+
+import datetime
+import json
+import os
+import numpy as np
+import pandas as pd
+import aggregation
+import schema
+
+CUBE_DIR = "cubes/"
+CUBE = "cube.npy"
+INDEX = "index.json"
+
+# integer columns that locate a row rather than measure something
+KEY_COLUMNS = ["week_number", "year", "row_id"]
+
+
+def cube_path(date):
+    '''
+    Builds the path of the cube of a snapshot
+    '''
+    return CUBE_DIR + str(date) + "/"
+
+
+def cube_variables(ts):
+    '''
+    Lists the numeric variables of a time series panel
+    '''
+    return [col for col in ts.select_dtypes("number").columns
+            if col not in KEY_COLUMNS]
+
+
+def build_cube(ts, date=None):
+    '''
+    Reshapes a long time series panel into the cube of a snapshot
+
+    Inputs:
+        ts: pandas DataFrame with zip_code, week_end and numeric columns,
+            e.g. ts_database
+        date: str or datetime.date, snapshot date. Defaults to today.
+    Returns:
+        str, path of the cube
+    '''
+    if date is None:
+        date = datetime.date.today()
+    ts = ts.reset_index() if "zip_code" not in ts.columns else ts
+    variables = cube_variables(ts)
+
+    zip_codes, zip_idx = np.unique(ts["zip_code"].astype(str),
+                                   return_inverse=True)
+    week_end = pd.to_datetime(ts["week_end"])
+    ordinals = aggregation.week_ordinal(week_end)
+    first = int(ordinals.min())
+    n_weeks = int(ordinals.max()) - first + 1
+    week_idx = ordinals - first
+    # weeks without any row stay NaT
+    week_ends = np.full(n_weeks, np.datetime64("NaT"), dtype="datetime64[ns]")
+    week_ends[week_idx] = week_end.to_numpy()
+
+    path = cube_path(date)
+    staging = schema.staging_directory(path)
+
+    cube = np.lib.format.open_memmap(staging + CUBE, mode="w+",
+                                     dtype="float32",
+                                     shape=(len(zip_codes), n_weeks,
+                                            len(variables)))
+    cube[:] = np.nan
+    for k, var in enumerate(variables):
+        cube[zip_idx, week_idx, k] = ts[var].to_numpy(dtype="float32",
+                                                      na_value=np.nan)
+    cube.flush()
+    del cube
+
+    index = {"zip_codes": zip_codes.tolist(),
+             "first_week_ordinal": first,
+             "week_ends": [None if np.isnat(day) else str(day)[:10]
+                           for day in week_ends],
+             "variables": variables}
+    with open(staging + INDEX, "w") as f:
+        json.dump(index, f, indent=1)
+
+    schema.publish_directory(staging, path)
+    return path
+
+
+class PanelCube:
+    '''
+    A read-only, memory-mapped cube with constant-time lookups of its zip
+    codes, weeks and variables
+    '''
+
+    def __init__(self, path):
+        with open(path + INDEX) as f:
+            index = json.load(f)
+        self.values = np.load(path + CUBE, mmap_mode="r")
+        self.zip_codes = index["zip_codes"]
+        self.first_week_ordinal = index["first_week_ordinal"]
+        self.week_ends = pd.to_datetime(index["week_ends"])
+        self.variables = index["variables"]
+        self._zip_pos = {zip_code: i for i, zip_code
+                         in enumerate(self.zip_codes)}
+        self._var_pos = {var: k for k, var in enumerate(self.variables)}
+
+    def week_position(self, day):
+        '''
+        Finds the position on the week axis of the ISO week of a date
+
+        Inputs:
+            day: str, date or pandas Timestamp in the week
+        Returns:
+            int
+        '''
+        days = (pd.Timestamp(day) - aggregation.EPOCH).days
+        position = days // 7 - self.first_week_ordinal
+        if not 0 <= position < self.values.shape[1]:
+            raise KeyError(day)
+        return position
+
+    def zip_history(self, zip_code):
+        '''
+        Every week and variable of one zip code, weeks x variables
+        '''
+        return self.values[self._zip_pos[str(zip_code)]]
+
+    def week(self, day):
+        '''
+        Every zip code and variable of one week, zips x variables
+        '''
+        return self.values[:, self.week_position(day)]
+
+    def variable(self, var):
+        '''
+        The full panel of one variable, zips x weeks
+        '''
+        return self.values[:, :, self._var_pos[var]]
+
+    def series(self, zip_code, var):
+        '''
+        The weekly series of one variable in one zip code
+        '''
+        return self.values[self._zip_pos[str(zip_code)], :,
+                           self._var_pos[var]]
+
+
+def read_cube(date):
+    '''
+    Opens the cube of a snapshot
+
+    Inputs:
+        date: str or datetime.date, snapshot date
+    Returns:
+        PanelCube, or None if the snapshot has no cube
+    '''
+    path = cube_path(date)
+    if not os.path.exists(path + INDEX):
+        return None
+    # resolved once, so a cube published meanwhile is not read half
+    return PanelCube(os.path.realpath(path) + "/")
@@ -0,0 +1,205 @@
+'''
+This module fits a trend model to the weekly series of every zip code of
+the time series panel:
+    - the growth rate of the last GROWTH_WEEKS weeks, from a log-linear
+      regression, with the matching doubling time
+    - a continuous log-linear trend with one changepoint, chosen by least
+      squares among the weeks leaving MIN_SEGMENT weeks on either side
+
+The panel is reshaped into one zip x week array per variable and written
+to a memory-mapped file. Worker processes open it read-only and each fits
+a chunk of zip codes, so the data is shared through the page cache
+instead of being copied to every worker.
+
+Run after data_processing:
+    python panel_models.py
+'''
+
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import schema
+
+TREND_VARIABLES = ["cases_weekly", "deaths_weekly", "tests_weekly"]
+
+GROWTH_WEEKS = 6
+MIN_SEGMENT = 4
+CHUNK_ZIPS = 256
+RIDGE = 1e-9
+
+
+def panel_arrays(ts, variables):
+    '''
+    Reshapes the long time series panel into dense arrays
+
+    Inputs:
+        ts: pandas DataFrame with zip_code, week_end and the variables
+        variables: list of column names
+    Returns:
+        (zip codes, week ends, numpy array variables x zips x weeks with
+        NaN where a zip code has no row)
+    '''
+    zip_codes, zip_idx = np.unique(ts["zip_code"].astype(str),
+                                   return_inverse=True)
+    week_ends, week_idx = np.unique(ts["week_end"].to_numpy(),
+                                    return_inverse=True)
+    values = np.full((len(variables), len(zip_codes), len(week_ends)),
+                     np.nan)
+    for i, var in enumerate(variables):
+        values[i, zip_idx, week_idx] = ts[var].to_numpy(dtype="float64",
+                                                        na_value=np.nan)
+    return zip_codes, week_ends, values
+
+
+def log_values(values):
+    '''
+    Takes the log of the values plus half their smallest positive value, so
+    that zeros stay finite; the offset is 0.5 for counts
+    '''
+    positive = values[values > 0]
+    offset = positive.min() / 2 if positive.size else 0.5
+    return np.log(np.maximum(values, 0) + offset)
+
+
+def weighted_fits(y, weights, basis):
+    '''
+    Least squares fits of one basis to many series at once
+
+    Inputs:
+        y: numpy array zips x weeks, with 0 where weights are 0
+        weights: numpy array zips x weeks of 0/1 observation weights
+        basis: numpy array weeks x p
+    Returns:
+        (coefficients zips x p, sums of squared residuals zips)
+    '''
+    weeks, p = basis.shape
+    outer = (basis[:, :, None] * basis[:, None, :]).reshape(weeks, p * p)
+    xtwx = (weights @ outer).reshape(-1, p, p)
+    xtwy = (weights * y) @ basis
+    # a tiny ridge keeps zips with too few weeks from making the batch
+    # singular, their fits are discarded by the callers
+    coef = np.linalg.solve(xtwx + RIDGE * np.eye(p), xtwy[:, :, None])
+    coef = coef[:, :, 0]
+    residuals = weights * (y - coef @ basis.T)
+    return coef, np.sum(residuals ** 2, axis=1)
+
+
+def fit_trends(series):
+    '''
+    Fits the growth rate and the changepoint trend of many series sharing
+    the same weeks
+
+    Inputs:
+        series: numpy array zips x weeks of log values, NaN if missing
+    Returns:
+        dictionary of numpy arrays of length zips
+    '''
+    n_weeks = series.shape[1]
+    weights = np.isfinite(series).astype("float64")
+    y = np.where(weights > 0, series, 0)
+    t = np.arange(n_weeks, dtype="float64")
+
+    recent = slice(max(n_weeks - GROWTH_WEEKS, 0), n_weeks)
+    line = np.column_stack([np.ones(n_weeks), t])
+    coef, _ = weighted_fits(y[:, recent], weights[:, recent], line[recent])
+    slope = np.where(weights[:, recent].sum(axis=1) >= 2, coef[:, 1], np.nan)
+
+    best_sse = np.full(len(series), np.inf)
+    best = np.full((len(series), 3), np.nan)
+    changepoint = np.full(len(series), -1)
+    for week in range(MIN_SEGMENT, n_weeks - MIN_SEGMENT + 1):
+        hinge = np.column_stack([line, np.maximum(0, t - week)])
+        coef, sse = weighted_fits(y, weights, hinge)
+        enough = ((weights[:, :week].sum(axis=1) >= MIN_SEGMENT)
+                  & (weights[:, week:].sum(axis=1) >= MIN_SEGMENT))
+        better = enough & (sse < best_sse)
+        best_sse[better] = sse[better]
+        best[better] = coef[better]
+        changepoint[better] = week
+
+    with np.errstate(divide="ignore"):
+        doubling = np.where(slope > 0, np.log(2) / slope, np.inf)
+    return {"weeks_observed": weights.sum(axis=1),
+            "growth_rate": np.exp(slope) - 1,
+            "doubling_weeks": np.where(np.isnan(slope), np.nan, doubling),
+            "changepoint": changepoint,
+            "slope_before": best[:, 1],
+            "slope_after": best[:, 1] + best[:, 2]}
+
+
+def fit_chunk(path, shape, start, stop):
+    '''
+    Fits the zip codes start to stop of every variable of the memory-mapped
+    panel; runs in a worker process
+
+    Inputs:
+        path: str, file of the panel array
+        shape: tuple, variables x zips x weeks
+        start, stop: int, range of zip codes
+    Returns:
+        list with one dictionary of results per variable
+    '''
+    panel = np.memmap(path, dtype="float64", mode="r", shape=shape)
+    return [fit_trends(panel[i, start:stop]) for i in range(shape[0])]
+
+
+def fit_panel(ts, variables=TREND_VARIABLES, workers=None,
+              chunk_zips=CHUNK_ZIPS):
+    '''
+    Fits the trend models of every zip code and variable of a time series
+    panel, spreading the zip codes over a process pool
+
+    Inputs:
+        ts: pandas DataFrame, e.g. ts_database
+        variables: list of the variables to model
+        workers: int, number of processes, all cores by default, 0 to fit
+            in the calling process
+        chunk_zips: int, number of zip codes fitted by one task
+    Returns:
+        pandas DataFrame with one row by zip code and variable
+    '''
+    zip_codes, week_ends, values = panel_arrays(ts, variables)
+    for i in range(len(variables)):
+        values[i] = log_values(values[i])
+    chunks = [(start, min(start + chunk_zips, len(zip_codes)))
+              for start in range(0, len(zip_codes), chunk_zips)]
+
+    folder = tempfile.mkdtemp(prefix="panel_")
+    try:
+        path = os.path.join(folder, "panel.dat")
+        panel = np.memmap(path, dtype="float64", mode="w+",
+                          shape=values.shape)
+        panel[:] = values
+        panel.flush()
+        del panel
+
+        tasks = [(path, values.shape, start, stop) for start, stop in chunks]
+        if workers == 0:
+            results = [fit_chunk(*task) for task in tasks]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                results = list(pool.map(fit_chunk, *zip(*tasks)))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    frames = []
+    for i, var in enumerate(variables):
+        fits = {key: np.concatenate([chunk[i][key] for chunk in results])
+                for key in results[0][i]}
+        changepoint = fits.pop("changepoint")
+        df = pd.DataFrame({"zip_code": zip_codes, "variable": var, **fits})
+        df["changepoint"] = pd.NaT
+        found = changepoint >= 0
+        df.loc[found, "changepoint"] = week_ends[changepoint[found]]
+        frames.append(df)
+    return schema.apply_schema(pd.concat(frames, ignore_index=True),
+                               "ts_trends")
+
+
+if __name__ == "__main__":
+    date = schema.latest_snapshot("ts")
+    trends = fit_panel(schema.read_database("ts", date))
+    schema.write_database(trends, "ts_trends", date)
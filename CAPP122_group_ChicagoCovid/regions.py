@@ -0,0 +1,171 @@
+'''
+This module runs the collection and processing of several metro regions
+side by side, and reads their outputs back by region and date
+
+Every region is a partition: a directory laid out like the project root,
+with its own rawdata/, databases/, artifacts/, cubes/ and sqlite3
+database. Chicago, the first region, is the project root itself; every
+other region lives in regions/<name>/. Within a region, the snapshots are
+partitioned by date through their file names.
+
+All paths of the pipeline are relative, so a region is processed by
+running the usual scripts from its directory. Each runs in its own
+process, so regions share no memory, no files and no connections, and
+adding a region takes another core rather than slowing the others.
+
+To add a city, add an entry to REGIONS, then:
+    python regions.py collect <region> ...
+    python regions.py process <region> ...
+'''
+
+import concurrent.futures
+import os
+import subprocess
+import sys
+import pandas as pd
+import schema
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+REGION_DIR = "regions/"
+DEFAULT_REGION = "chicago"
+
+# city_name and state_abbr filter the City Health Dashboard, state_fips
+# the census ZCTA to tract relationship file, portal and datasets are the
+# Socrata open data portal of the city and the ids of its datasets
+REGIONS = {
+    "chicago": {"city_name": "Chicago",
+                "state_abbr": "IL",
+                "state_fips": "17",
+                "portal": "data.cityofchicago.org",
+                "datasets": {"covid_case_num": "yhhz-zm2v",
+                             "covid_vaccination_num": "553k-3xzc",
+                             "covid_vaccination_sites": "6q3z-9maq",
+                             "population": "85cm-7uqa",
+                             "health_centers": "cjg8-dbka"},
+                "hospitals": "https://api.chicagohealthatlas.org/api/v1/"
+                             "hospitals",
+                "root": ""},
+}
+
+STAGES = {"collect": "data_collect.py",
+          "process": "data_processing.py"}
+
+
+def region_root(region):
+    '''
+    Finds the directory of the partition of a region
+
+    Inputs:
+        region: str, key of REGIONS
+    Returns:
+        str, absolute path ending with a separator
+    '''
+    root = REGIONS[region].get("root", REGION_DIR + region + "/")
+    return os.path.join(PROJECT_DIR, root)
+
+
+def run_stage(region, stage):
+    '''
+    Runs one stage of the pipeline in the partition of a region, in a new
+    Python process
+
+    Inputs:
+        region: str, key of REGIONS
+        stage: str, key of STAGES
+    Returns:
+        (region, return code of the process)
+    '''
+    root = region_root(region)
+    for folder in [schema.RAWDATA_DIR, schema.DATABASE_DIR]:
+        os.makedirs(root + folder, exist_ok=True)
+    script = os.path.join(PROJECT_DIR, STAGES[stage])
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR)
+    done = subprocess.run([sys.executable, script, region], cwd=root,
+                          env=env)
+    return region, done.returncode
+
+
+def run_regions(regions, stage, workers=None):
+    '''
+    Runs one stage of the pipeline for many regions at once, one process
+    per region and at most one per core
+
+    Inputs:
+        regions: list of keys of REGIONS
+        stage: str, key of STAGES
+        workers: int, number of regions run at once, all cores by default
+    Returns:
+        list of the regions that failed
+    '''
+    workers = workers or os.cpu_count()
+    # the threads only wait for their process, the work happens in them
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(run_stage, regions,
+                                [stage] * len(regions)))
+    return [region for region, code in results if code != 0]
+
+
+def partition_snapshots(kind, regions=None, start=None, end=None):
+    '''
+    Lists the snapshots of a processed database matching the filters,
+    from the names of the partitions and files alone
+
+    Inputs:
+        kind: str, name of the database in schema.DATABASE_FILES
+        regions: list of keys of REGIONS, all regions by default
+        start, end: str, first and last snapshot dates, inclusive
+    Returns:
+        list of (region, date, path)
+    '''
+    snapshots = []
+    for region in regions or REGIONS:
+        root = region_root(region)
+        for date in schema.snapshot_dates(kind, root):
+            if (start is None or date >= start) and \
+                    (end is None or date <= end):
+                snapshots.append((region, date,
+                                  root + schema.database_path(kind, date)))
+    return snapshots
+
+
+def read_partitions(kind, regions=None, start=None, end=None):
+    '''
+    Reads the snapshots of a processed database matching the filters, and
+    only those
+
+    Inputs:
+        kind: str, name of the database in schema.DATABASE_FILES
+        regions: list of keys of REGIONS, all regions by default
+        start, end: str, first and last snapshot dates, inclusive
+    Returns:
+        pandas DataFrame with region and snapshot columns, NaN in the
+        columns a snapshot lacks
+    '''
+    frames = []
+    for region, date, path in partition_snapshots(kind, regions, start, end):
+        df = schema.read_csv(path, kind)
+        df.insert(0, "region", region)
+        df.insert(1, "snapshot", date)
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=["region", "snapshot"])
+    # every partition is read with its types; columns missing from some of
+    # them become NaN, so only the categoricals, whose categories differ
+    # between partitions, are cast back after joining
+    df = pd.concat(frames, ignore_index=True)
+    categories = [col for col in df.columns
+                  if schema.column_type(kind, col) in [schema.ZIP,
+                                                       schema.LABEL]]
+    return schema.sort_categories(df.astype(
+        {col: "category" for col in ["region"] + categories}))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in STAGES:
+        print("Usage: python regions.py {} [region ...]".format(
+            "|".join(STAGES)))
+        sys.exit(1)
+    failed = run_regions(sys.argv[2:] or list(REGIONS), sys.argv[1])
+    if failed:
+        print("Failed regions:", ", ".join(failed))
+        sys.exit(1)
@@ -0,0 +1,151 @@
+'''
+This module predicts the outcomes of edited zip code rows, such as more
+vaccination sites or another age structure, from the artefact bundle of a
+snapshot, without refitting anything
+
+The standardization, the principal axes and the coefficients of every
+outcome compose into one affine map from the inputs to the linear
+predictor:
+    eta = ((x - mean) / scale) @ axes.T @ beta_components
+          + dummies @ beta_dummies
+so a scenario costs one small matrix product, and a grid of scenarios
+one batched product.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+class ScenarioEngine:
+    '''
+    The affine maps of the models of one bundle, and the rows of its zip
+    codes to edit
+    '''
+
+    def __init__(self, bundle):
+        manifest = bundle.manifest
+        design = manifest["design_columns"]
+        components = [design.index(name) for name in manifest["comp_names"]]
+        dummies = [i for i, name in enumerate(design)
+                   if name.startswith("major")]
+
+        self.outcomes = bundle.outcomes
+        self.inputs = manifest["pca_var"] + [design[i] for i in dummies]
+        self.binomial = np.array([manifest["families"][var] == "binomial"
+                                  for var in self.outcomes])
+        self.zip_codes = pd.Index(bundle.full_df.index.astype(str))
+        self.base = bundle.full_df[self.inputs].to_numpy(dtype="float64")
+        self._positions = {name: i for i, name in enumerate(self.inputs)}
+
+        scale = np.asarray(bundle.arrays["scaler_scale"])
+        mean = np.asarray(bundle.arrays["scaler_mean"])
+        axes = np.asarray(bundle.arrays["components"])
+        beta = np.asarray(bundle.arrays["coefficients"]) # outcomes x design
+
+        projection = axes.T / scale[:, np.newaxis] # pca_var x components
+        beta_components = beta[:, components].T
+        self.weights = np.vstack([projection @ beta_components,
+                                  beta[:, dummies].T]) # inputs x outcomes
+        self.intercept = -(mean / scale) @ axes.T @ beta_components
+        self.baseline = self.base @ self.weights + self.intercept
+
+    def outcome_position(self, outcome):
+        '''
+        Finds the column of an outcome in the weights
+        '''
+        if outcome not in self.outcomes:
+            raise ValueError("Unknown outcome {}".format(outcome))
+        return self.outcomes.index(outcome)
+
+    def zip_positions(self, zip_codes):
+        '''
+        Finds the rows of zip codes, all of them if zip_codes is None
+        '''
+        if zip_codes is None:
+            return np.arange(len(self.zip_codes))
+        positions = self.zip_codes.get_indexer([str(z) for z in zip_codes])
+        if (positions < 0).any():
+            raise ValueError("zipcode not in the cross section")
+        return positions
+
+    def input_position(self, column):
+        '''
+        Finds the row of an input in the weights
+        '''
+        if column not in self._positions:
+            raise ValueError("Unknown input {}".format(column))
+        return self._positions[column]
+
+    def response(self, linear, outcome):
+        '''
+        Maps linear predictors to predictions, like Bundle.predictions
+        '''
+        if self.binomial[self.outcome_position(outcome)]:
+            linear = 1 / (1 + np.exp(-linear))
+        return np.maximum(linear, 0) # Limiting prediction range
+
+    def rows(self, zip_codes=None, **edits):
+        '''
+        Copies the input rows of zip codes with some inputs replaced
+
+        Inputs:
+            zip_codes: list of zip codes, all by default
+            edits: new value of inputs, a number or one value per zip code
+        Returns:
+            numpy array zips x inputs, in the order of self.inputs
+        '''
+        rows = self.base[self.zip_positions(zip_codes)]
+        for column, value in edits.items():
+            rows[:, self.input_position(column)] = value
+        return rows
+
+    def predict(self, rows, outcome):
+        '''
+        Predicts an outcome for any batch of input rows
+
+        Inputs:
+            rows: numpy array (..., inputs), see rows
+            outcome (str): name of the outcome
+        Returns:
+            numpy array (...)
+        '''
+        i = self.outcome_position(outcome)
+        return self.response(rows @ self.weights[:, i] + self.intercept[i],
+                             outcome)
+
+    def what_if(self, zip_code, outcome, **edits):
+        '''
+        Predicts an outcome of one zip code before and after some edits
+
+        Returns:
+            (float, float), the predictions without and with the edits
+        '''
+        rows = np.vstack([self.rows([zip_code]), self.rows([zip_code],
+                                                           **edits)])
+        before, after = self.predict(rows, outcome)
+        return float(before), float(after)
+
+    def sweep(self, column, values, outcome, zip_codes=None):
+        '''
+        Predicts an outcome of every zip code for every value of one input,
+        all other inputs kept, in one vectorized step
+
+        Inputs:
+            column (str): name of the input to vary
+            values: array-like of the values of the input
+            outcome (str): name of the outcome
+            zip_codes: list of zip codes, all by default
+        Returns:
+            pandas DataFrame, one row per value and one column per zip code
+        '''
+        i = self.outcome_position(outcome)
+        j = self.input_position(column)
+        positions = self.zip_positions(zip_codes)
+        values = np.asarray(values, dtype="float64")
+
+        # the linear predictor moves along the weight of the input only
+        linear = self.baseline[positions, i] + \
+            (values[:, np.newaxis] - self.base[positions, j]) * \
+            self.weights[j, i]
+        return pd.DataFrame(self.response(linear, outcome), index=values,
+                            columns=self.zip_codes[positions])
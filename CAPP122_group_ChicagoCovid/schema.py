@@ -0,0 +1,494 @@
+'''
+This module is the central registry of column types for the raw and
+processed data files, and the readers and writers that apply it.
+
+Zip codes are stored as categoricals, counts as nullable 32-bit integers,
+rates and shares as 32-bit floats and dates as real datetimes. Frames
+handed to plots go through to_float, as pandas.NA is not serializable.
+'''
+
+import datetime
+import glob
+import os
+import shutil
+import tempfile
+import pandas as pd
+
+ZIP = "category"
+LABEL = "category"
+COUNT = "Int32"
+RATE = "float32"
+COORD = "float32"
+WEEK = "int8"
+YEAR = "int16"
+FLAG = "int8"
+DATE = "datetime64[ns]"
+
+RAWDATA_DIR = "rawdata/"
+DATABASE_DIR = "databases/"
+
+# Socrata geo-region ids and row ids (zip_code-year-week) are never used
+DROP_COLUMNS = [":@computed_region_rpca_8um6",
+                ":@computed_region_vrxf_vc4k",
+                ":@computed_region_6mkv_f3dw",
+                ":@computed_region_bdys_3d7i",
+                ":@computed_region_43wa_7qmu",
+                ":@computed_region_awaf_s7ux",
+                "row_id"]
+
+INDICATORS = ["children_in_poverty",
+              "dental_care",
+              "diabetes",
+              "frequent_mental_distress",
+              "frequent_physical_distress",
+              "housing_cost_excessive",
+              "income_inequality",
+              "life_expectancy",
+              "obesity",
+              "uninsured",
+              "preventive_services"]
+
+CASE_TYPES = {"zip_code": ZIP,
+              "week_number": WEEK,
+              "week_start": DATE,
+              "week_end": DATE,
+              "tests_weekly": COUNT,
+              "tests_cumulative": COUNT,
+              "test_rate_weekly": RATE,
+              "test_rate_cumulative": RATE,
+              "percent_tested_positive_weekly": RATE,
+              "percent_tested_positive_cumulative": RATE,
+              "deaths_weekly": COUNT,
+              "deaths_cumulative": COUNT,
+              "death_rate_weekly": RATE,
+              "death_rate_cumulative": RATE,
+              "population": COUNT,
+              "zip_code_location": LABEL,
+              "cases_weekly": COUNT,
+              "cases_cumulative": COUNT,
+              "case_rate_weekly": RATE,
+              "case_rate_cumulative": RATE}
+
+VACCINE_TYPES = {"zip_code": ZIP,
+                 "date": DATE,
+                 "total_doses_daily": COUNT,
+                 "total_doses_cumulative": COUNT,
+                 "_1st_dose_daily": COUNT,
+                 "_1st_dose_cumulative": COUNT,
+                 "_1st_dose_percent_population": RATE,
+                 "vaccine_series_completed_daily": COUNT,
+                 "vaccine_series_completed_cumulative": COUNT,
+                 "vaccine_series_completed_percent_population": RATE,
+                 "population": COUNT,
+                 "zip_code_location": LABEL}
+
+WINDOW_TYPES = {"zip_code": ZIP,
+                "day_ordinal": "int32",
+                "*_7d": COUNT,
+                "*_14d": COUNT,
+                "*_28d": COUNT,
+                "*_rate": RATE,
+                "*_growth": RATE}
+
+# Keys ending with "*" match every column starting with the prefix and
+# keys starting with "*" every column ending with the suffix
+SCHEMA = {
+    "covid_case_num": CASE_TYPES,
+    "covid_vaccination_num": VACCINE_TYPES,
+    "covid_vaccination_sites": {"facility_id": COUNT,
+                                "city": LABEL,
+                                "state": LABEL,
+                                "postal_code": ZIP,
+                                "country": LABEL,
+                                "begin_date": DATE,
+                                "end_date": DATE},
+    "population": {"geography_type": LABEL,
+                   "year": YEAR,
+                   "geography": ZIP,
+                   "population_*": COUNT},
+    "health_centers": {"community_area": LABEL,
+                       "fqhc_look_alike_or_neither_special_notes": LABEL},
+    "hospital": {"id": COUNT,
+                 "src_id": COUNT,
+                 "primary_type": LABEL,
+                 "sub_type": LABEL,
+                 "addr_city": LABEL,
+                 "addr_zip": ZIP},
+    "health_indicator_tract": {
+        "geoid": LABEL,
+        "zip_code": ZIP,
+        **{ind: RATE for ind in INDICATORS},
+        **{ind.replace("_", "-"): RATE for ind in INDICATORS}},
+    "health_indicator_zip": {"zip_code": ZIP,
+                             **{ind: RATE for ind in INDICATORS}},
+    "facility_distances": {"zip_code": ZIP,
+                           "km_to_nearest_*": RATE},
+    "geoid_zipcode_map": {"zip_code": ZIP,
+                          "geoid": LABEL,
+                          "population_part": COUNT,
+                          "land_area_part": "float64"},
+    "zip_coordinates": {"Zip": ZIP,
+                        "Latitude": COORD,
+                        "Longitude": COORD},
+    "cross_section": {**CASE_TYPES,
+                      **VACCINE_TYPES,
+                      "population_*": RATE,
+                      "majority_*": FLAG,
+                      "vaccionation_sites": COUNT,
+                      "health_centers": COUNT,
+                      "number_of_hospitals": COUNT},
+    "ts": {**CASE_TYPES, **VACCINE_TYPES, "year": YEAR, "*_smoothed": RATE},
+    "weekly_vaccine": {**VACCINE_TYPES,
+                       "year": YEAR,
+                       "week_number": WEEK},
+    "vaccine_windows": {**WINDOW_TYPES, "date": DATE},
+    "case_windows": {**WINDOW_TYPES, "week_end": DATE},
+    "zip_locations": {"zip_code": ZIP,
+                      "latitude": COORD,
+                      "longitude": COORD},
+    "ts_trends": {"zip_code": ZIP,
+                  "variable": LABEL,
+                  "weeks_observed": "int32",
+                  "growth_rate": RATE,
+                  "doubling_weeks": RATE,
+                  "changepoint": DATE,
+                  "slope_before": RATE,
+                  "slope_after": RATE},
+    "anomaly_state": {"zip_code": ZIP,
+                      "variable": LABEL,
+                      "n": "int32",
+                      "mean": "float64",
+                      "m2": "float64",
+                      "ewma": "float64",
+                      "ewvar": "float64",
+                      "ring_pos": WEEK,
+                      "ring_*": "float64",
+                      "last_week_end": DATE,
+                      "last_loaded_at": DATE},
+    "anomaly_flags": {"zip_code": ZIP,
+                      "variable": LABEL,
+                      "week_end": DATE,
+                      "value": RATE,
+                      "expected": RATE,
+                      "lower": RATE,
+                      "upper": RATE,
+                      "zscore": RATE,
+                      "recent_median": RATE,
+                      "flag": LABEL},
+}
+
+RAW_FILES = {"covid_case_num": ("covid_case_num.csv", {"index_col": 0}),
+             "covid_vaccination_num": ("covid_vaccination_num.csv",
+                                       {"index_col": 0}),
+             "covid_vaccination_sites": ("covid_vaccination_sites.csv",
+                                         {"index_col": 0}),
+             "population": ("population.csv", {"index_col": 0}),
+             "health_centers": ("health_centers.csv", {"index_col": 0}),
+             "hospital": ("hospital.csv", {"index_col": 0}),
+             "health_indicator_tract": ("health_indicator_tract.csv",
+                                        {"index_col": 0}),
+             "geoid_zipcode_map": ("geoid_zipcode_map.csv", {"index_col": 0}),
+             "zip_coordinates": ("chicago-zip-code-latitude-and-longitude.csv",
+                                 {"sep": "\t"})}
+
+DATABASE_FILES = {"cross_section": "cross_section_database",
+                  "ts": "ts_database",
+                  "weekly_vaccine": "weekly_vaccine_database",
+                  "vaccine_windows": "vaccine_windows_database",
+                  "case_windows": "case_windows_database",
+                  "zip_locations": "zip_locations_database",
+                  "health_indicator_zip": "health_indicator_zip_database",
+                  "facility_distances": "facility_distances_database",
+                  "ts_trends": "ts_trends_database",
+                  "anomaly_state": "anomaly_state_database",
+                  "anomaly_flags": "anomaly_flags_database"}
+
+
+def column_type(table, column):
+    '''
+    Looks up the registered type of one column of a table
+
+    Inputs:
+        table: str, name of the table in SCHEMA
+        column: str, name of the column
+    Returns:
+        str, the registered dtype, or None if the column is not declared
+    '''
+    types = SCHEMA[table]
+    if column in types:
+        return types[column]
+    for key, dtype in types.items():
+        if key.endswith("*") and column.startswith(key[:-1]):
+            return dtype
+        if key.startswith("*") and column.endswith(key[1:]):
+            return dtype
+    return None
+
+
+def split_types(table, columns):
+    '''
+    Splits the registered types of the given columns into the dtype mapping
+    and the list of date columns expected by pandas.read_csv
+
+    Inputs:
+        table: str, name of the table in SCHEMA
+        columns: list of column names present in the file
+    Returns:
+        (dict, list): dtypes by column, names of date columns
+    '''
+    dtypes = {}
+    dates = []
+    for col in columns:
+        dtype = column_type(table, col)
+        if dtype == DATE:
+            dates.append(col)
+        elif dtype is not None:
+            dtypes[col] = dtype
+    return dtypes, dates
+
+
+def read_csv(path, table, **kwargs):
+    '''
+    Reads a csv file applying the registered types of the table and
+    skipping the unused columns
+
+    Inputs:
+        path: str, path of the csv file
+        table: str, name of the table in SCHEMA
+        kwargs: further arguments to pandas.read_csv
+    Returns:
+        pandas DataFrame, or an iterator of DataFrames if a chunksize is
+        given
+    '''
+    header = pd.read_csv(path, nrows=0, sep=kwargs.get("sep", ","))
+    columns = [col for col in header.columns if col not in DROP_COLUMNS]
+    dtypes, dates = split_types(table, columns)
+    df = pd.read_csv(path, usecols=columns, dtype=dtypes,
+                     parse_dates=dates, **kwargs)
+    if kwargs.get("chunksize"):
+        return map(sort_categories, df)
+    return sort_categories(df)
+
+
+def sort_categories(df):
+    '''
+    Sorts the categories of every categorical column and index, so that
+    grouping by zip code returns rows in zip code order
+
+    Inputs:
+        df: pandas DataFrame
+    Returns:
+        pandas DataFrame
+    '''
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.reorder_categories(
+                sorted(df[col].cat.categories))
+    if isinstance(df.index, pd.CategoricalIndex):
+        df.index = df.index.reorder_categories(sorted(df.index.categories))
+    return df
+
+
+def to_float(df):
+    '''
+    Casts the nullable integer columns of a DataFrame to float64, missing
+    values becoming NaN, for consumers that cannot handle pandas.NA such as
+    the JSON encoder of Plotly
+
+    Inputs:
+        df: pandas DataFrame
+    Returns:
+        pandas DataFrame
+    '''
+    nullable = [col for col in df.columns
+                if isinstance(df[col].dtype, pd.api.extensions.ExtensionDtype)
+                and df[col].dtype.kind in "iu"]
+    return df.astype({col: "float64" for col in nullable})
+
+
+def read_raw(table, **kwargs):
+    '''
+    Reads one of the raw data files in rawdata/
+
+    Inputs:
+        table: str, name of the raw table, e.g. "covid_case_num"
+        kwargs: further arguments to pandas.read_csv
+    Returns:
+        pandas DataFrame
+    '''
+    filename, options = RAW_FILES[table]
+    options = dict(options, **kwargs)
+    return read_csv(RAWDATA_DIR + filename, table, **options)
+
+
+def database_path(kind, date=None):
+    '''
+    Builds the path of a processed database file
+
+    Inputs:
+        kind: str, name of the database in DATABASE_FILES
+        date: str or datetime.date, snapshot date. Defaults to today.
+    Returns:
+        str, path of the csv file
+    '''
+    if date is None:
+        date = datetime.date.today()
+    return DATABASE_DIR + DATABASE_FILES[kind] + " " + str(date) + ".csv"
+
+
+def snapshot_dates(kind, root=""):
+    '''
+    Lists the dates of the published snapshots of a processed database
+
+    Inputs:
+        kind: str, name of the database in DATABASE_FILES
+        root: str, directory of the partition of a region (see regions.py),
+            the current directory by default
+    Returns:
+        list of str, dates in increasing order
+    '''
+    prefix = DATABASE_FILES[kind] + " "
+    paths = glob.glob(glob.escape(root + DATABASE_DIR + prefix) + "*.csv")
+    return sorted(os.path.basename(path)[len(prefix):-len(".csv")]
+                  for path in paths)
+
+
+def latest_snapshot(kind):
+    '''
+    Returns the date of the newest snapshot of a processed database, or
+    None if none was published
+    '''
+    dates = snapshot_dates(kind)
+    return dates[-1] if dates else None
+
+
+def read_database(kind, date=None, **kwargs):
+    '''
+    Reads a processed database file from databases/
+
+    Inputs:
+        kind: str, name of the database in DATABASE_FILES
+        date: str or datetime.date, snapshot date. Defaults to today.
+        kwargs: further arguments to pandas.read_csv
+    Returns:
+        pandas DataFrame
+    '''
+    return read_csv(database_path(kind, date), kind, **kwargs)
+
+
+def apply_schema(df, table):
+    '''
+    Casts the columns of an in-memory DataFrame to the registered types
+
+    Inputs:
+        df: pandas DataFrame
+        table: str, name of the table in SCHEMA
+    Returns:
+        pandas DataFrame with compact dtypes
+    '''
+    dtypes, dates = split_types(table, df.columns)
+    df = df.astype(dtypes)
+    for col in dates:
+        df[col] = pd.to_datetime(df[col])
+    return df
+
+
+def write_database(df, kind, date=None):
+    '''
+    Writes a processed database file to databases/
+
+    Inputs:
+        df: pandas DataFrame
+        kind: str, name of the database in DATABASE_FILES
+        date: str or datetime.date, snapshot date. Defaults to today.
+    '''
+    path = database_path(kind, date)
+    # readers watching databases/ must never see a half-written snapshot
+    apply_schema(df, kind).to_csv(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+
+class DatabaseWriter:
+    '''
+    Writes a processed database file to databases/ part by part, so that
+    only one part is in memory at a time, and publishes it once complete,
+    like write_database
+
+        with DatabaseWriter("case_windows") as writer:
+            for part in parts:
+                writer.write(part)
+    '''
+
+    def __init__(self, kind, date=None):
+        self.kind = kind
+        self.path = database_path(kind, date)
+        self.file = None
+        self.header = True
+
+    def __enter__(self):
+        self.file = open(self.path + ".tmp", "w", newline="")
+        return self
+
+    def write(self, df):
+        '''
+        Appends the rows of a DataFrame
+        '''
+        apply_schema(df, self.kind).to_csv(self.file, index=False,
+                                           header=self.header)
+        self.header = False
+
+    def __exit__(self, error_type, error, traceback):
+        self.file.close()
+        if error_type is None:
+            os.replace(self.path + ".tmp", self.path)
+        else:
+            os.remove(self.path + ".tmp")
+
+
+def staging_directory(path):
+    '''
+    Creates a new directory next to path, to write the next version of a
+    directory in before publish_directory
+
+    Inputs:
+        path: str, path the directory will be published at
+    Returns:
+        str, path of the new directory ending with a separator
+    '''
+    parent, name = os.path.split(path.rstrip("/"))
+    parent = parent or "."
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=name + ".", dir=parent)
+    # mkdtemp creates private directories, published ones are shared
+    os.chmod(staging, 0o755)
+    return staging + "/"
+
+
+def publish_directory(staging, path):
+    '''
+    Publishes a directory written by staging_directory at path
+
+    path is a symbolic link to the current version, replaced with one
+    rename, so readers find either version and never none. The previous
+    version is kept for readers that resolved the link just before, and
+    older ones are removed.
+
+    Inputs:
+        staging: str, path returned by staging_directory
+        path: str, path to publish at
+    '''
+    path, staging = path.rstrip("/"), staging.rstrip("/")
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+    link = staging + ".link"
+    os.symlink(os.path.basename(staging), link)
+    if os.path.isdir(path) and not os.path.islink(path):
+        # published before versions were linked, removed below
+        os.replace(path, staging + ".old")
+    os.replace(link, path)
+
+    keep = {os.path.realpath(path), previous}
+    for version in glob.glob(glob.escape(path) + ".*"):
+        if os.path.islink(version):
+            os.remove(version)
+        elif os.path.realpath(version) not in keep:
+            shutil.rmtree(version, ignore_errors=True)
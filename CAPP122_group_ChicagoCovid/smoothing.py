@@ -0,0 +1,142 @@
+'''
+This module smooths the weekly rates of small zip codes towards the rates
+of their neighbourhood, with local empirical Bayes estimates
+
+The neighbourhood of a zip code is itself and its K_NEIGHBORS nearest
+zip codes, or every zip code within a radius, built once as a sparse
+zip x zip matrix from the centroids. For every zip code i, week and rate,
+with events y, exposure n (population or tests) and raw rates r = y / n
+of the zip codes j of the neighbourhood of i:
+    m_i = sum(y_j) / sum(n_j)                      neighbourhood rate
+    s_i = sum(n_j (r_j - m_i)^2) / sum(n_j)        weighted variance
+    a_i = max(s_i - m_i / mean(n_j), 0)            variance between zips
+    smoothed_i = m_i + a_i / (a_i + m_i / n_i) (r_i - m_i)
+so zip codes with few residents or tests move towards m_i and large ones
+keep their own rate. Every sum is a sparse product of the neighbourhood
+matrix with a zip x week array, for all weeks at once.
+'''
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+import nearest
+import panel_models
+
+K_NEIGHBORS = 8
+SUFFIX = "_smoothed"
+
+# rate: (events, exposure, scale). Events of None are derived from the
+# published rate, rate / scale * exposure: positive tests are not
+# published, and cases / tests is not the published positivity
+SMOOTHED = {"case_rate_weekly": ("cases_weekly", "population", 100000),
+            "death_rate_weekly": ("deaths_weekly", "population", 100000),
+            "percent_tested_positive_weekly": (None, "tests_weekly", 1)}
+
+
+def neighbourhood_matrix(latitude, longitude, k=K_NEIGHBORS,
+                         radius_km=None):
+    '''
+    Builds the sparse 0/1 matrix linking every zip code to itself and to
+    its neighbours. Zip codes without coordinates only have themselves.
+
+    Inputs:
+        latitude, longitude: array-likes of the centroids
+        k (int): number of nearest neighbours
+        radius_km (float): if given, links every pair of zip codes closer
+            than this instead of the nearest neighbours
+    Returns:
+        scipy csr_matrix, zips x zips
+    '''
+    vectors = nearest.unit_vectors(latitude, longitude)
+    n = len(vectors)
+    located = np.flatnonzero(np.isfinite(vectors).all(axis=1))
+    rows, cols = [np.arange(n)], [np.arange(n)]
+
+    if len(located) > 1:
+        tree = cKDTree(vectors[located])
+        if radius_km is None:
+            _, near = tree.query(vectors[located], min(k + 1, len(located)))
+            near = near.reshape(len(located), -1)
+            rows.append(np.repeat(located, near.shape[1]))
+            cols.append(located[near.ravel()])
+        else:
+            pairs = tree.query_pairs(nearest.km_to_chord(radius_km),
+                                     output_type="ndarray")
+            rows += [located[pairs[:, 0]], located[pairs[:, 1]]]
+            cols += [located[pairs[:, 1]], located[pairs[:, 0]]]
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                               shape=(n, n))
+    # every zip code is its own nearest neighbour, counted twice above
+    matrix.data[:] = 1
+    return matrix
+
+
+def eb_smooth(events, exposure, neighbours):
+    '''
+    Local empirical Bayes rates of every zip code and week
+
+    Inputs:
+        events, exposure: numpy arrays zips x weeks, NaN where missing
+        neighbours: scipy sparse matrix zips x zips, see
+            neighbourhood_matrix
+    Returns:
+        numpy array zips x weeks, NaN where the raw rate is undefined
+    '''
+    valid = np.isfinite(events) & np.isfinite(exposure) & (exposure > 0)
+    y = np.where(valid, events, 0)
+    n = np.where(valid, exposure, 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.where(valid, y / n, 0)
+        sum_y = neighbours @ y
+        sum_n = neighbours @ n
+        count = neighbours @ valid.astype("float64")
+        mean = sum_y / sum_n
+        variance = (neighbours @ (y * rate)) / sum_n - mean ** 2
+        prior = np.maximum(variance - mean / (sum_n / count), 0)
+        shrink = np.nan_to_num(prior / (prior + mean / n))
+        smoothed = mean + shrink * (rate - mean)
+    return np.where(valid, smoothed, np.nan)
+
+
+def smooth_panel(ts, locations, k=K_NEIGHBORS, radius_km=None):
+    '''
+    Adds the smoothed version of every rate of SMOOTHED next to it
+
+    Inputs:
+        ts: pandas DataFrame with zip_code, week_end, the rates and their
+            events and exposures, e.g. ts_database
+        locations: pandas DataFrame with zip_code, latitude and longitude,
+            e.g. zip_locations_database
+        k, radius_km: see neighbourhood_matrix
+    Returns:
+        pandas DataFrame, ts with a <rate>_smoothed column after each rate
+    '''
+    rates = [rate for rate in SMOOTHED if rate in ts.columns]
+    inputs = sorted({col for rate in rates
+                     for col in [SMOOTHED[rate][0] or rate,
+                                 SMOOTHED[rate][1]]})
+    zip_codes, week_ends, values = panel_models.panel_arrays(ts, inputs)
+
+    centroids = locations.assign(zip_code=locations["zip_code"].astype(str))
+    centroids = centroids.drop_duplicates("zip_code").set_index("zip_code")
+    centroids = centroids.reindex(zip_codes)
+    neighbours = neighbourhood_matrix(centroids["latitude"],
+                                      centroids["longitude"], k, radius_km)
+
+    zip_idx = np.searchsorted(zip_codes, ts["zip_code"].astype(str))
+    week_idx = np.searchsorted(week_ends, ts["week_end"].to_numpy())
+    ts = ts.copy()
+    for rate in rates:
+        events, exposure, scale = SMOOTHED[rate]
+        exposure = values[inputs.index(exposure)]
+        if events is None:
+            events = values[inputs.index(rate)] / scale * exposure
+        else:
+            events = values[inputs.index(events)]
+        smoothed = eb_smooth(events, exposure, neighbours)
+        ts.insert(ts.columns.get_loc(rate) + 1, rate + SUFFIX,
+                  (scale * smoothed[zip_idx, week_idx]).astype("float32"))
+    return ts
@@ -0,0 +1,182 @@
+'''
+This module keeps the in-memory data of the dashboard in step with the
+snapshots published in databases/, without restarting the server
+
+A SnapshotManager serves one DashboardState at a time. A background
+thread watches for a newer snapshot, builds and warms the next state away
+from the requests, then swaps it in with a single assignment. Callbacks
+take the current state once when they start, so requests in flight finish
+on the state they began with.
+'''
+
+import threading
+import pandas as pd
+import aggregation
+import artifacts
+import scenarios
+import schema
+
+# databases the dashboard reads, a snapshot is complete once all exist
+SNAPSHOT_KINDS = ["cross_section", "ts"]
+POLL_SECONDS = 60
+
+
+def modeling():
+    '''
+    Imports data_modeling, with statsmodels and sklearn, only once a
+    snapshot without a bundle has to be refitted
+    '''
+    import data_modeling
+    return data_modeling
+
+
+def latest_complete_snapshot():
+    '''
+    Finds the newest date for which every database of the dashboard was
+    published
+
+    Returns:
+        str, date of the snapshot, or None
+    '''
+    dates = set(schema.snapshot_dates(SNAPSHOT_KINDS[0]))
+    for kind in SNAPSHOT_KINDS[1:]:
+        dates &= set(schema.snapshot_dates(kind))
+    return max(dates) if dates else None
+
+
+class DashboardState:
+    '''
+    The frames, principal components and fitted models of one snapshot.
+    Never modified once built, except for the cache of predictions.
+
+    They come from the artefact bundle of the snapshot when it has one, and
+    are refitted otherwise.
+    '''
+
+    def __init__(self, date):
+        self.date = date
+        self.bundle = artifacts.read_bundle(date)
+        if self.bundle is not None:
+            self.database_cross = self.bundle.database_cross
+            self.database_ts = self.bundle.database_ts
+            self.full_df = self.bundle.full_df
+            self.loadings = self.bundle.loadings
+            self.best_var = self.bundle.manifest["best_represented"]
+            self.options = self.bundle.manifest["options"]
+        else:
+            dm = modeling()
+            self.database_cross = schema.read_database("cross_section", date,
+                                                       index_col=0)
+            self.database_ts = schema.read_database("ts", date, index_col=0)
+            self.full_df, self.loadings = dm.do_pca(self.database_cross)
+            self.best_var = list(dm.best_represented(self.loadings))
+            self.options = artifacts.dashboard_options(self.database_cross,
+                                                       self.database_ts)
+        # counts missing after joins are pandas.NA, which Plotly cannot encode
+        self.database_cross = schema.to_float(self.database_cross)
+        self.database_ts = schema.to_float(self.database_ts)
+        # the week slider runs over week ordinals, consecutive across years
+        self.database_ts["week_ordinal"] = aggregation.week_ordinal(
+            pd.to_datetime(self.database_ts["week_end"]))
+        self.outcomes = self.options["outcomes"]
+        # what-if predictions need the stored models of a bundle
+        self.scenario_engine = None
+        if self.bundle is not None:
+            self.scenario_engine = scenarios.ScenarioEngine(self.bundle)
+        self._predictions = {}
+        self._lock = threading.Lock()
+
+    def predictions(self, var):
+        '''
+        Predictions by majority race of one outcome, fitted once per
+        snapshot
+
+        Inputs:
+            var (str): the name of the outcome
+        Returns:
+            pandas DataFrame, see data_modeling.predict_outcome
+        '''
+        with self._lock:
+            pred = self._predictions.get(var)
+        if pred is None:
+            if self.bundle is not None:
+                pred = self.bundle.predictions(var)
+            else:
+                pred = modeling().predict_outcome(self.database_cross, var)
+            with self._lock:
+                pred = self._predictions.setdefault(var, pred)
+        return pred
+
+    def warm(self):
+        '''
+        Fits the predictions of every outcome ahead of the first request
+        '''
+        for var in self.outcomes:
+            self.predictions(var)
+
+
+class SnapshotManager:
+    '''
+    Serves the state of the newest snapshot and replaces it when a newer
+    snapshot is published
+    '''
+
+    def __init__(self, poll_seconds=POLL_SECONDS):
+        date = latest_complete_snapshot()
+        if date is None:
+            raise RuntimeError("No snapshot in " + schema.DATABASE_DIR)
+        self.poll_seconds = poll_seconds
+        self.state = DashboardState(date)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        '''
+        Returns the state to use for the whole of one request
+        '''
+        return self.state
+
+    def refresh(self):
+        '''
+        Builds and warms the state of the newest snapshot, then swaps it in
+        if it is newer than the current one, or if the current snapshot was
+        refitted and its bundle has since been published
+
+        Returns:
+            bool, whether a new state was swapped in
+        '''
+        date = latest_complete_snapshot()
+        if date is None or date < self.state.date:
+            return False
+        # data_processing writes the bundle after the csv files
+        if date == self.state.date and (self.state.bundle is not None or
+                                        not artifacts.has_bundle(date)):
+            return False
+        state = DashboardState(date)
+        state.warm()
+        self.state = state
+        return True
+
+    def watch(self):
+        '''
+        Starts polling for new snapshots in a background thread
+        '''
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._poll, daemon=True,
+                                            name="snapshot-watcher")
+            self._thread.start()
+
+    def stop(self):
+        '''
+        Stops polling
+        '''
+        self._stop.set()
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                if self.refresh():
+                    print("Serving snapshot", self.state.date)
+            except Exception as error:
+                # a broken snapshot must not stop the server or the watcher
+                print("Could not load the newest snapshot:", repr(error))
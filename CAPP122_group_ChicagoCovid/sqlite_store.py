@@ -0,0 +1,273 @@
+'''
+This module manages the connections to covid_research.sqlite3
+
+The database runs in WAL mode so that readers never wait for the loader.
+A load writes every table into a staging copy first and then swaps all
+staging tables in within one short transaction, so a reader always sees
+either the previous or the new version of every table, never a mix.
+'''
+
+import contextlib
+import datetime
+import queue
+import sqlite3
+import threading
+import pandas as pd
+
+DATABASE_PATH = "covid_research.sqlite3"
+STAGING_PREFIX = "staging_"
+
+# SQL scripts of derived tables, rebuilt when any of their sources loads
+MATERIALIZED_SCRIPTS = {
+    "materialized_tables.sql": ["covid_case_num", "covid_vaccination_num"],
+    "facility_search.sql": ["covid_vaccination_sites", "health_centers",
+                            "hospital"]}
+
+# tables whose rows keep the time of the load that first brought them,
+# by the columns identifying a row, so that anomalies.py can read the rows
+# loaded since its last run, however old their week
+LOAD_STAMPS = {"covid_case_num": ["zip_code", "week_end"]}
+LOADED_AT = "loaded_at"
+LOADED_AT_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+CACHE_KIB = 64 * 1024
+MMAP_BYTES = 256 * 1024 * 1024
+BUSY_TIMEOUT_MS = 5000
+
+WRITER_PRAGMAS = ["PRAGMA journal_mode = WAL",
+                  "PRAGMA synchronous = NORMAL",
+                  "PRAGMA temp_store = MEMORY",
+                  "PRAGMA cache_size = -{}".format(CACHE_KIB),
+                  "PRAGMA mmap_size = {}".format(MMAP_BYTES),
+                  "PRAGMA busy_timeout = {}".format(BUSY_TIMEOUT_MS)]
+
+READER_PRAGMAS = ["PRAGMA query_only = ON",
+                  "PRAGMA temp_store = MEMORY",
+                  "PRAGMA cache_size = -{}".format(CACHE_KIB),
+                  "PRAGMA mmap_size = {}".format(MMAP_BYTES),
+                  "PRAGMA busy_timeout = {}".format(BUSY_TIMEOUT_MS)]
+
+
+def connect_writer(path=DATABASE_PATH):
+    '''
+    Opens a read-write connection in WAL mode with explicit transactions
+
+    Input:
+        path: str, path of the sqlite3 database
+    Output:
+        sqlite3 Connection
+    '''
+    conn = sqlite3.connect(path, isolation_level=None)
+    for pragma in WRITER_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def connect_reader(path=DATABASE_PATH):
+    '''
+    Opens a read-only connection that can be shared between threads
+
+    Input:
+        path: str, path of the sqlite3 database
+    Output:
+        sqlite3 Connection
+    '''
+    conn = sqlite3.connect("file:{}?mode=ro".format(path), uri=True,
+                           check_same_thread=False)
+    for pragma in READER_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ReaderPool:
+    '''
+    A bounded pool of read-only connections. Each worker thread borrows
+    its own connection, so reads run in parallel under WAL.
+    '''
+
+    def __init__(self, path=DATABASE_PATH, size=8):
+        self.path = path
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+
+    @contextlib.contextmanager
+    def connection(self):
+        '''
+        Borrows a connection, opening one if none is idle and the pool is
+        not full, and waiting otherwise
+        '''
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = connect_reader(self.path)
+        except BaseException:
+            # a failed open must give its slot back
+            self._slots.release()
+            raise
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+            self._slots.release()
+
+    def query(self, sql, params=()):
+        '''
+        Runs a SELECT query
+
+        Inputs:
+            sql: str, the query
+            params: tuple of query parameters
+        Output:
+            pandas DataFrame of the result
+        '''
+        with self.connection() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def close(self):
+        '''
+        Closes every idle connection
+        '''
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def reader_pool(path=DATABASE_PATH):
+    '''
+    Returns the process-wide reader pool of a database
+    '''
+    with _POOLS_LOCK:
+        if path not in _POOLS:
+            _POOLS[path] = ReaderPool(path)
+        return _POOLS[path]
+
+
+def stamp_rows(conn, table, df, loaded_at):
+    '''
+    Adds the loaded_at column of a table in LOAD_STAMPS: the rows already
+    in the table keep their stamp, the new rows get the time of this load
+
+    Inputs:
+        conn: sqlite3 Connection from connect_writer
+        table: str, name of the table
+        df: pandas DataFrame of data
+        loaded_at: str, time of this load in LOADED_AT_FORMAT
+    Returns:
+        pandas DataFrame with the loaded_at column
+    '''
+    keys = LOAD_STAMPS[table]
+
+    def row_keys(frame):
+        # dates read back from sqlite3 are strings
+        return pd.MultiIndex.from_arrays(
+            [pd.to_datetime(frame[key])
+             if pd.api.types.is_datetime64_any_dtype(df[key])
+             else frame[key].astype(str) for key in keys])
+
+    columns = [row[1] for row in
+               conn.execute('PRAGMA table_info("{}")'.format(table))]
+    stamps = pd.Series(loaded_at, index=row_keys(df))
+    if LOADED_AT in columns and set(keys) <= set(columns):
+        old = pd.read_sql_query('SELECT {}, "{}" FROM "{}"'.format(
+            ", ".join('"{}"'.format(key) for key in keys), LOADED_AT, table),
+            conn)
+        old = pd.Series(old[LOADED_AT].to_numpy(), index=row_keys(old))
+        old = old[~old.index.duplicated()]
+        stamps = old.reindex(stamps.index).fillna(stamps)
+    return df.assign(**{LOADED_AT: stamps.to_numpy()})
+
+
+def stage_table(conn, table, df):
+    '''
+    Writes a pandas DataFrame into the staging copy of a table
+
+    Inputs:
+        conn: sqlite3 Connection from connect_writer
+        table: str, name of the table
+        df: pandas DataFrame of data
+    '''
+    conn.execute("BEGIN")
+    df.to_sql(STAGING_PREFIX + table, con=conn, index=False,
+              if_exists='replace')
+    if conn.in_transaction:
+        conn.execute("COMMIT")
+
+
+def materialized_statements(path):
+    '''
+    Reads the statements of a script that rebuilds derived tables
+
+    Input:
+        path: str, path of the SQL script
+    Output:
+        list of SQL statements
+    '''
+    with open(path) as f:
+        script = f.read()
+    return [stmt for stmt in script.split(";") if stmt.strip()]
+
+
+def refresh_materialized(conn, tables):
+    '''
+    Rebuilds the derived tables of every script with a source among the
+    loaded tables, within the caller's transaction
+
+    Inputs:
+        conn: sqlite3 Connection from connect_writer
+        tables: list of the names of the loaded tables
+    '''
+    for script, sources in MATERIALIZED_SCRIPTS.items():
+        if any(table in sources for table in tables):
+            for stmt in materialized_statements(script):
+                conn.execute(stmt)
+
+
+def swap_in(conn, tables):
+    '''
+    Replaces every table by its staging copy in a single transaction,
+    together with the materialized tables built from them
+
+    Inputs:
+        conn: sqlite3 Connection from connect_writer
+        tables: list of table names
+    '''
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table in tables:
+            conn.execute('DROP TABLE IF EXISTS "{}"'.format(table))
+            conn.execute('ALTER TABLE "{}{}" RENAME TO "{}"'
+                         .format(STAGING_PREFIX, table, table))
+        refresh_materialized(conn, tables)
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def load_tables(data_dict, path=DATABASE_PATH):
+    '''
+    Loads a set of tables without blocking or disturbing the readers
+
+    Inputs:
+        data_dict: dictionary mapping table name to pandas DataFrame
+        path: str, path of the sqlite3 database
+    '''
+    conn = connect_writer(path)
+    loaded_at = datetime.datetime.now().strftime(LOADED_AT_FORMAT)
+    try:
+        for table, df in data_dict.items():
+            if table in LOAD_STAMPS:
+                df = stamp_rows(conn, table, df, loaded_at)
+            stage_table(conn, table, df)
+        swap_in(conn, list(data_dict))
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+    finally:
+        conn.close()
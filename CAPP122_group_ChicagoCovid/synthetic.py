@@ -0,0 +1,101 @@
+'''
+This module generates synthetic weekly panels shaped like ts_database, for
+thousands of zip codes instead of Chicago's sixty, to measure how the
+panel stages scale
+
+Every zip code follows a log-linear epidemic curve with its own growth
+rate and one change of trend at a random week. Their centroids are drawn
+in clusters, like metro areas, over the continental United States.
+'''
+
+import numpy as np
+import pandas as pd
+import schema
+
+FIRST_WEEK_END = "2020-03-07"
+LATITUDES = (25.0, 49.0)
+LONGITUDES = (-124.0, -67.0)
+ZIPS_PER_METRO = 50
+METRO_DEGREES = 0.3 # spread of the zip codes around their metro center
+
+
+def draw_zips(rng, n_zips):
+    '''
+    Draws distinct five-digit zip codes, in increasing order
+    '''
+    zips = np.sort(rng.choice(np.arange(1000, 100000), n_zips, replace=False))
+    return ["{:05d}".format(z) for z in zips]
+
+
+def synthetic_ts(n_zips=5000, n_weeks=60, seed=0):
+    '''
+    Draws a synthetic time series panel
+
+    Inputs:
+        n_zips (int): number of zip codes
+        n_weeks (int): number of weeks
+        seed (int): seed of the random generator
+    Returns:
+        pandas DataFrame with the case columns of ts_database, one row by
+        zip code and week
+    '''
+    rng = np.random.default_rng(seed)
+    zips = draw_zips(rng, n_zips)
+    population = (rng.lognormal(9.5, 1.0, n_zips) + 100).astype("int64")
+    week_end = pd.date_range(FIRST_WEEK_END, periods=n_weeks, freq="W-SAT")
+
+    weeks = np.arange(n_weeks)
+    growth = rng.normal(0.05, 0.05, n_zips)
+    change = rng.normal(-0.1, 0.05, n_zips)
+    breaks = rng.integers(n_weeks // 5, n_weeks - n_weeks // 5, n_zips)
+    log_rate = (np.log(50) + growth[:, None] * weeks
+                + change[:, None] * np.maximum(0, weeks - breaks[:, None]))
+    # expected weekly cases, from a rate per 100,000 capped at 5%
+    expected = (population[:, None]
+                * np.exp(np.minimum(log_rate, np.log(5000))) / 100000)
+
+    cases = rng.poisson(expected)
+    tests = cases + rng.poisson(expected * 10 + population[:, None] * 0.02)
+    deaths = rng.binomial(cases, 0.01)
+
+    calendar = week_end.isocalendar()
+    df = pd.DataFrame({
+        "zip_code": np.repeat(zips, n_weeks),
+        "week_number": np.tile(calendar["week"].to_numpy(), n_zips),
+        "week_end": np.tile(week_end, n_zips),
+        "year": np.tile(calendar["year"].to_numpy(), n_zips),
+        "population": np.repeat(population, n_weeks),
+        "cases_weekly": cases.ravel(),
+        "tests_weekly": tests.ravel(),
+        "deaths_weekly": deaths.ravel()})
+
+    per_100k = 100000 / df["population"]
+    df["case_rate_weekly"] = df["cases_weekly"] * per_100k
+    df["test_rate_weekly"] = df["tests_weekly"] * per_100k
+    df["death_rate_weekly"] = df["deaths_weekly"] * per_100k
+    df["percent_tested_positive_weekly"] = (df["cases_weekly"]
+                                            / df["tests_weekly"])
+    return schema.apply_schema(df, "ts")
+
+
+def synthetic_locations(n_zips=5000, seed=0):
+    '''
+    Draws the centroids of the zip codes of synthetic_ts
+
+    Inputs:
+        n_zips (int): number of zip codes
+        seed (int): seed of the random generator, as in synthetic_ts
+    Returns:
+        pandas DataFrame with the columns of zip_locations_database
+    '''
+    zips = draw_zips(np.random.default_rng(seed), n_zips)
+    rng = np.random.default_rng([seed, 1])
+    n_metros = max(1, n_zips // ZIPS_PER_METRO)
+    metro = rng.integers(0, n_metros, n_zips)
+    centers = np.column_stack([rng.uniform(*LATITUDES, n_metros),
+                               rng.uniform(*LONGITUDES, n_metros)])
+    points = centers[metro] + rng.normal(0, METRO_DEGREES, (n_zips, 2))
+    df = pd.DataFrame({"zip_code": zips,
+                       "latitude": points[:, 0],
+                       "longitude": points[:, 1]})
+    return schema.apply_schema(df, "zip_locations")